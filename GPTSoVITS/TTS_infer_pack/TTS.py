@@ -35,6 +35,8 @@ from tools.i18n.i18n import I18nAuto, scan_language_list
 from tools.my_utils import load_audio
 from TTS_infer_pack.text_segmentation_method import splits
 from TTS_infer_pack.TextPreprocessor import TextPreprocessor
+from TTS_infer_pack.ref_cache import RefPromptCache, file_digest
+from TTS_infer_pack.g2p_cache import G2PCache
 from sv import SV
 resample_transform_dict={}
 def resample(audio_tensor, sr0,sr1,device):
@@ -349,6 +351,15 @@ class TTS_Config:
         self.win_length: int = 2048
         self.n_speakers: int = 300
 
+        # 参考音频特征缓存 (TTS_infer_pack/ref_cache.py)，多音色 API 切换音色时不用重新计算
+        self.ref_cache_device_mb: float = self.configs.get("ref_cache_device_mb", 512)
+        self.ref_cache_host_mb: float = self.configs.get("ref_cache_host_mb", 1024)
+        self.ref_cache_dir: str = self.configs.get("ref_cache_dir", None)
+        # 分句 G2P / BERT 特征缓存 (TTS_infer_pack/g2p_cache.py)
+        self.g2p_cache_size: int = self.configs.get("g2p_cache_size", 20000)
+        self.bert_cache_size: int = self.configs.get("bert_cache_size", 2000)
+        self.g2p_cache_path: str = self.configs.get("g2p_cache_path", None)
+
     def _load_configs(self, configs_path: str) -> dict:
         if os.path.exists(configs_path):
             ...
@@ -432,7 +443,10 @@ class TTS:
         self._init_models()
 
         self.text_preprocessor: TextPreprocessor = TextPreprocessor(
-            self.bert_model, self.bert_tokenizer, self.configs.device
+            self.bert_model,
+            self.bert_tokenizer,
+            self.configs.device,
+            G2PCache(self.configs.g2p_cache_size, self.configs.bert_cache_size, self.configs.g2p_cache_path),
         )
 
         self.prompt_cache: dict = {
@@ -445,7 +459,11 @@ class TTS:
             "bert_features": None,
             "norm_text": None,
             "aux_ref_audio_paths": [],
+            "sv_emb": [],
         }
+        self.ref_cache = RefPromptCache(
+            self.configs.ref_cache_device_mb, self.configs.ref_cache_host_mb, self.configs.ref_cache_dir
+        )
 
         self.stop_flag: bool = False
         self.precision: torch.dtype = torch.float16 if self.configs.is_half else torch.float32
@@ -461,6 +479,7 @@ class TTS:
 
     def init_cnhuhbert_weights(self, base_path: str):
         print(f"Loading CNHuBERT weights from {base_path}")
+        self.configs.cnhuhbert_base_path = base_path
         self.cnhuhbert_model = CNHubert(base_path)
         self.cnhuhbert_model = self.cnhuhbert_model.eval()
         self.cnhuhbert_model = self.cnhuhbert_model.to(self.configs.device)
@@ -469,6 +488,7 @@ class TTS:
 
     def init_bert_weights(self, base_path: str):
         print(f"Loading BERT weights from {base_path}")
+        self.configs.bert_base_path = base_path
         self.bert_tokenizer = AutoTokenizer.from_pretrained(base_path)
         self.bert_model = AutoModelForMaskedLM.from_pretrained(base_path)
         self.bert_model = self.bert_model.eval()
@@ -737,18 +757,41 @@ class TTS:
     def _set_ref_audio_path(self, ref_audio_path):
         self.prompt_cache["ref_audio_path"] = ref_audio_path
 
+    def _ref_cache_key(self, kind: str, *parts) -> tuple:
+        """reference cache key: (kind, ..., model version, precision, device)"""
+        model_key = f"{self.configs.version}|{self.configs.vits_weights_path}"
+        # prompt BERT 特征和 semantic token 分别还依赖 BERT / CNHuBERT 权重
+        if kind == "text":
+            model_key += f"|{self.configs.bert_base_path}"
+        elif kind == "semantic":
+            model_key += f"|{self.configs.cnhuhbert_base_path}"
+        return (kind, *parts, model_key, str(self.precision), str(self.configs.device))
+
     def _set_ref_spec(self, ref_audio_path):
-        spec_audio = self._get_ref_spec(ref_audio_path)
+        entry = self._get_ref_entry(ref_audio_path)
+        self.prompt_cache["raw_audio"] = entry["raw_audio"]
+        self.prompt_cache["raw_sr"] = entry["raw_sr"]
         if self.prompt_cache["refer_spec"] in [[], None]:
-            self.prompt_cache["refer_spec"] = [spec_audio]
+            self.prompt_cache["refer_spec"] = [entry["refer_spec"]]
+            self.prompt_cache["sv_emb"] = [entry["sv_emb"]]
         else:
-            self.prompt_cache["refer_spec"][0] = spec_audio
+            self.prompt_cache["refer_spec"][0] = entry["refer_spec"]
+            self.prompt_cache["sv_emb"][0] = entry["sv_emb"]
 
     def _get_ref_spec(self, ref_audio_path):
+        return self._get_ref_entry(ref_audio_path)["refer_spec"]
+
+    def _get_ref_entry(self, ref_audio_path) -> dict:
+        """refer spec / 16k audio / SV embedding / raw audio of a reference, computed once per (file, model, precision)"""
+        return self.ref_cache.get_or_compute(
+            self._ref_cache_key("spec", file_digest(ref_audio_path)),
+            lambda: self._compute_ref_entry(ref_audio_path),
+            self.configs.device,
+        )
+
+    def _compute_ref_entry(self, ref_audio_path) -> dict:
         raw_audio, raw_sr = torchaudio.load(ref_audio_path)
         raw_audio = raw_audio.to(self.configs.device).float()
-        self.prompt_cache["raw_audio"] = raw_audio
-        self.prompt_cache["raw_sr"] = raw_sr
 
         if raw_sr != self.configs.sampling_rate:
             audio = raw_audio.to(self.configs.device)
@@ -771,14 +814,24 @@ class TTS:
         )
         if self.configs.is_half:
             spec = spec.half()
+        sv_emb = None
         if self.is_v2pro == True:
             audio = resample(audio, self.configs.sampling_rate, 16000, self.configs.device)
             if self.configs.is_half:
                 audio = audio.half()
+            sv_emb = self.sv_model.compute_embedding3(audio)
         else:audio=None
-        return spec,audio
+        return {"refer_spec": (spec, audio), "sv_emb": sv_emb, "raw_audio": raw_audio, "raw_sr": raw_sr}
 
     def _set_prompt_semantic(self, ref_wav_path: str):
+        entry = self.ref_cache.get_or_compute(
+            self._ref_cache_key("semantic", file_digest(ref_wav_path)),
+            lambda: {"prompt_semantic": self._compute_prompt_semantic(ref_wav_path)},
+            self.configs.device,
+        )
+        self.prompt_cache["prompt_semantic"] = entry["prompt_semantic"]
+
+    def _compute_prompt_semantic(self, ref_wav_path: str) -> torch.Tensor:
         zero_wav = np.zeros(
             int(self.configs.sampling_rate * 0.3),
             dtype=np.float16 if self.configs.is_half else np.float32,
@@ -801,8 +854,7 @@ class TTS:
             )  # .float()
             codes = self.vits_model.extract_latent(hubert_feature)
 
-            prompt_semantic = codes[0, 0].to(self.configs.device)
-            self.prompt_cache["prompt_semantic"] = prompt_semantic
+            return codes[0, 0].to(self.configs.device)
 
     def batch_sequences(self, sequences: List[torch.Tensor], axis: int = 0, pad_value: int = 0, max_length: int = None):
         seq = sequences[0]
@@ -1083,28 +1135,40 @@ class TTS:
         if not (len(list(paths)) == len(aux_ref_audio_paths) == len(self.prompt_cache["aux_ref_audio_paths"])):
             self.prompt_cache["aux_ref_audio_paths"] = aux_ref_audio_paths
             self.prompt_cache["refer_spec"] = [self.prompt_cache["refer_spec"][0]]
+            self.prompt_cache["sv_emb"] = [self.prompt_cache["sv_emb"][0]]
             for path in aux_ref_audio_paths:
                 if path in [None, ""]:
                     continue
                 if not os.path.exists(path):
                     print(i18n("音频文件不存在，跳过："), path)
                     continue
-                self.prompt_cache["refer_spec"].append(self._get_ref_spec(path))
+                entry = self._get_ref_entry(path)
+                self.prompt_cache["refer_spec"].append(entry["refer_spec"])
+                self.prompt_cache["sv_emb"].append(entry["sv_emb"])
 
         if not no_prompt_text:
             prompt_text = prompt_text.strip("\n")
             if prompt_text[-1] not in splits:
                 prompt_text += "。" if prompt_lang != "en" else "."
             print(i18n("实际输入的参考文本:"), prompt_text)
-            if self.prompt_cache["prompt_text"] != prompt_text:
-                phones, bert_features, norm_text = self.text_preprocessor.segment_and_extract_feature_for_text(
-                    prompt_text, prompt_lang, self.configs.version
+            if self.prompt_cache["prompt_text"] != prompt_text or self.prompt_cache["prompt_lang"] != prompt_lang:
+                entry = self.ref_cache.get_or_compute(
+                    self._ref_cache_key("text", prompt_text, prompt_lang),
+                    lambda: dict(
+                        zip(
+                            ("phones", "bert_features", "norm_text"),
+                            self.text_preprocessor.segment_and_extract_feature_for_text(
+                                prompt_text, prompt_lang, self.configs.version
+                            ),
+                        )
+                    ),
+                    self.configs.device,
                 )
                 self.prompt_cache["prompt_text"] = prompt_text
                 self.prompt_cache["prompt_lang"] = prompt_lang
-                self.prompt_cache["phones"] = phones
-                self.prompt_cache["bert_features"] = bert_features
-                self.prompt_cache["norm_text"] = norm_text
+                self.prompt_cache["phones"] = entry["phones"]
+                self.prompt_cache["bert_features"] = entry["bert_features"]
+                self.prompt_cache["norm_text"] = entry["norm_text"]
 
         ###### text preprocessing ########
         t1 = time.perf_counter()
@@ -1212,12 +1276,11 @@ class TTS:
                 t_34 += t4 - t3
 
                 refer_audio_spec = []
-                if self.is_v2pro:sv_emb=[]
+                # SV embedding 已在参考音频缓存里算好
+                if self.is_v2pro:sv_emb=list(self.prompt_cache["sv_emb"])
                 for spec,audio_tensor in self.prompt_cache["refer_spec"]:
                     spec=spec.to(dtype=self.precision, device=self.configs.device)
                     refer_audio_spec.append(spec)
-                    if self.is_v2pro:
-                        sv_emb.append(self.sv_model.compute_embedding3(audio_tensor))
 
                 batch_audio_fragment = []
 
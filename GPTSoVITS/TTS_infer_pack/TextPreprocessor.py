@@ -16,6 +16,7 @@ from text.cleaner import clean_text
 from text import cleaned_text_to_sequence
 from transformers import AutoModelForMaskedLM, AutoTokenizer
 from TTS_infer_pack.text_segmentation_method import split_big_text, splits, get_method as get_seg_method
+from TTS_infer_pack.g2p_cache import G2PCache
 
 from tools.i18n.i18n import I18nAuto, scan_language_list
 
@@ -49,12 +50,29 @@ def merge_short_text_in_array(texts: str, threshold: int) -> list:
     return result
 
 
+class _StopForward(Exception):
+    pass
+
+
 class TextPreprocessor:
-    def __init__(self, bert_model: AutoModelForMaskedLM, tokenizer: AutoTokenizer, device: torch.device):
+    # 用 BERT 倒数第三层 (hidden_states[-3]) 作文本特征
+    bert_hidden_layer: int = -3
+    # BERT 批处理每桶最多多少 token (句数 x 最长句 token 数)
+    bert_batch_tokens: int = 4096
+
+    def __init__(
+        self,
+        bert_model: AutoModelForMaskedLM,
+        tokenizer: AutoTokenizer,
+        device: torch.device,
+        g2p_cache: G2PCache = None,
+    ):
         self.bert_model = bert_model
         self.tokenizer = tokenizer
         self.device = device
         self.bert_lock = threading.RLock()
+        # 分句的 G2P 结果和 BERT 特征缓存 (重复的句子不用再算)
+        self.g2p_cache: G2PCache = g2p_cache if g2p_cache is not None else G2PCache()
 
     def preprocess(self, text: str, lang: str, text_split_method: str, version: str = "v2") -> List[Dict]:
         print(f"############ {i18n('切分文本')} ############")
@@ -62,13 +80,16 @@ class TextPreprocessor:
         texts = self.pre_seg_text(text, lang, text_split_method)
         result = []
         print(f"############ {i18n('提取文本Bert特征')} ############")
-        for text in tqdm(texts):
-            phones, bert_features, norm_text = self.segment_and_extract_feature_for_text(text, lang, version)
+        with self.bert_lock:
+            # 先做完所有分句的 G2P，再把全部中文片段按长度分桶，几次 BERT forward 算完
+            plans = [self._plan_phones(text, lang, version) for text in tqdm(texts)]
+            self._fill_bert_features([part for parts, _, _ in plans for part in parts])
+        for parts, phones, norm_text in plans:
             if phones is None or norm_text == "":
                 continue
             res = {
                 "phones": phones,
-                "bert_features": bert_features,
+                "bert_features": self._join_bert(parts),
                 "norm_text": norm_text,
             }
             result.append(res)
@@ -121,88 +142,169 @@ class TextPreprocessor:
 
     def get_phones_and_bert(self, text: str, language: str, version: str, final: bool = False):
         with self.bert_lock:
-            if language in {"en", "all_zh", "all_ja", "all_ko", "all_yue"}:
-                # language = language.replace("all_","")
-                formattext = text
-                while "  " in formattext:
-                    formattext = formattext.replace("  ", " ")
-                if language == "all_zh":
-                    if re.search(r"[A-Za-z]", formattext):
-                        formattext = re.sub(r"[a-z]", lambda x: x.group(0).upper(), formattext)
-                        formattext = chinese.mix_text_normalize(formattext)
-                        return self.get_phones_and_bert(formattext, "zh", version)
-                    else:
-                        phones, word2ph, norm_text = self.clean_text_inf(formattext, language, version)
-                        bert = self.get_bert_feature(norm_text, word2ph).to(self.device)
-                elif language == "all_yue" and re.search(r"[A-Za-z]", formattext):
+            parts, phones, norm_text = self._plan_phones(text, language, version, final)
+            self._fill_bert_features(parts)
+            return phones, self._join_bert(parts), norm_text
+
+    def _plan_phones(self, text: str, language: str, version: str, final: bool = False):
+        """
+        get_phones_and_bert 的 G2P 部分：返回 (parts, phones, norm_text)，
+        parts 每段是 {"phones", "word2ph", "norm_text", "zh"}，zh 的段之后由 _fill_bert_features 批量补上 BERT 特征
+        """
+        if language in {"en", "all_zh", "all_ja", "all_ko", "all_yue"}:
+            # language = language.replace("all_","")
+            formattext = text
+            while "  " in formattext:
+                formattext = formattext.replace("  ", " ")
+            if language == "all_zh":
+                if re.search(r"[A-Za-z]", formattext):
                     formattext = re.sub(r"[a-z]", lambda x: x.group(0).upper(), formattext)
                     formattext = chinese.mix_text_normalize(formattext)
-                    return self.get_phones_and_bert(formattext, "yue", version)
+                    return self._plan_phones(formattext, "zh", version)
                 else:
                     phones, word2ph, norm_text = self.clean_text_inf(formattext, language, version)
-                    bert = torch.zeros(
-                        (1024, len(phones)),
-                        dtype=torch.float32,
-                    ).to(self.device)
-            elif language in {"zh", "ja", "ko", "yue", "auto", "auto_yue"}:
-                textlist = []
-                langlist = []
-                if language == "auto":
-                    for tmp in LangSegmenter.getTexts(text):
-                        langlist.append(tmp["lang"])
-                        textlist.append(tmp["text"])
-                elif language == "auto_yue":
-                    for tmp in LangSegmenter.getTexts(text):
-                        if tmp["lang"] == "zh":
-                            tmp["lang"] = "yue"
+                    parts = [{"phones": phones, "word2ph": word2ph, "norm_text": norm_text, "zh": True}]
+            elif language == "all_yue" and re.search(r"[A-Za-z]", formattext):
+                formattext = re.sub(r"[a-z]", lambda x: x.group(0).upper(), formattext)
+                formattext = chinese.mix_text_normalize(formattext)
+                return self._plan_phones(formattext, "yue", version)
+            else:
+                phones, word2ph, norm_text = self.clean_text_inf(formattext, language, version)
+                parts = [{"phones": phones, "word2ph": word2ph, "norm_text": norm_text, "zh": False}]
+        elif language in {"zh", "ja", "ko", "yue", "auto", "auto_yue"}:
+            textlist = []
+            langlist = []
+            if language == "auto":
+                for tmp in LangSegmenter.getTexts(text):
+                    langlist.append(tmp["lang"])
+                    textlist.append(tmp["text"])
+            elif language == "auto_yue":
+                for tmp in LangSegmenter.getTexts(text):
+                    if tmp["lang"] == "zh":
+                        tmp["lang"] = "yue"
+                    langlist.append(tmp["lang"])
+                    textlist.append(tmp["text"])
+            else:
+                for tmp in LangSegmenter.getTexts(text):
+                    if tmp["lang"] == "en":
                         langlist.append(tmp["lang"])
-                        textlist.append(tmp["text"])
-                else:
-                    for tmp in LangSegmenter.getTexts(text):
-                        if tmp["lang"] == "en":
-                            langlist.append(tmp["lang"])
-                        else:
-                            # 因无法区别中日韩文汉字,以用户输入为准
-                            langlist.append(language)
-                        textlist.append(tmp["text"])
-                # print(textlist)
-                # print(langlist)
-                phones_list = []
-                bert_list = []
-                norm_text_list = []
-                for i in range(len(textlist)):
-                    lang = langlist[i]
-                    phones, word2ph, norm_text = self.clean_text_inf(textlist[i], lang, version)
-                    bert = self.get_bert_inf(phones, word2ph, norm_text, lang)
-                    phones_list.append(phones)
-                    norm_text_list.append(norm_text)
-                    bert_list.append(bert)
-                bert = torch.cat(bert_list, dim=1)
-                phones = sum(phones_list, [])
-                norm_text = "".join(norm_text_list)
-
-            if not final and len(phones) < 6:
-                return self.get_phones_and_bert("." + text, language, version, final=True)
-
-            return phones, bert, norm_text
+                    else:
+                        # 因无法区别中日韩文汉字,以用户输入为准
+                        langlist.append(language)
+                    textlist.append(tmp["text"])
+            # print(textlist)
+            # print(langlist)
+            parts = []
+            for i in range(len(textlist)):
+                lang = langlist[i]
+                phones, word2ph, norm_text = self.clean_text_inf(textlist[i], lang, version)
+                parts.append(
+                    {"phones": phones, "word2ph": word2ph, "norm_text": norm_text, "zh": lang.replace("all_", "") == "zh"}
+                )
+            phones = sum([part["phones"] for part in parts], [])
+            norm_text = "".join([part["norm_text"] for part in parts])
+
+        if not final and len(phones) < 6:
+            return self._plan_phones("." + text, language, version, final=True)
+
+        return parts, phones, norm_text
+
+    def _fill_bert_features(self, parts: List[dict]):
+        """所有 zh 段的 BERT 特征一次过算 (按长度分桶 batch)，其余段补零"""
+        zh_parts = [part for part in parts if part["zh"]]
+        features = self._bert_features([(part["norm_text"], part["word2ph"]) for part in zh_parts])
+        for part, feature in zip(zh_parts, features):
+            part["bert"] = feature
+        for part in parts:
+            if not part["zh"]:
+                part["bert"] = torch.zeros(
+                    (1024, len(part["phones"])),
+                    dtype=torch.float32,
+                ).to(self.device)
+
+    @staticmethod
+    def _join_bert(parts: List[dict]) -> torch.Tensor:
+        return torch.cat([part["bert"] for part in parts], dim=1)
 
     def get_bert_feature(self, text: str, word2ph: list) -> torch.Tensor:
+        return self._bert_features([(text, word2ph)])[0]
+
+    def _bert_features(self, items: List[Tuple[str, list]]) -> List[torch.Tensor]:
+        """
+        [(norm_text, word2ph), ...] -> 每段 phone 级 BERT 特征 (1024, sum(word2ph))，结果留在 device 上。
+        按长度排序分桶，每桶 pad 成一个 batch 做一次 forward，phone 级展开整桶一次 repeat_interleave。
+        """
+        results = [None] * len(items)
+        tag = self._bert_cache_tag()
+        for i, (text, word2ph) in enumerate(items):
+            results[i] = self.g2p_cache.get_bert(text, word2ph, tag)
+        order = sorted([i for i in range(len(items)) if results[i] is None], key=lambda i: len(items[i][0]))
+        for batch in self._length_buckets([len(items[i][0]) + 2 for i in order], order):
+            hidden = self._bert_hidden([items[i][0] for i in batch])
+            # 每句去掉 [CLS]，只取 len(text) 个字的特征 (之后是 [SEP] 和 padding)
+            valid = torch.zeros(hidden.shape[:2], dtype=torch.bool, device=hidden.device)
+            for j, i in enumerate(batch):
+                text, word2ph = items[i]
+                assert len(word2ph) == len(text)
+                valid[j, 1 : 1 + len(text)] = True
+            repeats = torch.tensor(sum([items[i][1] for i in batch], []), dtype=torch.long, device=hidden.device)
+            phone_level_feature = hidden[valid].repeat_interleave(repeats, dim=0)
+            for i, feature in zip(batch, phone_level_feature.split([sum(items[i][1]) for i in batch])):
+                results[i] = feature.T
+                self.g2p_cache.put_bert(items[i][0], items[i][1], tag, results[i])
+        return results
+
+    def _bert_cache_tag(self) -> tuple:
+        """BERT 特征缓存要区分模型 / 精度 / device"""
+        dtype = next(self.bert_model.parameters()).dtype
+        return (getattr(self.bert_model, "name_or_path", ""), str(dtype), str(self.device))
+
+    def _length_buckets(self, lengths: List[int], order: List[int]) -> List[List[int]]:
+        """lengths 已按升序排好；每桶 (句数 x 最长 token 数) 不超过 bert_batch_tokens"""
+        buckets, bucket = [], []
+        for length, i in zip(lengths, order):
+            if bucket and (len(bucket) + 1) * length > self.bert_batch_tokens:
+                buckets.append(bucket)
+                bucket = []
+            bucket.append(i)
+        if bucket:
+            buckets.append(bucket)
+        return buckets
+
+    def _bert_hidden(self, texts: List[str]) -> torch.Tensor:
+        """
+        只跑到需要的那一层 (hidden_states[bert_hidden_layer])：
+        用 forward hook 取该层输出后提前结束，后面几层和 MLM head 都不算。返回 (B, T, hidden)
+        """
         with torch.no_grad():
-            inputs = self.tokenizer(text, return_tensors="pt")
+            inputs = self.tokenizer(texts, return_tensors="pt", padding=True)
             for i in inputs:
                 inputs[i] = inputs[i].to(self.device)
-            res = self.bert_model(**inputs, output_hidden_states=True)
-            res = torch.cat(res["hidden_states"][-3:-2], -1)[0].cpu()[1:-1]
-        assert len(word2ph) == len(text)
-        phone_level_feature = []
-        for i in range(len(word2ph)):
-            repeat_feature = res[i].repeat(word2ph[i], 1)
-            phone_level_feature.append(repeat_feature)
-        phone_level_feature = torch.cat(phone_level_feature, dim=0)
-        return phone_level_feature.T
+            base_model = self.bert_model.base_model
+            layers = base_model.encoder.layer
+            # hidden_states[0] 是 embedding 输出，hidden_states[k] 是第 k 层 (layers[k - 1]) 的输出
+            target = layers[len(layers) + self.bert_hidden_layer]
+            captured = {}
+
+            def hook(module, args, output):
+                captured["hidden"] = output[0] if isinstance(output, tuple) else output
+                raise _StopForward()
+
+            handle = target.register_forward_hook(hook)
+            try:
+                base_model(**inputs)
+            except _StopForward:
+                pass
+            finally:
+                handle.remove()
+        return captured["hidden"]
 
     def clean_text_inf(self, text: str, language: str, version: str = "v2"):
         language = language.replace("all_", "")
+        return self.g2p_cache.get_g2p(text, language, version, lambda: self._clean_text(text, language, version))
+
+    @staticmethod
+    def _clean_text(text: str, language: str, version: str):
         phones, word2ph, norm_text = clean_text(text, language, version)
         phones = cleaned_text_to_sequence(phones, version)
         return phones, word2ph, norm_text
@@ -0,0 +1,185 @@
+import atexit
+import hashlib
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, List, Optional
+
+import torch
+
+import text
+
+# G2P 结果依赖的词典文件，变了就清掉 G2P 缓存 (BERT 特征只依赖 norm_text / word2ph，不受影响)
+DICT_FILES = [
+    os.path.join(os.path.dirname(text.__file__), "engdict-hot.rep"),
+    os.path.join(os.path.dirname(text.__file__), "g2pw", "polyphonic-fix.rep"),
+]
+
+
+def reload_dicts():
+    """
+    重新加载已经 import 的 G2P 模块的词典 (en_G2p.cmu / g2pw.pp_dict 都只在 import 时读一次)，
+    只清缓存的话重新计算出来的还是旧读音。没 import 的模块以后 import 时自然读到新词典
+    """
+    english = sys.modules.get("text.english")
+    if english is not None:
+        english._g2p.reload_dict()
+    g2pw = sys.modules.get("text.g2pw.g2pw")
+    if g2pw is not None:
+        g2pw.reload_dict()
+
+
+def dict_fingerprint(paths: List[str]) -> str:
+    h = hashlib.sha1()
+    for path in paths:
+        try:
+            st = os.stat(path)
+            h.update(f"{path}:{st.st_mtime_ns}:{st.st_size};".encode("utf-8"))
+        except FileNotFoundError:
+            h.update(f"{path}:missing;".encode("utf-8"))
+    return h.hexdigest()
+
+
+class _LRU:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[tuple, object]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key: tuple, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+class G2PCache:
+    """
+    Bounded, thread-safe memo of text processing results, so repeated phrases (prompts, greetings, UI strings)
+    skip normalization + G2P (jieba/g2pw, pyopenjtalk, jyutping, g2p_en) and the BERT forward:
+      - g2p:  (text, language, version) -> (phones, word2ph, norm_text)   (clean_text_inf 的结果)
+      - bert: (norm_text, word2ph, bert model tag) -> phone-level BERT feature
+    When the dictionary files (engdict-hot.rep / polyphonic-fix.rep) change, the loaded dictionaries are reloaded
+    and the G2P entries are dropped.
+    With persist_path set, both tables are loaded at start and saved at exit (or via save()).
+    """
+
+    # 词典文件最多每隔多少秒 stat 一次
+    DICT_CHECK_INTERVAL = 5.0
+
+    def __init__(
+        self,
+        max_g2p_entries: int = 20000,
+        max_bert_entries: int = 2000,
+        persist_path: Optional[str] = None,
+        dict_files: Optional[List[str]] = None,
+    ):
+        self.lock = threading.Lock()
+        self.g2p = _LRU(max_g2p_entries)
+        self.bert = _LRU(max_bert_entries)
+        self.persist_path = persist_path
+        self.dict_files = DICT_FILES if dict_files is None else dict_files
+        self.fingerprint = dict_fingerprint(self.dict_files)
+        self.invalidations = 0
+        self._last_check = time.monotonic()
+        if persist_path is not None:
+            self.load()
+            atexit.register(self.save)
+
+    def _check_dicts(self):
+        now = time.monotonic()
+        if now - self._last_check < self.DICT_CHECK_INTERVAL:
+            return
+        self._last_check = now
+        fingerprint = dict_fingerprint(self.dict_files)
+        if fingerprint != self.fingerprint:
+            self.fingerprint = fingerprint
+            try:
+                reload_dicts()
+            except Exception as e:
+                print(f"Failed to reload G2P dictionaries: {e}")
+            self.g2p.entries.clear()
+            self.invalidations += 1
+
+    def get_g2p(self, text: str, language: str, version: str, compute: Callable[[], tuple]) -> tuple:
+        key = (text, language, version)
+        with self.lock:
+            self._check_dicts()
+            value = self.g2p.get(key)
+        if value is None:
+            value = compute()
+            with self.lock:
+                self.g2p.put(key, value)
+        phones, word2ph, norm_text = value
+        # 返回副本，调用方改 list 不会污染缓存
+        return list(phones), None if word2ph is None else list(word2ph), norm_text
+
+    def get_bert(self, norm_text: str, word2ph: list, tag: tuple) -> Optional[torch.Tensor]:
+        with self.lock:
+            return self.bert.get((norm_text, tuple(word2ph), tag))
+
+    def put_bert(self, norm_text: str, word2ph: list, tag: tuple, feature: torch.Tensor):
+        with self.lock:
+            self.bert.put((norm_text, tuple(word2ph), tag), feature)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"g2p": self.g2p.stats(), "bert": self.bert.stats(), "invalidations": self.invalidations}
+
+    def save(self, path: Optional[str] = None):
+        path = path or self.persist_path
+        if path is None:
+            return
+        with self.lock:
+            data = {
+                "fingerprint": self.fingerprint,
+                "g2p": list(self.g2p.entries.items()),
+                "bert": [(k, v.detach().cpu()) for k, v in self.bert.entries.items()],
+            }
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp = path + ".tmp"
+        torch.save(data, tmp)
+        os.replace(tmp, path)
+
+    def load(self, path: Optional[str] = None):
+        path = path or self.persist_path
+        if path is None or not os.path.exists(path):
+            return
+        try:
+            data = torch.load(path, map_location="cpu")
+        except Exception as e:
+            print(f"Failed to load G2P cache {path}: {e}")
+            return
+        with self.lock:
+            # 词典改过的话只保留 BERT 特征
+            if data.get("fingerprint") == self.fingerprint:
+                for key, value in data["g2p"]:
+                    self.g2p.put(tuple(key), tuple(value))
+            else:
+                self.invalidations += 1
+            for key, feature in data["bert"]:
+                # tag 里有 device，加载时放回原来的 device
+                try:
+                    self.bert.put(tuple(key), feature.to(key[2][2]))
+                except (RuntimeError, AssertionError):
+                    continue
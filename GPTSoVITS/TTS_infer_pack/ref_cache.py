@@ -0,0 +1,152 @@
+import hashlib
+import os
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Callable, Optional
+
+import torch
+
+
+@lru_cache(maxsize=1024)
+def _file_digest(path: str, mtime_ns: int, size: int) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def file_digest(path: str) -> str:
+    """
+    Content hash of a reference audio file.
+    The same file under another path shares cache entries; an edited file gets a new key.
+    (memoized on path + mtime + size, so switching back and forth between voices does not re-read the file)
+    """
+    st = os.stat(path)
+    return _file_digest(os.path.abspath(path), st.st_mtime_ns, st.st_size)
+
+
+def _tensors(value):
+    if isinstance(value, torch.Tensor):
+        yield value
+    elif isinstance(value, dict):
+        for v in value.values():
+            yield from _tensors(v)
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            yield from _tensors(v)
+
+
+def _map_tensors(value, fn):
+    if isinstance(value, torch.Tensor):
+        return fn(value)
+    if isinstance(value, dict):
+        return {k: _map_tensors(v, fn) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(_map_tensors(v, fn) for v in value)
+    return value
+
+
+def _sizeof(value) -> tuple:
+    """(device bytes, host bytes) held by the tensors of an entry"""
+    device_bytes, host_bytes = 0, 0
+    for t in _tensors(value):
+        if t.device.type == "cpu":
+            host_bytes += t.element_size() * t.nelement()
+        else:
+            device_bytes += t.element_size() * t.nelement()
+    return device_bytes, host_bytes
+
+
+class RefPromptCache:
+    """
+    LRU cache for reference prompt features (prompt semantic tokens, refer spec, SV embedding, prompt phones / BERT),
+    so an API serving many voices does not recompute CNHuBERT / spectrogram / SV for every voice switch.
+    Keys are tuples such as ("semantic", file hash, model version, precision).
+    Entries are evicted least-recently-used first once either the device (VRAM) or host (RAM) budget is exceeded.
+    With persist_dir set, entries are also written to disk and reloaded on a memory miss (survives restarts).
+    """
+
+    def __init__(self, max_device_mb: float = 512, max_host_mb: float = 1024, persist_dir: Optional[str] = None):
+        self.max_device_bytes = int(max_device_mb * 1024**2)
+        self.max_host_bytes = int(max_host_mb * 1024**2)
+        self.persist_dir = persist_dir
+        if persist_dir is not None:
+            os.makedirs(persist_dir, exist_ok=True)
+        self.entries: "OrderedDict[tuple, dict]" = OrderedDict()
+        self.sizes: dict = {}
+        self.device_bytes = 0
+        self.host_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _disk_path(self, key: tuple) -> str:
+        return os.path.join(self.persist_dir, hashlib.sha1(repr(key).encode("utf-8")).hexdigest() + ".pt")
+
+    def get(self, key: tuple, device=None) -> Optional[dict]:
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+        if self.persist_dir is not None and os.path.exists(self._disk_path(key)):
+            try:
+                value = torch.load(self._disk_path(key), map_location=device or "cpu")
+            except Exception as e:
+                print(f"Failed to load reference cache file {self._disk_path(key)}: {e}")
+            else:
+                self.disk_hits += 1
+                self._insert(key, value)
+                return value
+        self.misses += 1
+        return None
+
+    def put(self, key: tuple, value: dict):
+        self._insert(key, value)
+        if self.persist_dir is not None:
+            path = self._disk_path(key)
+            tmp = path + ".tmp"
+            torch.save(_map_tensors(value, lambda t: t.detach().cpu()), tmp)
+            os.replace(tmp, path)
+
+    def get_or_compute(self, key: tuple, compute: Callable[[], dict], device=None) -> dict:
+        value = self.get(key, device)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def _insert(self, key: tuple, value: dict):
+        if key in self.entries:
+            self._remove(key)
+        self.entries[key] = value
+        self.sizes[key] = _sizeof(value)
+        self.device_bytes += self.sizes[key][0]
+        self.host_bytes += self.sizes[key][1]
+        while self.entries and (self.device_bytes > self.max_device_bytes or self.host_bytes > self.max_host_bytes):
+            self._remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def _remove(self, key: tuple):
+        self.entries.pop(key)
+        device_bytes, host_bytes = self.sizes.pop(key)
+        self.device_bytes -= device_bytes
+        self.host_bytes -= host_bytes
+
+    def clear(self):
+        """Drop the in-memory entries (on-disk entries are kept)"""
+        self.entries.clear()
+        self.sizes.clear()
+        self.device_bytes = self.host_bytes = 0
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "device_mb": round(self.device_bytes / 1024**2, 2),
+            "host_mb": round(self.host_bytes / 1024**2, 2),
+        }
@@ -252,13 +252,9 @@ class en_G2p(G2p):
         wordsegment.load()
 
         # 扩展过时字典, 添加姓名字典
-        self.cmu = get_dict()
+        self.reload_dict()
         self.namedict = get_namedict()
 
-        # 剔除读音错误的几个缩写
-        for word in ["AE", "AI", "AR", "IOS", "HUD", "OS"]:
-            del self.cmu[word.lower()]
-
         # 修正多音字
         self.homograph2features["read"] = (["R", "IY1", "D"], ["R", "EH1", "D"], "VBP")
         self.homograph2features["complex"] = (
@@ -267,6 +263,15 @@ class en_G2p(G2p):
             "JJ",
         )
 
+    def reload_dict(self):
+        """重新读取字典 (engdict-hot.rep 改动后调用)"""
+        cmu = get_dict()
+
+        # 剔除读音错误的几个缩写
+        for word in ["AE", "AI", "AR", "IOS", "HUD", "OS"]:
+            cmu.pop(word.lower(), None)
+        self.cmu = cmu
+
     def __call__(self, text):
         # tokenization
         words = word_tokenize(text)
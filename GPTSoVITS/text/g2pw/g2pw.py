@@ -125,6 +125,14 @@ def get_dict():
     return polyphonic_dict
 
 
+def reload_dict():
+    """polyphonic-fix.rep 改动后重建字典和 pickle 缓存 (原地更新，correct_pronunciation 立即生效)"""
+    polyphonic_dict = read_dict()
+    cache_dict(polyphonic_dict, CACHE_PATH)
+    pp_dict.clear()
+    pp_dict.update(polyphonic_dict)
+
+
 def read_dict():
     polyphonic_dict = {}
     with open(PP_DICT_PATH, encoding="utf-8") as f:
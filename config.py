@@ -9,7 +9,8 @@ class Config:
     dirs = {}
     
     docker_imgs = {
-        "UVR5": "uvr5"
+        "UVR5": "uvr5",
+        "ASR": "funasr",
     }
     
     # 基礎路徑設定
@@ -20,6 +21,103 @@ class Config:
     dirs["TRAIN_ROOT"] = _data_root / "train"
     dirs["TRAIN_INPUT"] = dirs["TRAIN_ROOT"] / "input"
     train_task_file = dirs["TRAIN_ROOT"] / ".task.json"
+    # 並行模式下每個執行中任務各自嘅追蹤檔
+    train_task_dir = dirs["TRAIN_ROOT"] / ".tasks"
+    # 任務索引 (SQLite)，記錄每個音頻嘅處理階段
+    task_index_file = dirs["TRAIN_ROOT"] / ".task_index.db"
+    # ffprobe 結果緩存
+    probe_cache_file = dirs["TRAIN_ROOT"] / ".probe_cache.json"
+
+    # 任務鎖定檔 (cron 模式有任務執行中時存在)，daemon 啟動時會等佢釋放
+    train_lock_file = Path("/tmp/tts_train.lock")
+    # daemon 模式嘅 PID 檔，cron 見到 daemon 行緊就唔再巡檢
+    train_daemon_pid_file = Path("/tmp/tts_train_daemon.pid")
+
+    # --- 並行調度 (daemon 模式) ---
+    # 每粒 GPU / CPU 最多同時行幾多個任務
+    gpu_slots = 2
+    cpu_slots = 2
+    # 各類任務嘅 VRAM 峰值 (GB)，0 代表只用 CPU
+    task_vram_gb = {
+        ("UVR5", "extract"): 6.0,   # BS-Roformer
+        ("UVR5", "dereverb"): 3.0,  # MDX-Net ONNX dereverb
+        ("UVR5", "deecho"): 2.5,    # VR DeEcho
+        ("UVR5", "chain"): 8.0,     # 三個模型同時留喺 VRAM (uvr5_chain_mode)
+        ("Slice_Audio", ""): 0.0,   # librosa / noisereduce，純 CPU
+        ("ASR", ""): 3.0,           # FunASR
+    }
+    # 每粒 GPU 預留嘅 VRAM (GB)，避免塞到爆
+    gpu_vram_margin_gb = 0.5
+
+    # --- UVR5 常駐 worker ---
+    # 開啟後 UVR5 任務交畀常駐 worker (模型唔使每次重新 load)，用唔到先退返一次性 docker run
+    uvr5_worker_enabled = True
+    # worker 閒置幾多秒後自動結束並釋放 VRAM
+    uvr5_worker_idle_timeout = 600
+    # 等 worker 就緒嘅最長時間 (秒)
+    uvr5_worker_start_timeout = 120
+    # worker container 名嘅前綴 (後面接設備，例如 tts_uvr5_worker_cuda0)；cron 檢查有冇任務行緊時唔計佢
+    uvr5_worker_container_prefix = "tts_uvr5_worker_"
+    # 本地替身指令 (唔經 Docker)，例如 ["python", "uvr5/worker.py", "--stub"]；None 就用 Docker
+    uvr5_worker_cmd = None
+    # extract 任務直接串連 extract → dereverb → deecho (中間 stem 留喺記憶體，只寫 vocal_main_vocal.wav)
+    uvr5_chain_mode = True
+    # chain 模式都保留 vocal.wav / main_vocal.wav (debug 用)
+    uvr5_chain_keep_intermediates = False
+    # 各階段用嘅模型 (要同 uvr5/worker.py DEFAULT_MODELS 一致)，亦係階段緩存 key 嘅一部分
+    uvr5_models = {
+        "extract": "model_bs_roformer_ep_317_sdr_12.9755",
+        "dereverb": "onnx_dereverb",
+        "deecho": "VR-DeEchoAggressive",
+    }
+
+    # --- 階段緩存 (內容定址) ---
+    stage_cache_enabled = True
+    stage_cache_dir = dirs["TRAIN_ROOT"] / ".stage_cache"
+    # 超過上限就按 LRU 淘汰 (GB)
+    stage_cache_max_gb = 50
+
+    # --- ASR 標註 (funASR container) ---
+    # 識別語言 (yue = 粵語 UniASR / zh = Paraformer)，亦係轉寫緩存 key 嘅一部分
+    asr_language = "yue"
+    # FunASR 批量模式每批總長 (秒)
+    asr_batch_size_s = 300
+    # 本地替身指令 (唔經 Docker)，例如 ["python", "funASR/asr/funasr_asr.py"]；None 就用 Docker
+    asr_local_cmd = None
+    # modelscope 模型緩存 (掛入 container，唔使每次重新下載)
+    asr_model_cache_dir = dirs["TRAIN_ROOT"] / ".modelscope"
+    # 逐個切片嘅轉寫緩存 (以內容 sha256 做 key)
+    asr_cache_enabled = True
+    transcript_cache_file = dirs["TRAIN_ROOT"] / ".transcript_cache.db"
+
+    # --- 成本模型調度 (task_scheduler.py) ---
+    # 冇歷史紀錄時嘅預設實時倍率 (音頻秒數 / 牆鐘秒數)，有 metrics 之後按模型用實測值
+    sched_default_rtf = {
+        ("UVR5", "extract"): 20.0,
+        ("UVR5", "dereverb"): 15.0,
+        ("UVR5", "deecho"): 25.0,
+        ("UVR5", "chain"): 8.0,
+        ("Slice_Audio", ""): 30.0,
+        ("ASR", ""): 40.0,
+    }
+    # probe 唔到長度時當幾長 (秒)
+    sched_default_duration_sec = 600
+    # 只用最近幾多日、每個模型最少幾多個任務嘅紀錄
+    sched_history_days = 14
+    sched_min_samples = 3
+    # 日間最多接受估計幾耐 (秒) 嘅分離任務，長過呢個留返夜間時段做
+    sched_day_heavy_max_sec = 600
+    # 排隊每 1 秒抵銷幾多秒估計耗時 (防止長任務餓死)
+    sched_aging = 0.5
+    # 用歷史 VRAM 峰值 (torch 配置) 估計時，額外預留俾 CUDA context 嘅 GB
+    sched_vram_overhead_gb = 0.8
+
+    # --- 量度 ---
+    metrics_enabled = True
+    # 每個任務一行 JSON (python metrics.py slowest / rtf 用)
+    metrics_file = dirs["TRAIN_ROOT"] / ".metrics.jsonl"
+    # Prometheus textfile (node_exporter --collector.textfile.directory 指去呢個目錄)
+    metrics_prom_file = dirs["TRAIN_ROOT"] / "metrics" / "tts_pipeline.prom"
     
 
     @staticmethod
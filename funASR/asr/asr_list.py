@@ -0,0 +1,44 @@
+import os
+
+
+class AsrListWriter:
+    """
+    逐批追加寫入 .list 標註檔 (格式: 音頻路徑|說話人|語言|文本)。
+    每批寫完即刻 fsync，崩潰都保留已完成嘅行；重新執行時讀返已有嘅行，跳過已轉寫嘅檔案。
+    """
+
+    def __init__(self, list_path):
+        self.list_path = os.path.abspath(list_path)
+        os.makedirs(os.path.dirname(self.list_path), exist_ok=True)
+        self.done = self._load_done()
+        self._f = open(self.list_path, "a", encoding="utf-8")
+
+    def _load_done(self):
+        if not os.path.exists(self.list_path):
+            return set()
+        with open(self.list_path, "rb") as f:
+            data = f.read()
+        # 最後一行冇換行 = 寫到一半就崩潰，截走佢等呢個檔重新轉寫
+        # (舊版一次過寫出嘅 .list 最後一行都冇換行，咁樣只係多轉寫一個檔)
+        if data and not data.endswith(b"\n"):
+            last_nl = data.rfind(b"\n")
+            with open(self.list_path, "r+b") as f:
+                f.truncate(last_nl + 1)
+            data = data[: last_nl + 1]
+        return {line.split("|", 1)[0] for line in data.decode("utf-8").splitlines() if line}
+
+    def write(self, lines):
+        if not lines:
+            return
+        self._f.write("".join(line + "\n" for line in lines))
+        self._f.flush()
+        os.fsync(self._f.fileno())
+
+    def close(self):
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
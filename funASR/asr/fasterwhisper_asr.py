@@ -1,14 +1,22 @@
 import argparse
 import os
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 
 os.environ["HF_ENDPOINT"] = "https://hf-mirror.com"
 os.environ["KMP_DUPLICATE_LIB_OK"] = "TRUE"
 
+import numpy as np
 import torch
-from faster_whisper import WhisperModel
+from faster_whisper import WhisperModel, decode_audio
+from faster_whisper.audio import pad_or_trim
+from faster_whisper.tokenizer import Tokenizer
+from faster_whisper.transcribe import get_ctranslate2_storage
+from faster_whisper.vad import VadOptions, get_speech_timestamps
 from tqdm import tqdm
 
+from asr_list import AsrListWriter
+
 from tools.asr.config import check_fw_local_models
 from tools.my_utils import load_cudnn
 
@@ -38,20 +46,27 @@ language_code_list = [
 # fmt: on
 
 
-def execute_asr(input_folder, output_folder, model_size, language, precision):
+def create_model(model_size, precision):
     if "-local" in model_size:
         model_size = model_size[:-6]
         model_path = f"tools/asr/models/faster-whisper-{model_size}"
     else:
         model_path = model_size
-    if language == "auto":
-        language = None  # 不设置语种由模型自动输出概率最高的语种
     print("loading faster whisper model:", model_size, model_path)
     device = "cuda" if torch.cuda.is_available() else "cpu"
     try:
-        model = WhisperModel(model_path, device=device, compute_type=precision)
+        return WhisperModel(model_path, device=device, compute_type=precision)
     except:
-        return print(traceback.format_exc())
+        print(traceback.format_exc())
+        return None
+
+
+def execute_asr(input_folder, output_folder, model_size, language, precision):
+    if language == "auto":
+        language = None  # 不设置语种由模型自动输出概率最高的语种
+    model = create_model(model_size, precision)
+    if model is None:
+        return None
 
     input_file_names = os.listdir(input_folder)
     input_file_names.sort()
@@ -94,6 +109,175 @@ def execute_asr(input_folder, output_folder, model_size, language, precision):
     return output_file_path
 
 
+# --- 批量模式 ---
+SAMPLE_RATE = 16000
+# Whisper 一個窗口 30 秒；同一個檔案相鄰嘅語音段會合併到最長 30 秒先送去解碼
+CHUNK_SAMPLES = 30 * SAMPLE_RATE
+# 交畀 FunASR 處理嘅語言 (同逐個模式一樣，只有中文轉 FunASR)
+FUNASR_LANGUAGES = {"zh"}
+
+
+def _load_audio(file_path):
+    try:
+        return decode_audio(file_path, sampling_rate=SAMPLE_RATE)
+    except Exception:
+        print(traceback.format_exc())
+        return None
+
+
+def _speech_chunks(audio, vad_options):
+    """VAD 搵出語音段 (sample 位置)，相鄰段合併到最長 30 秒；冇語音回傳空 list"""
+    chunks = []
+    for ts in get_speech_timestamps(audio, vad_options):
+        start, end = ts["start"], ts["end"]
+        if chunks and end - chunks[-1][0] <= CHUNK_SAMPLES:
+            chunks[-1][1] = end
+            continue
+        # 單段超過 30 秒就切開
+        while end - start > CHUNK_SAMPLES:
+            chunks.append([start, start + CHUNK_SAMPLES])
+            start += CHUNK_SAMPLES
+        chunks.append([start, end])
+    return chunks
+
+
+def _features(model, audio):
+    """log-mel 特徵，補齊 / 截斷到一個 30 秒窗口"""
+    return pad_or_trim(model.feature_extractor(audio)[..., :-1])
+
+
+def _detect_languages(model, audios, batch_size):
+    """逐批用每個檔案頭 30 秒做語言識別，回傳語言代碼 list"""
+    languages = []
+    for i in range(0, len(audios), batch_size):
+        features = np.stack([_features(model, audio[:CHUNK_SAMPLES]) for audio in audios[i : i + batch_size]])
+        for probs in model.model.detect_language(get_ctranslate2_storage(features)):
+            # probs 已按概率排好，token 格式係 <|zh|>
+            languages.append(probs[0][0][2:-2])
+    return languages
+
+
+def _decode_chunks(model, chunks, language, batch_size, beam_size=5):
+    """
+    將多個檔案嘅語音段 (已屬同一語言) 湊成批一次過解碼，回傳每段文本。
+    唔 strip：同 faster-whisper 嘅 segment.text 一樣，英文等語言每段開頭保留空格，直接拼埋都唔會黐埋個字 (成句寫出前先 strip)
+    """
+    tokenizer = Tokenizer(model.hf_tokenizer, model.model.is_multilingual, task="transcribe", language=language)
+    prompt = model.get_prompt(tokenizer, [], without_timestamps=True)
+    texts = []
+    for i in range(0, len(chunks), batch_size):
+        batch = chunks[i : i + batch_size]
+        features = np.stack([_features(model, chunk) for chunk in batch])
+        results = model.model.generate(
+            get_ctranslate2_storage(features),
+            [prompt] * len(batch),
+            beam_size=beam_size,
+            max_length=model.max_length,
+            suppress_blank=True,
+            suppress_tokens=[-1],
+        )
+        texts.extend(tokenizer.decode(result.sequences_ids[0]) for result in results)
+    return texts
+
+
+def execute_asr_batched(
+    input_folder, output_folder, model_size, language, precision, batch_size=16, workers=8, group_size=64
+):
+    """
+    批量轉寫：每 group_size 個檔案一組，thread pool 並行解碼 + VAD (預先做下一組)，
+    冇指定語言就先成組做語言識別，再按語言成批分流：中文交 FunASR (一次過批量，唔會 whisper 同 FunASR 各解一次)，
+    其餘語言將全組檔案嘅語音段湊埋一齊，每 batch_size 段一次過解碼。
+    每組完成即刻追加寫入 .list，重新執行會跳過已轉寫嘅檔案。
+    """
+    if language == "auto":
+        language = None  # 不设置语种由模型自动输出概率最高的语种
+    model = create_model(model_size, precision)
+    if model is None:
+        return None
+    funasr_model = None
+    vad_options = VadOptions(min_silence_duration_ms=700)
+
+    output_file_name = os.path.basename(input_folder)
+    output_folder = output_folder or "output/asr_opt"
+    output_file_path = os.path.abspath(f"{output_folder}/{output_file_name}.list")
+
+    def prepare(file_path):
+        audio = _load_audio(file_path)
+        return audio, (_speech_chunks(audio, vad_options) if audio is not None else [])
+
+    with AsrListWriter(output_file_path) as writer:
+        file_paths = [
+            os.path.join(input_folder, file_name)
+            for file_name in sorted(os.listdir(input_folder))
+            if os.path.join(input_folder, file_name) not in writer.done
+        ]
+        if writer.done:
+            print(f"⏭️ 跳過已轉寫嘅 {len(writer.done)} 個檔案，剩餘 {len(file_paths)} 個")
+        groups = [file_paths[i : i + group_size] for i in range(0, len(file_paths), group_size)]
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = [pool.map(prepare, groups[0])] if groups else []
+            for i, group in enumerate(tqdm(groups)):
+                if i + 1 < len(groups):
+                    pending.append(pool.map(prepare, groups[i + 1]))
+                prepared = [(p, audio, chunks) for p, (audio, chunks) in zip(group, pending.pop(0)) if audio is not None]
+                if not prepared:
+                    continue
+
+                # 1. 語言識別 (成組一次過)
+                if language is None:
+                    languages = _detect_languages(model, [audio for _, audio, _ in prepared], batch_size)
+                else:
+                    languages = [language] * len(prepared)
+
+                # 2. 按語言分流
+                texts = {}
+                routes = {}
+                for (file_path, audio, chunks), lang in zip(prepared, languages):
+                    routes.setdefault(lang, []).append((file_path, audio, chunks))
+                for lang, items in routes.items():
+                    if lang in FUNASR_LANGUAGES:
+                        if funasr_model is None:
+                            print("检测为中文文本, 转 FunASR 处理")
+                            from funasr_asr import create_model as create_funasr_model  # 如果用英文就不需要导入下载模型
+
+                            funasr_model = create_funasr_model(lang)
+                        from funasr_asr import _generate_batch
+
+                        results = _generate_batch(funasr_model, [audio for _, audio, _ in items], 300)
+                        texts.update((file_path, text) for (file_path, _, _), text in zip(items, results) if text)
+                        # FunASR 冇結果 (空文本 / 失敗) 嘅檔案同舊版一樣退返用 whisper 解碼
+                        items = [item for item, text in zip(items, results) if not text]
+                        if not items:
+                            continue
+
+                    # 3. 全組同語言檔案嘅語音段湊成批解碼，再按檔案拼返
+                    owners, segments = [], []
+                    for file_path, audio, chunks in items:
+                        texts[file_path] = ""
+                        for start, end in chunks:
+                            owners.append(file_path)
+                            segments.append(audio[start:end])
+                    try:
+                        for file_path, text in zip(owners, _decode_chunks(model, segments, lang, batch_size)):
+                            texts[file_path] += text
+                    except Exception:
+                        print(traceback.format_exc())
+                        for file_path, _, _ in items:
+                            texts.pop(file_path, None)
+
+                writer.write(
+                    [
+                        f"{file_path}|{output_file_name}|{lang.upper()}|{texts[file_path].strip()}"
+                        for (file_path, _, _), lang in zip(prepared, languages)
+                        if texts.get(file_path) is not None
+                    ]
+                )
+
+    print(f"ASR 任务完成->标注文件路径: {output_file_path}\n")
+    return output_file_path
+
+
 load_cudnn()
 
 if __name__ == "__main__":
@@ -122,11 +306,27 @@ if __name__ == "__main__":
         help="fp16, int8 or fp32",
     )
 
-    cmd = parser.parse_args()
-    output_file_path = execute_asr(
-        input_folder=cmd.input_folder,
-        output_folder=cmd.output_folder,
-        model_size=cmd.model_size,
-        language=cmd.language,
-        precision=cmd.precision,
+    parser.add_argument(
+        "-b", "--batch_size", type=int, default=0, help="批量模式每次解碼幾多段語音；0 = 逐個檔案轉寫 (舊行為)"
     )
+    parser.add_argument("-w", "--workers", type=int, default=8, help="批量模式解碼 / VAD thread 數")
+
+    cmd = parser.parse_args()
+    if cmd.batch_size > 0:
+        output_file_path = execute_asr_batched(
+            input_folder=cmd.input_folder,
+            output_folder=cmd.output_folder,
+            model_size=cmd.model_size,
+            language=cmd.language,
+            precision=cmd.precision,
+            batch_size=cmd.batch_size,
+            workers=cmd.workers,
+        )
+    else:
+        output_file_path = execute_asr(
+            input_folder=cmd.input_folder,
+            output_folder=cmd.output_folder,
+            model_size=cmd.model_size,
+            language=cmd.language,
+            precision=cmd.precision,
+        )
@@ -3,12 +3,18 @@
 import argparse
 import os
 import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import librosa
+import soundfile
 
 # from funasr.utils import version_checker
 # version_checker.check_for_update = lambda: None
 from funasr import AutoModel
 from tqdm import tqdm
 
+from asr_list import AsrListWriter
+
 funasr_models = {}  # 存储模型避免重复加载
 
 
@@ -96,6 +102,101 @@ def execute_asr(input_folder, output_folder, model_size, language):
     return output_file_path
 
 
+def _group_by_duration(file_paths, batch_size_s):
+    """按長度排序後分批，每批總長唔超過 batch_size_s 秒 (單個超長檔自成一批)"""
+    durations = {}
+    for file_path in file_paths:
+        try:
+            durations[file_path] = soundfile.info(file_path).duration
+        except Exception:
+            # soundfile 讀唔到 header 嘅格式 (例如 mp3) 交返 librosa 解碼時再算
+            durations[file_path] = 0.0
+
+    batches, batch, total = [], [], 0.0
+    for file_path in sorted(file_paths, key=lambda p: durations[p]):
+        if batch and total + durations[file_path] > batch_size_s:
+            batches.append(batch)
+            batch, total = [], 0.0
+        batch.append(file_path)
+        total += durations[file_path]
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _decode(file_path):
+    try:
+        wav, _ = librosa.load(file_path, sr=16000, mono=True)
+        return wav
+    except Exception:
+        print(traceback.format_exc())
+        return None
+
+
+def _generate_batch(model, wavs, batch_size_s):
+    """一次過將成批波形餵畀模型；批量推理出錯就逐個再試，唔會成批冇咗"""
+    try:
+        results = model.generate(input=wavs, batch_size=len(wavs), batch_size_s=batch_size_s)
+        if len(results) == len(wavs):
+            return [res["text"] for res in results]
+        print(f"⚠️ 批量結果數目唔啱 ({len(results)} != {len(wavs)})，改為逐個轉寫")
+    except Exception:
+        print(traceback.format_exc())
+        print("⚠️ 批量轉寫失敗，改為逐個轉寫")
+
+    texts = []
+    for wav in wavs:
+        try:
+            texts.append(model.generate(input=wav)[0]["text"])
+        except Exception:
+            print(traceback.format_exc())
+            texts.append(None)
+    return texts
+
+
+def execute_asr_batched(input_folder, output_folder, model_size, language, batch_size_s=300, workers=8):
+    """
+    批量轉寫：thread pool 並行解碼切片，按長度分批 (每批總長 ≤ batch_size_s 秒) 一次過餵畀常駐嘅模型。
+    每批轉寫完即刻追加寫入 .list，崩潰都保留已完成嘅行；重新執行會跳過 .list 入面已有嘅檔案。
+    """
+    output_file_name = os.path.basename(input_folder)
+    output_folder = output_folder or "output/asr_opt"
+    output_file_path = os.path.abspath(f"{output_folder}/{output_file_name}.list")
+
+    model = create_model(language)
+
+    with AsrListWriter(output_file_path) as writer:
+        file_paths = [
+            os.path.join(input_folder, file_name)
+            for file_name in sorted(os.listdir(input_folder))
+            if os.path.join(input_folder, file_name) not in writer.done
+        ]
+        if writer.done:
+            print(f"⏭️ 跳過已轉寫嘅 {len(writer.done)} 個檔案，剩餘 {len(file_paths)} 個")
+        batches = _group_by_duration(file_paths, batch_size_s)
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # 解碼預先行一批，GPU 做緊呢批時 CPU 已經解緊下一批
+            pending = [pool.map(_decode, batches[0])] if batches else []
+            for i, batch in enumerate(tqdm(batches)):
+                if i + 1 < len(batches):
+                    pending.append(pool.map(_decode, batches[i + 1]))
+                wavs = list(pending.pop(0))
+
+                decoded = [(p, w) for p, w in zip(batch, wavs) if w is not None]
+                texts = _generate_batch(model, [w for _, w in decoded], batch_size_s) if decoded else []
+                writer.write(
+                    [
+                        f"{file_path}|{output_file_name}|{language.upper()}|{text}"
+                        for (file_path, _), text in zip(decoded, texts)
+                        if text is not None
+                    ]
+                )
+
+    print(f"ASR 任务完成->标注文件路径: {output_file_path}\n")
+    return output_file_path
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -109,10 +210,24 @@ if __name__ == "__main__":
     parser.add_argument(
         "-p", "--precision", type=str, default="float16", choices=["float16", "float32"], help="fp16 or fp32"
     )  # 还没接入
-    cmd = parser.parse_args()
-    execute_asr(
-        input_folder=cmd.input_folder,
-        output_folder=cmd.output_folder,
-        model_size=cmd.model_size,
-        language=cmd.language,
+    parser.add_argument(
+        "-b", "--batch_size_s", type=int, default=0, help="批量模式每批總長 (秒)；0 = 逐個檔案轉寫 (舊行為)"
     )
+    parser.add_argument("-w", "--workers", type=int, default=8, help="批量模式解碼 thread 數")
+    cmd = parser.parse_args()
+    if cmd.batch_size_s > 0:
+        execute_asr_batched(
+            input_folder=cmd.input_folder,
+            output_folder=cmd.output_folder,
+            model_size=cmd.model_size,
+            language=cmd.language,
+            batch_size_s=cmd.batch_size_s,
+            workers=cmd.workers,
+        )
+    else:
+        execute_asr(
+            input_folder=cmd.input_folder,
+            output_folder=cmd.output_folder,
+            model_size=cmd.model_size,
+            language=cmd.language,
+        )
@@ -14,6 +14,8 @@ def main():
     parser.add_argument("--language", type=str, default="yue", choices=["zh", "yue", "auto"], help="識別語言 (粵語用 yue)")
     parser.add_argument("--model_size", type=str, default="large", choices=["large", "small"], help="模型大小")
     parser.add_argument("--precision", type=str, default="float16", choices=["float16", "float32"], help="fp16 或 fp32")
+    parser.add_argument("--batch_size_s", type=int, default=300, help="批量模式每批總長 (秒)，0 = 逐個檔案轉寫")
+    parser.add_argument("--decode_workers", type=int, default=8, help="批量模式並行解碼 thread 數")
     
     # 掛載後的 ASR 腳本絕對路徑
     asr_script_path = Path("/app/asr/funasr_asr.py")
@@ -31,20 +33,27 @@ def main():
     print(f"輸入目錄: {args.input_dir}")
     print(f"輸出檔案: {args.output_file}")
     print(f"使用語言: {args.language}")
+    print(f"批量長度: {args.batch_size_s}s" if args.batch_size_s > 0 else "批量長度: 關閉 (逐個檔案)")
     print(f"--------------------------")
 
     # 3. 構建指令 (對接你份 script 嘅 flag: -i, -o, -s, -l, -p)
     cmd = [
         "python3", str(asr_script_path),
         "-i", str(args.input_dir),
-        "-o", str(args.output_file),
+        "-o", str(args.output_file.parent),
         "-s", args.model_size,
         "-l", args.language,
-        "-p", args.precision
+        "-p", args.precision,
+        "-b", str(args.batch_size_s),
+        "-w", str(args.decode_workers)
     ]
 
     try:
         result = subprocess.run(cmd, check=True, text=True)
+        # funasr_asr.py 以輸入目錄命名 .list，改返做指定嘅檔名
+        produced = args.output_file.parent / f"{args.input_dir.name}.list"
+        if produced != args.output_file and produced.exists():
+            produced.replace(args.output_file)
         if result.returncode == 0:
             print(f"\n✅ SUCCESS: 標註完成。")
             sys.exit(0)
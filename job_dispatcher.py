@@ -0,0 +1,186 @@
+import hashlib
+import logging
+import threading
+import time
+import uuid
+from typing import Optional
+from structure import Task
+from config import Config
+from tools.tools import Tools
+from train_pipeline import TrainPipeline
+from task_scheduler import TaskScheduler
+from uvr5 import UVR5
+from uvr5_worker import UVR5WorkerClient
+
+_GB = 1024**3
+
+
+class Job:
+    """一個執行中嘅任務 (喺獨立 thread 度行)"""
+
+    def __init__(self, task: Task, device: str):
+        self.task = task
+        self.device = device
+        self.container_name = f"tts_{task.cmd}_{task.sub_cmd or 'main'}_{uuid.uuid4().hex[:8]}".lower()
+        self.started_at = time.time()
+        self.success: Optional[bool] = None
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def audio_key(self) -> tuple[str, str]:
+        return (self.task.character_name, self.task.audio_name)
+
+
+class JobDispatcher:
+    """
+    多 GPU 並行調度器。
+    每粒 GPU / CPU 有固定 slot 數；GPU 任務按 Config.task_vram_gb 嘅峰值，
+    用 mem_get_info 睇剩餘顯存決定收唔收 (admission)，揀最空閒嗰粒。
+    唔需要 GPU 嘅任務 (例如 Slice) 行 CPU slot；冇 GPU 嘅機器所有任務都行 CPU。
+    """
+
+    def __init__(
+        self,
+        gpu_slots: int = Config.gpu_slots,
+        cpu_slots: int = Config.cpu_slots,
+        warmup_sec: float = 60.0,
+        scheduler: Optional[TaskScheduler] = None,
+    ):
+        self.gpu_slots = gpu_slots
+        self.cpu_slots = cpu_slots
+        # 啱啱啟動嘅 container 未必已經攞晒 VRAM，呢段時間內要預留返佢嘅峰值
+        self.warmup_sec = warmup_sec
+        # 有調度器就用佢嘅 VRAM 估計 (Config 峰值同歷史實測取大)
+        self.scheduler = scheduler
+        self.gpu_ids = [i for i, _free, _total in Tools.get_gpu_mem_info()]
+        self.jobs: dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+        logging.info(
+            f"🧮 調度器就緒: GPU {self.gpu_ids or '無'} x {gpu_slots} slot, CPU x {cpu_slots} slot"
+        )
+
+    # --- 狀態查詢 ---
+
+    @staticmethod
+    def peak_vram(task: Task) -> int:
+        sub_cmd = UVR5.job_type(task) if task.cmd == "UVR5" else task.sub_cmd
+        return int(Config.task_vram_gb.get((task.cmd, sub_cmd), 0.0) * _GB)
+
+    def _peak(self, task: Task) -> int:
+        if self.scheduler is not None:
+            return self.scheduler.estimate(task).vram_bytes
+        return JobDispatcher.peak_vram(task)
+
+    def _device_jobs(self, device: str) -> list[Job]:
+        return [job for job in self.jobs.values() if job.device == device]
+
+    def busy_audios(self) -> set[tuple[str, str]]:
+        """執行中任務所屬嘅 (角色, 音頻)，同一個音頻唔可以同時行兩個階段"""
+        with self._lock:
+            return {job.audio_key for job in self.jobs.values()}
+
+    def running_containers(self) -> list[str]:
+        """
+        執行中任務嘅 container 名；經常駐 worker 行嘅 UVR5 任務報 worker 嘅 container
+        (每個 job 自己嘅 container 名只係一次性 docker run 先會用到)
+        """
+        names = []
+        with self._lock:
+            for job in self.jobs.values():
+                if job.task.cmd not in Config.docker_imgs:
+                    continue
+                name = job.container_name
+                if job.task.cmd == "UVR5" and Config.uvr5_worker_enabled:
+                    client = UVR5WorkerClient.get(job.device)
+                    if client.local:
+                        # 本地替身 worker 冇 container
+                        continue
+                    name = client.container_name
+                if name not in names:
+                    names.append(name)
+        return names
+
+    @property
+    def running_count(self) -> int:
+        with self._lock:
+            return len(self.jobs)
+
+    # --- Admission ---
+
+    def _pick_device(self, task: Task) -> Optional[str]:
+        peak = self._peak(task)
+
+        # 純 CPU 任務，或者成部機冇 GPU
+        if peak == 0 or not self.gpu_ids:
+            return "cpu" if len(self._device_jobs("cpu")) < self.cpu_slots else None
+
+        now = time.time()
+        margin = int(Config.gpu_vram_margin_gb * _GB)
+        candidates = []
+        for i, free_mem, _total in Tools.get_gpu_mem_info():
+            device = f"cuda:{i}"
+            jobs = self._device_jobs(device)
+            if len(jobs) >= self.gpu_slots:
+                continue
+            reserved = sum(
+                self._peak(job.task)
+                for job in jobs
+                if now - job.started_at < self.warmup_sec
+            )
+            available = free_mem - reserved - margin
+            if available >= peak:
+                candidates.append((available, device))
+
+        if not candidates:
+            return None
+        return max(candidates)[1]
+
+    @staticmethod
+    def _task_file_for(task: Task):
+        """每個任務一個固定嘅追蹤檔，失敗重試會覆蓋返同一個"""
+        digest = hashlib.sha1(f"{task.cmd}|{task.sub_cmd}|{task.file_path}".encode("utf-8")).hexdigest()
+        return Config.train_task_dir / f"{digest[:16]}.json"
+
+    def submit(self, task: Task) -> bool:
+        """嘗試開始任務；冇設備收得落就回傳 False (稍後再試)"""
+        with self._lock:
+            device = self._pick_device(task)
+            if device is None:
+                return False
+
+            if not task.in_process:
+                Config.train_task_dir.mkdir(parents=True, exist_ok=True)
+                task.task_file = JobDispatcher._task_file_for(task)
+
+            job = Job(task, device)
+            self.jobs[job.container_name] = job
+            job.thread = threading.Thread(target=self._run, args=(job,), name=job.container_name, daemon=True)
+            job.thread.start()
+        logging.info(f"📤 已派發 [{task.cmd} - {task.sub_cmd}] {task.audio_name} → {device}")
+        return True
+
+    def _run(self, job: Job):
+        try:
+            job.success = TrainPipeline.run_task(job.task, job.device, job.container_name)
+        except Exception as e:
+            logging.error(f"💥 任務 thread 崩潰: {e}")
+            job.success = False
+
+    def reap(self) -> list[Job]:
+        """收返已經完成嘅任務"""
+        with self._lock:
+            finished = [job for job in self.jobs.values() if not job.thread.is_alive()]
+            for job in finished:
+                del self.jobs[job.container_name]
+        for job in finished:
+            elapsed = time.time() - job.started_at
+            logging.info(
+                f"🔚 [{job.task.cmd} - {job.task.sub_cmd}] {job.task.audio_name} 結束 "
+                f"({'成功' if job.success else '失敗'}, {job.device}, {elapsed:.1f}s)"
+            )
+        return finished
+
+    def wait_all(self):
+        for job in list(self.jobs.values()):
+            job.thread.join()
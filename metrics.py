@@ -0,0 +1,393 @@
+import argparse
+import contextlib
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Iterator, Optional
+from structure import Task
+from config import Config
+
+# container 印出嚟嘅量度行前綴 (uvr5/uvr5_processor.py 用同一個)
+METRIC_PREFIX = "METRIC "
+
+_MB = 1024**2
+
+
+class _RssSampler(threading.Thread):
+    """任務期間定時讀 /proc/self/statm，記錄 host 程序 RSS 峰值 (daemon 並行時係成個程序嘅值)"""
+
+    def __init__(self, interval: float = 0.5):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = 0
+        self._stop_event = threading.Event()
+        self._page_size = os.sysconf("SC_PAGE_SIZE")
+
+    def _rss(self) -> int:
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * self._page_size
+        except (OSError, ValueError, IndexError):
+            return 0
+
+    def run(self):
+        while True:
+            self.peak = max(self.peak, self._rss())
+            if self._stop_event.wait(self.interval):
+                break
+
+    def stop(self) -> int:
+        self._stop_event.set()
+        self.join()
+        return max(self.peak, self._rss())
+
+
+class Metrics:
+    """
+    每個任務嘅結構化量度：排隊時間、container 啟動、模型載入、運算、I/O bytes、RSS / VRAM 峰值、實時倍率。
+    任務喺邊條 thread 行，量度就掛喺嗰條 thread (daemon 多個任務並行唔會撈亂)；
+    完成後追加一行去 Config.metrics_file (JSON lines)，並更新 Prometheus textfile。
+    """
+
+    _local = threading.local()
+    # 同一程序內寫檔嘅鎖 (跨程序用 flock)
+    _write_lock = threading.Lock()
+
+    # --- 收集 ---
+
+    @staticmethod
+    def current() -> Optional[dict]:
+        return getattr(Metrics._local, "record", None)
+
+    @staticmethod
+    @contextlib.contextmanager
+    def track(task: Task, device: Optional[str] = None, audio_sec: Optional[float] = None) -> Iterator[dict]:
+        """
+        包住一個任務嘅執行；離開時計埋總耗時同 I/O，再寫出量度
+        :param audio_sec: 輸入音頻長度 (計實時倍率用)，None 就唔計
+        """
+        start = time.time()
+        record = {
+            "ts": round(start, 3),
+            "cmd": task.cmd,
+            "sub_cmd": task.sub_cmd,
+            "character": task.character_name,
+            "audio": task.audio_name,
+            "device": device or "",
+            "resumed": task.in_process,
+            "model": "",
+            "queue_wait": round(start - task.queued_at, 3) if task.queued_at else None,
+            "audio_sec": audio_sec,
+            "read_bytes": task.file_path.stat().st_size if task.file_path.exists() else 0,
+            "stages": [],
+        }
+        if not Config.metrics_enabled:
+            yield record
+            return
+
+        sampler = _RssSampler()
+        sampler.start()
+        Metrics._local.record = record
+        try:
+            yield record
+        finally:
+            Metrics._local.record = None
+            record["host_peak_rss_mb"] = round(sampler.stop() / _MB, 1)
+            record["wall"] = round(time.time() - start, 3)
+            record["write_bytes"] = _bytes_written_since(task.train_dir, start)
+            if record["audio_sec"] and record["wall"] > 0:
+                record["rtf"] = round(record["audio_sec"] / record["wall"], 3)
+            record.setdefault("success", False)
+            Metrics.write(record)
+
+    @staticmethod
+    def annotate(**fields):
+        """為目前任務補充欄位 (例如 model / cache_hit)；冇任務追蹤中就乜都唔做"""
+        record = Metrics.current()
+        if record is not None:
+            record.update(fields)
+
+    @staticmethod
+    def record_stage(stage: str, seconds: float, **extra):
+        """記錄一個階段耗時 (同名階段可以出現多次，例如一個 job 多個檔案)"""
+        record = Metrics.current()
+        if record is not None:
+            record["stages"].append({"stage": stage, "seconds": round(seconds, 3), **extra})
+
+    @staticmethod
+    @contextlib.contextmanager
+    def stage(stage: str, **extra):
+        start = time.time()
+        try:
+            yield
+        finally:
+            Metrics.record_stage(stage, time.time() - start, **extra)
+
+    @staticmethod
+    def ingest(metric: dict):
+        """
+        收 container 報上嚟嘅量度 ({"stage", "seconds", ...})；
+        stage 為 "resources" 嗰行係 container 嘅 RSS / VRAM 峰值
+        """
+        record = Metrics.current()
+        if record is None:
+            return
+        metric = dict(metric)
+        stage = metric.pop("stage", None)
+        if stage == "resources":
+            for key in ("peak_rss_mb", "peak_vram_mb"):
+                if metric.get(key) is not None:
+                    record[key] = max(record.get(key) or 0, metric[key])
+        elif stage:
+            Metrics.record_stage(stage, float(metric.pop("seconds", 0.0)), **metric)
+
+    @staticmethod
+    def parse_docker_line(line: str) -> bool:
+        """[Docker Output] 行係量度行就收低並回傳 True"""
+        if not line.startswith(METRIC_PREFIX):
+            return False
+        try:
+            Metrics.ingest(json.loads(line[len(METRIC_PREFIX):]))
+        except (ValueError, TypeError):
+            return False
+        return True
+
+    # --- 輸出 ---
+
+    @staticmethod
+    def write(record: dict):
+        """追加 JSON line，並將累計值寫入 Prometheus textfile"""
+        try:
+            Config.metrics_file.parent.mkdir(parents=True, exist_ok=True)
+            with Metrics._write_lock, open(Config.metrics_file, "a", encoding="utf-8") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                # 先讀狀態 (可能要由 JSON lines 重新累計) 再追加，避免重複計
+                state = Metrics._load_state()
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                f.flush()
+                _accumulate(state, record)
+                Metrics._save_state(state)
+                Metrics._write_prom(state)
+        except OSError as e:
+            logging.warning(f"⚠️ 寫入量度失敗: {e}")
+            return
+
+        logging.info(
+            f"📊 [{record['cmd']} - {record['sub_cmd']}] {record['audio']}: "
+            f"{record['wall']}s"
+            + (f", 實時倍率 {record['rtf']}x" if record.get("rtf") else "")
+            + "".join(f" | {s['stage']} {s['seconds']}s" for s in record["stages"])
+        )
+
+    @staticmethod
+    def _state_file() -> Path:
+        return Config.metrics_prom_file.with_suffix(".state.json")
+
+    @staticmethod
+    def _load_state() -> dict:
+        path = Metrics._state_file()
+        if path.exists():
+            try:
+                return json.loads(path.read_text(encoding="utf-8"))
+            except ValueError:
+                pass
+        # 狀態檔唔見咗 / 壞咗就由 JSON lines 重新累計
+        state = {}
+        for record in Metrics.read_records():
+            _accumulate(state, record)
+        return state
+
+    @staticmethod
+    def _save_state(state: dict):
+        path = Metrics._state_file()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.tmp")
+        tmp.write_text(json.dumps(state, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, path)
+
+    @staticmethod
+    def _write_prom(state: dict):
+        """node_exporter textfile collector 格式；先寫暫存檔再 rename，避免被讀到半份"""
+        lines = []
+        for name, (kind, help_text) in _PROM_METRICS.items():
+            series = state.get(name)
+            if not series:
+                continue
+            lines.append(f"# HELP tts_pipeline_{name} {help_text}")
+            lines.append(f"# TYPE tts_pipeline_{name} {kind}")
+            for labels, value in sorted(series.items()):
+                lines.append(f"tts_pipeline_{name}{{{labels}}} {value}")
+        path = Config.metrics_prom_file
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.tmp")
+        tmp.write_text("\n".join(lines) + "\n", encoding="utf-8")
+        os.replace(tmp, path)
+
+    # --- 報表 ---
+
+    @staticmethod
+    def read_records(since: Optional[float] = None) -> Iterator[dict]:
+        if not Config.metrics_file.exists():
+            return
+        with open(Config.metrics_file, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if since is None or record.get("ts", 0) >= since:
+                    yield record
+
+    @staticmethod
+    def slowest_stages(records: list[dict], top: int = 10) -> list[tuple]:
+        """按平均耗時排序，回傳 [(任務, 階段, 次數, 平均, p95, 最長, 合計)]"""
+        groups: dict[tuple[str, str], list[float]] = defaultdict(list)
+        for record in records:
+            task = _task_label(record)
+            groups[(task, "total")].append(record.get("wall", 0.0))
+            for s in record.get("stages", []):
+                groups[(task, s["stage"])].append(s["seconds"])
+
+        rows = []
+        for (task, stage), values in groups.items():
+            values.sort()
+            p95 = values[min(len(values) - 1, int(len(values) * 0.95))]
+            rows.append((task, stage, len(values), sum(values) / len(values), p95, values[-1], sum(values)))
+        rows.sort(key=lambda r: r[3], reverse=True)
+        return rows[:top]
+
+    @staticmethod
+    def rtf_by_model(records: list[dict]) -> list[tuple]:
+        """
+        每個模型嘅實時倍率 (音頻秒數 / 牆鐘秒數)，回傳 [(模型, 任務數, 音頻秒數, 牆鐘秒數, 總倍率, 運算倍率)]；
+        運算倍率只計 compute 類階段 (唔計排隊、啟動、載入模型)
+        """
+        groups = defaultdict(lambda: [0, 0.0, 0.0, 0.0])
+        for record in records:
+            if not record.get("success") or not record.get("audio_sec") or record.get("cache_hit"):
+                continue
+            g = groups[record.get("model") or _task_label(record)]
+            g[0] += 1
+            g[1] += record["audio_sec"]
+            g[2] += record.get("wall", 0.0)
+            g[3] += sum(s["seconds"] for s in record.get("stages", []) if s["stage"] in _COMPUTE_STAGES)
+
+        rows = []
+        for model, (count, audio, wall, compute) in groups.items():
+            rows.append(
+                (model, count, audio, wall, audio / wall if wall else 0.0, audio / compute if compute else None)
+            )
+        rows.sort(key=lambda r: r[4])
+        return rows
+
+
+# 計入「運算」嘅階段名 (UVR5 單獨任務 / chain 各級 / Slice)
+_COMPUTE_STAGES = {"compute", "extract", "dereverb", "deecho", "ensemble", "denoise_split", "export", "transcribe"}
+
+_PROM_METRICS = {
+    "tasks_total": ("counter", "已完成任務數"),
+    "task_seconds_total": ("counter", "任務牆鐘時間合計 (秒)"),
+    "queue_wait_seconds_total": ("counter", "任務排隊時間合計 (秒)"),
+    "stage_seconds_total": ("counter", "各階段耗時合計 (秒)"),
+    "stage_runs_total": ("counter", "各階段執行次數"),
+    "audio_seconds_total": ("counter", "已處理音頻長度合計 (秒)"),
+    "io_bytes_total": ("counter", "任務讀寫 bytes 合計"),
+    "peak_rss_bytes": ("gauge", "最近一個任務嘅 RSS 峰值"),
+    "peak_vram_bytes": ("gauge", "最近一個任務嘅 VRAM 峰值"),
+    "realtime_factor": ("gauge", "最近一個任務嘅實時倍率 (音頻秒數 / 牆鐘秒數)"),
+}
+
+
+def _bytes_written_since(root: Path, since: float) -> int:
+    """任務期間喺 train_dir 入面新寫 / 改過嘅檔案大小合計"""
+    total = 0
+    for dirpath, _dirnames, filenames in os.walk(root):
+        for name in filenames:
+            try:
+                st = os.stat(os.path.join(dirpath, name))
+            except OSError:
+                continue
+            if st.st_mtime >= since:
+                total += st.st_size
+    return total
+
+
+def _task_label(record: dict) -> str:
+    return f"{record['cmd']}/{record['sub_cmd']}" if record.get("sub_cmd") else record["cmd"]
+
+
+def _labels(**labels) -> str:
+    return ",".join(f'{k}="{str(v).replace(chr(34), "")}"' for k, v in labels.items())
+
+
+def _accumulate(state: dict, record: dict):
+    """將一個任務嘅量度累加入 Prometheus 狀態 ({metric: {labels: value}})"""
+
+    def add(name, labels, value):
+        series = state.setdefault(name, {})
+        series[labels] = round(series.get(labels, 0) + value, 3)
+
+    def gauge(name, labels, value):
+        state.setdefault(name, {})[labels] = value
+
+    base = dict(cmd=record["cmd"], sub_cmd=record["sub_cmd"])
+    task = _labels(**base)
+    add("tasks_total", _labels(**base, status="success" if record.get("success") else "failure"), 1)
+    add("task_seconds_total", task, record.get("wall", 0.0))
+    if record.get("queue_wait") is not None:
+        add("queue_wait_seconds_total", task, record["queue_wait"])
+    if record.get("audio_sec") and record.get("success"):
+        add("audio_seconds_total", _labels(**base, model=record.get("model", "")), record["audio_sec"])
+    add("io_bytes_total", _labels(**base, direction="read"), record.get("read_bytes", 0))
+    add("io_bytes_total", _labels(**base, direction="write"), record.get("write_bytes", 0))
+    for s in record.get("stages", []):
+        labels = _labels(**base, stage=s["stage"], model=s.get("model", ""))
+        add("stage_seconds_total", labels, s["seconds"])
+        add("stage_runs_total", labels, 1)
+
+    peak_rss_mb = max(record.get("peak_rss_mb") or 0, record.get("host_peak_rss_mb") or 0)
+    if peak_rss_mb:
+        gauge("peak_rss_bytes", task, int(peak_rss_mb * _MB))
+    if record.get("peak_vram_mb"):
+        gauge("peak_vram_bytes", task, int(record["peak_vram_mb"] * _MB))
+    if record.get("rtf"):
+        gauge("realtime_factor", task, record["rtf"])
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    parser = argparse.ArgumentParser(description="流水線量度報表")
+    parser.add_argument("command", choices=["slowest", "rtf", "prom"])
+    parser.add_argument("--top", type=int, default=10, help="slowest 顯示幾多行")
+    parser.add_argument("--hours", type=float, default=None, help="只計最近幾多個鐘 (slowest / rtf)")
+    args = parser.parse_args()
+    if args.command == "prom" and args.hours:
+        # textfile 入面嘅 *_total 係 counter，只計一段時間會令 counter 倒退，rate() 就計錯
+        parser.error("prom 一律由全部紀錄重新累計，唔支援 --hours")
+
+    since = time.time() - args.hours * 3600 if args.hours else None
+    records = list(Metrics.read_records(since))
+
+    if args.command == "slowest":
+        print(f"{'任務':<20} {'階段':<16} {'次數':>6} {'平均s':>9} {'p95 s':>9} {'最長s':>9} {'合計s':>10}")
+        for task, stage, count, mean, p95, longest, total in Metrics.slowest_stages(records, args.top):
+            print(f"{task:<20} {stage:<16} {count:>6} {mean:>9.2f} {p95:>9.2f} {longest:>9.2f} {total:>10.1f}")
+    elif args.command == "rtf":
+        print(f"{'模型':<48} {'任務':>6} {'音頻s':>10} {'牆鐘s':>10} {'倍率':>8} {'運算倍率':>8}")
+        for model, count, audio, wall, rtf, compute_rtf in Metrics.rtf_by_model(records):
+            compute = f"{compute_rtf:.2f}" if compute_rtf is not None else "-"
+            print(f"{model:<48} {count:>6} {audio:>10.1f} {wall:>10.1f} {rtf:>8.2f} {compute:>8}")
+    elif args.command == "prom":
+        # 由 JSON lines 重新累計並重寫 textfile (例如刪走咗狀態檔之後)
+        state = {}
+        for record in records:
+            _accumulate(state, record)
+        Metrics._write_prom(state)
+        Metrics._save_state(state)
+        logging.info(f"✅ 已重寫 {Config.metrics_prom_file} ({len(records)} 個任務)")
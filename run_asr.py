@@ -0,0 +1,171 @@
+import logging
+import os
+import shutil
+import subprocess
+from pathlib import Path
+from typing import Optional
+
+from config import Config
+from metrics import Metrics
+from structure import Task
+from tools.tools import Tools
+from transcript_cache import TranscriptCache
+
+
+class ASR:
+    @staticmethod
+    def list_file(task: Task) -> Path:
+        """標註檔 (同 FunASR 一樣以輸入目錄命名，放喺 slice_manifest.json 旁邊)"""
+        return task.train_dir / f"{task.slice_dir.name}.list"
+
+    @staticmethod
+    def model_name() -> str:
+        """量度 / 調度 / 轉寫緩存用嘅模型名 (FunASR 按語言揀模型)"""
+        return f"funasr_{Config.asr_language}"
+
+    @staticmethod
+    def process_asr_task(task: Task, device: Optional[str] = None, container_name: Optional[str] = None):
+        """
+        轉寫 slice_dir 入面嘅切片，寫出 {train_dir}/slice.list。
+        先逐段查轉寫緩存，只將未轉寫過嘅片段交畀 FunASR (container 或者本地替身)；
+        新結果存返入緩存，最後按切片次序原子寫出標註檔。
+        """
+        if not task.in_process:
+            task.to_file(task.task_file)
+
+        language = Config.asr_language
+        model = ASR.model_name()
+        Metrics.annotate(model=model)
+
+        # 切片一律係 Slice 寫出嘅 .wav，唔使逐個 probe
+        slices = sorted(p for p in task.slice_dir.glob("*.wav") if p.is_file())
+        hashes = {p.name: TranscriptCache.file_hash(p) for p in slices}
+
+        texts: dict[str, str] = {}
+        cache = TranscriptCache() if Config.asr_cache_enabled else None
+        if cache is not None:
+            hits = cache.lookup(hashes.values(), model, language)
+            texts = {name: hits[sha] for name, sha in hashes.items() if sha in hits}
+
+        missing = [p for p in slices if p.name not in texts]
+        logging.info(
+            f"📝 [ASR] {task.character_name}/{task.audio_name}: {len(slices)} 段，"
+            f"緩存命中 {len(texts)} 段，要轉寫 {len(missing)} 段"
+        )
+
+        if missing:
+            with Metrics.stage("transcribe", model=model, slices=len(missing)):
+                new_texts = ASR._transcribe(task, missing, device, container_name)
+            if cache is not None:
+                cache.store({hashes[name]: text for name, text in new_texts.items()}, model, language)
+            texts.update(new_texts)
+            failed = len(missing) - len(new_texts)
+            if failed:
+                # 唔寫標註檔：寫咗索引就當 done，呢啲片段會永久冇咗；保留 .asr/，重試時只轉寫失敗嘅片段
+                raise RuntimeError(
+                    f"{task.character_name}/{task.audio_name}: {failed} 段轉寫失敗，唔寫標註檔，稍後重試"
+                )
+        else:
+            Metrics.annotate(cache_hit=True)
+
+        # 每段都有結果；冇文本 (FunASR 判斷冇人聲) 嘅片段唔寫入，訓練讀到空文本會出錯
+        lines = [
+            f"{p}|{task.character_name}|{language.upper()}|{texts[p.name]}"
+            for p in slices
+            if texts.get(p.name, "").strip()
+        ]
+        list_file = ASR.list_file(task)
+        tmp_file = list_file.with_name(f"{list_file.name}.tmp")
+        tmp_file.write_text("".join(line + "\n" for line in lines), encoding="utf-8")
+        os.replace(tmp_file, list_file)
+        shutil.rmtree(ASR._work_dir(task), ignore_errors=True)
+        logging.info(f"✅ [ASR] 標註完成 ({len(lines)} / {len(slices)} 段): {list_file}")
+
+    @staticmethod
+    def _work_dir(task: Task) -> Path:
+        return task.train_dir / ".asr"
+
+    @staticmethod
+    def _transcribe(
+        task: Task, slices: list[Path], device: Optional[str], container_name: Optional[str]
+    ) -> dict[str, str]:
+        """
+        將要轉寫嘅切片 hard link 入 .asr/slice，交畀 FunASR 批量模式，回傳 {切片檔名: 文本}。
+        續做嘅任務唔清走 .asr，FunASR 會跳過 .asr/slice.list 入面已完成嘅片段。
+        """
+        work_dir = ASR._work_dir(task)
+        if not task.in_process:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        input_dir = work_dir / task.slice_dir.name
+        input_dir.mkdir(parents=True, exist_ok=True)
+        for src in slices:
+            dst = input_dir / src.name
+            if not dst.exists():
+                try:
+                    os.link(src, dst)
+                except OSError:
+                    shutil.copy2(src, dst)
+        output_file = work_dir / f"{input_dir.name}.list"
+
+        if Config.asr_local_cmd:
+            ok = ASR._run_local(
+                Config.asr_local_cmd
+                + ["-i", str(input_dir), "-o", str(work_dir), "-l", Config.asr_language,
+                   "-b", str(Config.asr_batch_size_s)],
+                device,
+            )
+        else:
+            docker_work_dir = task.docker_train_dir / work_dir.name
+            ok = Tools.run_docker(
+                [
+                    "-v",
+                    f"{Config.dirs['DATA_ROOT']}:{Config.docker_root}",
+                    "-v",
+                    f"{Config.asr_model_cache_dir}:/root/.cache/modelscope",
+                ],
+                Config.docker_imgs[task.cmd],
+                [
+                    "--input_dir",
+                    str(docker_work_dir / input_dir.name),
+                    "--output_file",
+                    str(docker_work_dir / output_file.name),
+                    "--language",
+                    Config.asr_language,
+                    "--batch_size_s",
+                    str(Config.asr_batch_size_s),
+                ],
+                device_str=device,
+                container_name=container_name,
+            )
+        if not ok:
+            raise RuntimeError(f"FunASR 執行失敗: {task.character_name}/{task.audio_name}")
+
+        # 行嘅格式: 音頻路徑|說話人|語言|文本 (路徑可能係 container 入面嘅，只睇檔名)
+        wanted = {p.name for p in slices}
+        texts = {}
+        if output_file.exists():
+            for line in output_file.read_text(encoding="utf-8").splitlines():
+                parts = line.split("|", 3)
+                if len(parts) == 4 and Path(parts[0]).name in wanted:
+                    texts[Path(parts[0]).name] = parts[3]
+        return texts
+
+    @staticmethod
+    def _run_local(cmd: list[str], device: Optional[str]) -> bool:
+        """本地替身 (唔經 Docker)：直接行 funasr_asr.py，輸出照樣寫 log / 收量度"""
+        env = dict(os.environ)
+        if device is not None:
+            env["CUDA_VISIBLE_DEVICES"] = device.split(":")[-1] if "cuda" in device else ""
+        logging.info(f"[ASR] 🚀 啟動本地轉寫: {' '.join(cmd)}")
+        with subprocess.Popen(
+            cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1, env=env
+        ) as p:
+            for line in p.stdout:
+                line = line.strip()
+                if not line or Metrics.parse_docker_line(line):
+                    continue
+                logging.info(f"[ASR] {line}")
+            p.wait()
+        if p.returncode != 0:
+            logging.error(f"[ASR] ❌ 本地轉寫報錯退出，Exit Code: {p.returncode}")
+        return p.returncode == 0
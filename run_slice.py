@@ -1,72 +1,78 @@
+import json
 import logging
 import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-import librosa
 import numpy as np
-import noisereduce as nr
-from pydub import AudioSegment
+import soxr
+from noisereduce.spectralgate.stationary import SpectralGateStationary
 from datetime import timedelta
-import io
 import soundfile as sf
 
 from config import Config
+from metrics import Metrics
+from stage_cache import StageCache
 from structure import Task
 from tools.tools import Tools
 
 
 
 class Slice:
-    @staticmethod
-    def get_slick_audio_task() -> Optional[Task]: # 記得 import Optional
-        base_dir = Config.dirs["TRAIN_INPUT"]
-        if not base_dir.exists():
-            logging.warning(f"Input 目錄不存在: {base_dir}")
-            return None
+    # 切片參數，亦係階段緩存 key 嘅一部分 (改咗就唔會用返舊結果)
+    SLICE_PARAMS = {"max_sec": 10, "gap_threshold_sec": 1.0, "top_db": 35}
 
-        for sub_dir in sorted(base_dir.iterdir()):
-            if not sub_dir.is_dir():
-                continue
+    @staticmethod
+    def _slice_outputs(task: Task) -> list[str]:
+        """切片產出 (相對 train_dir)：slice/ 入面嘅片段同 manifest"""
+        files = [f"slice/{name}" for name in sorted(os.listdir(task.slice_dir))]
+        return files + [f"{task.slice_dir.name}_manifest.json"]
 
-            char_name = sub_dir.name
-            
-            for audio_dir in sorted(sub_dir.iterdir()):
-                if not audio_dir.is_dir():
-                    continue
+    @staticmethod
+    def _fetch_cached_slices(cache: StageCache, cache_key: str, task: Task) -> bool:
+        """命中就先 link 入暫存目錄，再成個換入 slice_dir (同 slice_and_denoise 一樣唔會留低半套)"""
+        staging_dir = task.train_dir / f".{task.slice_dir.name}.cached"
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        files = cache.fetch(cache_key, staging_dir)
+        if files is None:
+            return False
 
-                audio_name = audio_dir.name
-                vocal_path = audio_dir / "vocal_main_vocal.wav"
-                result_dir: Path = audio_dir / "slice"
+        manifest_name = f"{task.slice_dir.name}_manifest.json"
+        if (staging_dir / manifest_name).exists():
+            os.replace(staging_dir / manifest_name, task.train_dir / manifest_name)
+        staged_slices = staging_dir / task.slice_dir.name
+        staged_slices.mkdir(exist_ok=True)
+        shutil.rmtree(task.slice_dir, ignore_errors=True)
+        os.replace(staged_slices, task.slice_dir)
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        return True
 
-                # --- 修正後的 Check 邏輯 ---
-                # 1. 來源檔案必須存在
-                if not vocal_path.exists():
-                    continue
-                
-                # 2. 判斷是否需要執行 Slice:
-                #    如果 slice 資料夾唔存在 OR 入面係空嘅
-                is_empty = True
-                if result_dir.exists():
-                    # any(result_dir.iterdir()) 如果入面有任何 file 會回傳 True
-                    if any(result_dir.iterdir()):
-                        is_empty = False
-
-                if is_empty:
-                    return Task(
-                        cmd="Slice_Audio",
-                        sub_cmd="",  # 呢度補返就唔會報 Pydantic validation error
-                        file_path=vocal_path,
-                        character_name=char_name,
-                        audio_name=audio_name,
-                    )
-        return None
-                                  
     @staticmethod
     def process_slick_audio_task(task: Task):
         if not task.in_process:   
-            task.to_file(Config.train_task_file)
+            task.to_file(task.task_file)
             
         Tools.clear_folder_contents(task.slice_dir)
-        Slice.slice_and_denoise(str(task.file_path), str(task.slice_dir))
+        # 重新切片之後舊標註檔已經對唔上，刪咗佢等 ASR 重新標註 (冇變嘅片段會命中轉寫緩存)
+        (task.train_dir / f"{task.slice_dir.name}.list").unlink(missing_ok=True)
+
+        # 同一段人聲 (同參數) 切過就直接由階段緩存 link 返
+        cache, cache_key = None, None
+        if Config.stage_cache_enabled:
+            cache = StageCache()
+            cache_key = cache.make_key(task.file_path, "slice", "", Slice.SLICE_PARAMS)
+            if Slice._fetch_cached_slices(cache, cache_key, task):
+                logging.info(f"♻️ 命中階段緩存 [slice] {task.character_name}/{task.audio_name}，跳過處理")
+                Metrics.annotate(cache_hit=True)
+                return
+
+        Metrics.annotate(model=Slice.MODEL_NAME)
+        with Metrics.stage("denoise_split", model=Slice.MODEL_NAME):
+            Slice.slice_and_denoise(str(task.file_path), str(task.slice_dir), **Slice.SLICE_PARAMS)
+
+        if cache is not None and any(task.slice_dir.iterdir()):
+            cache.store(cache_key, "slice", "", task.train_dir, Slice._slice_outputs(task))
     
     @staticmethod
     def _format_timestamp(ms):
@@ -78,80 +84,248 @@ class Slice:
         milliseconds = int(td.microseconds / 1000)
         return f"{hours:02d}{minutes:02d}{seconds:02d}{milliseconds:03d}"
 
+    # --- 串流切片 ---
+    # 降噪分塊大小同前後 context，同 noisereduce 內部分塊 (chunk_size / padding) 一致，
+    # 所以逐塊處理嘅結果同成個檔一次過 reduce_noise 一樣
+    DENOISE_CHUNK = 600000
+    DENOISE_PADDING = 30000
+    # 量度 / 調度用嘅「模型」名
+    MODEL_NAME = "noisereduce"
+    # 片段統一輸出 44.1kHz mono 16-bit，並行寫出
+    EXPORT_SR = 44100
+    EXPORT_WORKERS = 4
+
+    @staticmethod
+    def _iter_mono_blocks(input_file, block_size):
+        """用 soundfile 逐塊讀入 (downmix 做 mono，同 librosa.load 預設一樣)"""
+        with sf.SoundFile(input_file) as f:
+            while True:
+                block = f.read(block_size, dtype="float32", always_2d=True)
+                if not len(block):
+                    break
+                yield block.mean(axis=1)
+
+    @staticmethod
+    def _make_noise_gate(input_file, sr):
+        """只用檔案開頭一個 chunk 估計一次噪音 profile (同 reduce_noise 嘅 clip_noise_stationary 一致)"""
+        noise_clip = next(Slice._iter_mono_blocks(input_file, Slice.DENOISE_CHUNK), np.zeros(0, dtype=np.float32))
+        return SpectralGateStationary(
+            y=noise_clip,
+            sr=sr,
+            y_noise=None,
+            n_std_thresh_stationary=1.5,
+            chunk_size=Slice.DENOISE_CHUNK,
+            clip_noise_stationary=True,
+            padding=Slice.DENOISE_PADDING,
+            n_fft=1024,
+            win_length=None,
+            hop_length=None,
+            time_constant_s=2.0,
+            freq_mask_smooth_hz=500,
+            time_mask_smooth_ms=50,
+            tmp_folder=None,
+            # 加入 stationary 通常對 UVR5 剩低嘅底噪效果更好更穩定
+            prop_decrease=0.8,
+            use_tqdm=False,
+            n_jobs=1,
+        )
+
+    @staticmethod
+    def _iter_denoised_blocks(input_file, sr):
+        """逐塊降噪：每塊前後補 DENOISE_PADDING 嘅 context (檔頭檔尾補零)，再裁返中間"""
+        gate = Slice._make_noise_gate(input_file, sr)
+        chunk, pad = Slice.DENOISE_CHUNK, Slice.DENOISE_PADDING
+
+        blocks = Slice._iter_mono_blocks(input_file, chunk)
+        left = np.zeros(pad)
+        cur = next(blocks, None)
+        while cur is not None and len(cur):
+            nxt = next(blocks, None)
+            right = nxt[:pad] if nxt is not None else np.zeros(0)
+            padded = np.zeros(chunk + 2 * pad)
+            padded[:pad] = left
+            padded[pad : pad + len(cur)] = cur
+            padded[pad + len(cur) : pad + len(cur) + len(right)] = right
+
+            denoised = gate.spectral_gating_stationary(padded[np.newaxis])[0][pad : pad + len(cur)]
+            # 修正：處理 NaN 數值防止轉換崩潰
+            yield np.nan_to_num(denoised).astype(np.float32)
+
+            left = np.concatenate([left, cur])[-pad:]
+            cur = nxt
+
+    @staticmethod
+    def _iter_segments(input_file, spill_dir, max_sec=10, gap_threshold_sec=1.0, top_db=35):
+        """
+        串流降噪 + 斷句，逐段 yield (start_ms, end_ms, pcm)；pcm 係 EXPORT_SR mono int16 暫存檔嘅 memmap view。
+        第一輪逐塊降噪，同時用 _FramePower 增量計每格能量 (跨塊保留 carry-over)，
+        降噪結果即場重採樣一次做 EXPORT_SR int16，暫存落 spill_dir 嘅匿名暫存檔 (唔會留喺 slice 目錄)；
+        librosa.effects.split 嘅 ref 係成條訊號嘅最大能量，所以要等第一輪完先判斷有聲區間。
+        第二輪按斷句邏輯 (1 秒空白必斷 / 超過 max_sec 就斷 / 短過 1 秒唔要) 逐段交出，一段確定結束就即刻交出。
+        記憶體只有一塊降噪緩衝同每格一個能量值，片段本身唔複製。
+        """
+        sr = sf.info(input_file).samplerate
+        power = _FramePower()
+        hop = power.hop_length
+        resampler = soxr.ResampleStream(sr, Slice.EXPORT_SR, 1, dtype="float32") if sr != Slice.EXPORT_SR else None
+
+        def to_pcm(y):
+            # 同 soundfile 寫 PCM_16 一樣：clip 再乘 32767
+            return (np.clip(y, -1.0, 1.0) * 32767).astype(np.int16)
+
+        with tempfile.TemporaryFile(dir=spill_dir) as spill:
+            # 1. 逐塊降噪、計能量、重採樣暫存
+            frames = []
+            for block in Slice._iter_denoised_blocks(input_file, sr):
+                frames.append(power.feed(block))
+                if resampler is not None:
+                    block = resampler.resample_chunk(block)
+                spill.write(to_pcm(block).tobytes())
+            frames.append(power.finish())
+            if resampler is not None:
+                spill.write(to_pcm(resampler.resample_chunk(np.zeros(0, dtype=np.float32), last=True)).tobytes())
+            spill.flush()
+
+            frames = np.concatenate(frames)
+            n_samples = power.n_samples
+            n_pcm = spill.tell() // 2
+            if not len(frames) or n_samples == 0 or n_pcm == 0:
+                return
+            # mmap 自己持有 fd，暫存檔關咗之後 view 仍然有效 (匯出 thread 可能仲用緊)
+            pcm = np.memmap(spill, dtype=np.int16, mode="r", shape=(n_pcm,))
+
+            # 2. 搵出「有聲區間」(同 power_to_db(mse, ref=np.max) > -top_db 等價)
+            threshold = max(1e-10, frames.max()) * 10 ** (-top_db / 10)
+            nonsilent = frames > threshold
+            edges = np.flatnonzero(np.diff(nonsilent.astype(np.int8))) + 1
+            if nonsilent[0]:
+                edges = np.concatenate([[0], edges])
+            if nonsilent[-1]:
+                edges = np.concatenate([edges, [len(nonsilent)]])
+            intervals = np.minimum(edges * hop, n_samples).reshape(-1, 2)
+
+            def cut(start_ms, end_ms):
+                return pcm[int(start_ms * Slice.EXPORT_SR / 1000) : int(end_ms * Slice.EXPORT_SR / 1000)]
+
+            # 3. 斷句邏輯 (1秒空白必斷)
+            curr = None
+            for interval_start, interval_end in intervals:
+                next_start_ms = int(interval_start / sr * 1000)
+                next_end_ms = int(interval_end / sr * 1000)
+                if curr is None:
+                    curr = [next_start_ms, next_end_ms]
+                    continue
+
+                gap_duration = next_start_ms - curr[1]
+                current_total_duration = next_end_ms - curr[0]
+
+                if gap_duration >= gap_threshold_sec * 1000 or current_total_duration > max_sec * 1000:
+                    if curr[1] - curr[0] >= 1000:
+                        yield curr[0], curr[1], cut(*curr)
+                    curr = [next_start_ms, next_end_ms]
+                else:
+                    curr[1] = next_end_ms
+
+            if curr is not None and curr[1] - curr[0] >= 1000:
+                yield curr[0], curr[1], cut(*curr)
+
+    @staticmethod
+    def _export_segment(save_dir, filename, pcm, start, end) -> dict:
+        """寫出一段 (喺 thread pool 度行)，回傳 manifest 條目"""
+        sf.write(os.path.join(save_dir, filename), pcm, Slice.EXPORT_SR, subtype="PCM_16")
+        rms = float(np.sqrt(np.mean(np.square(pcm, dtype=np.float64)))) / 32768 if len(pcm) else 0.0
+        logging.info(f"  ✨ 已導出: {filename} ({ (end-start)/1000 }s)")
+        return {
+            "file": filename,
+            "start_ms": start,
+            "end_ms": end,
+            "duration": round(len(pcm) / Slice.EXPORT_SR, 3),
+            "rms": round(rms, 6),
+        }
+
     @staticmethod
     def slice_and_denoise(input_file, output_dir, min_sec=4, max_sec=10, gap_threshold_sec=1.0, top_db=35):
-        os.makedirs(output_dir, exist_ok=True)
-
-        logging.info(f"🚀 啟動降噪 + 拆分流程...")
-        
-        # 1. 載入音訊
-        y, sr = librosa.load(input_file, sr=None)
-        
-        # 2. 執行降噪
-        logging.info("🧹 正在進行 AI 降噪處理...")
-        # 加入 stationary=True 通常對 UVR5 剩低嘅底噪效果更好更穩定
-        y_denoised = nr.reduce_noise(y=y, sr=sr, prop_decrease=0.8, stationary=True)
-        
-        # 修正：處理 NaN 數值防止轉換崩潰
-        y_denoised = np.nan_to_num(y_denoised)
-
-        # 3. 將降噪後嘅數據轉做 pydub 物件 (用 BytesIO 比較穩陣)
-        logging.info("存儲臨時音訊...")
-        buffer = io.BytesIO()
-        sf.write(buffer, y_denoised, sr, format='WAV')
-        buffer.seek(0)
-        audio = AudioSegment.from_file(buffer)
-
-        # 4. 搵出「有聲區間」
+        """
+        降噪 + 拆分，片段寫入 output_dir，另外喺旁邊寫 {output_dir}_manifest.json。
+        片段先寫入隱藏嘅暫存目錄，全部完成先成個目錄 rename 做 output_dir，
+        中途崩潰唔會留低一個「唔係空」但未做完嘅 slice 目錄。
+        """
+        output_dir = os.path.abspath(output_dir)
+        parent_dir, dir_name = os.path.split(output_dir)
+        staging_dir = os.path.join(parent_dir, f".{dir_name}.partial")
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        os.makedirs(staging_dir)
+
+        logging.info(f"🚀 啟動降噪 + 拆分流程 (串流模式)...")
+
+        # 降噪、搵有聲區間、斷句全部逐塊做，記憶體用量同音頻長度無關；
+        # 片段直接係重採樣後暫存檔嘅 view，交畀 thread pool 並行寫出
         # 提高 top_db (e.g., 30) 如果仲係搵唔到聲；降低 (e.g., 40) 如果切得太碎
-        intervals = librosa.effects.split(y_denoised, top_db=top_db)
-        
-        if len(intervals) == 0:
+        with ThreadPoolExecutor(max_workers=Slice.EXPORT_WORKERS) as pool:
+            futures = []
+            for start, end, pcm in Slice._iter_segments(input_file, parent_dir, max_sec, gap_threshold_sec, top_db):
+                if (end - start) < 2000: continue
+                filename = f"{Slice._format_timestamp(start)}.wav"
+                futures.append(pool.submit(Slice._export_segment, staging_dir, filename, pcm, start, end))
+            manifest = [future.result() for future in futures]
+
+        if not manifest:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            os.makedirs(output_dir, exist_ok=True)
             logging.info(f"❌ 依舊搵唔到人聲。試吓將 top_db 較低啲 (而家係 {top_db})")
             return
 
-        final_segments = []
-        curr_start_ms = int(intervals[0][0] / sr * 1000)
-        curr_end_ms = int(intervals[0][1] / sr * 1000)
+        # manifest 先寫 (原子寫入)，再將暫存目錄換入去
+        manifest_file = f"{output_dir}_manifest.json"
+        tmp_manifest = f"{manifest_file}.tmp"
+        with open(tmp_manifest, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_manifest, manifest_file)
 
-        # 5. 斷句邏輯 (1秒空白必斷)
-        for i in range(1, len(intervals)):
-            next_start_ms = int(intervals[i][0] / sr * 1000)
-            next_end_ms = int(intervals[i][1] / sr * 1000)
-            
-            gap_duration = next_start_ms - curr_end_ms
-            current_total_duration = next_end_ms - curr_start_ms
-
-            if gap_duration >= gap_threshold_sec * 1000 or current_total_duration > max_sec * 1000:
-                if curr_end_ms - curr_start_ms >= 1000:
-                    final_segments.append((curr_start_ms, curr_end_ms))
-                curr_start_ms = next_start_ms
-                curr_end_ms = next_end_ms
-            else:
-                curr_end_ms = next_end_ms
-
-        if curr_end_ms - curr_start_ms >= 1000:
-            final_segments.append((curr_start_ms, curr_end_ms))
-
-        # 6. 導出檔案
-        logging.info(f"✂️ 準備導出 {len(final_segments)} 段乾淨片段...")
-        count = 0
-        for start, end in final_segments:
-            if (end - start) < 2000: continue
-            
-            chunk = audio[start:end]
-            chunk = chunk.set_frame_rate(44100).set_channels(1).set_sample_width(2)
-            
-            filename = f"{_format_timestamp(start)}.wav"
-            save_path = os.path.join(output_dir, filename)
-            chunk.export(save_path, format="wav")
-            logging.info(f"  ✨ 已導出: {filename} ({ (end-start)/1000 }s)")
-            count += 1
+        shutil.rmtree(output_dir, ignore_errors=True)
+        os.replace(staging_dir, output_dir)
+
+        logging.info(f"\n🎉 任務完成！成功切出 {len(manifest)} 段。")
+
+
+class _FramePower:
+    """
+    串流版 librosa.feature.rms(...)**2 (center=True，頭尾補零)：
+    逐塊 feed 樣本，回傳已經湊夠一個 frame 嘅能量。
+    """
+
+    def __init__(self, frame_length=2048, hop_length=512):
+        self.frame_length = frame_length
+        self.hop_length = hop_length
+        self.n_samples = 0
+        self.n_frames = 0
+        self._buf = np.zeros(frame_length // 2)
+
+    def feed(self, y):
+        self.n_samples += len(y)
+        self._buf = np.concatenate([self._buf, y])
+        return self._emit()
+
+    def finish(self):
+        self._buf = np.concatenate([self._buf, np.zeros(self.frame_length // 2)])
+        # center=True 時 frame 數 = 1 + len // hop
+        remaining = 1 + self.n_samples // self.hop_length - self.n_frames
+        return self._emit()[:remaining]
+
+    def _emit(self):
+        if len(self._buf) < self.frame_length:
+            return np.zeros(0)
+        n = (len(self._buf) - self.frame_length) // self.hop_length + 1
+        cumsum = np.concatenate([[0.0], np.cumsum(np.square(self._buf, dtype=np.float64))])
+        starts = np.arange(n) * self.hop_length
+        power = (cumsum[starts + self.frame_length] - cumsum[starts]) / self.frame_length
+        self._buf = self._buf[n * self.hop_length :]
+        self.n_frames += n
+        return power
 
-        logging.info(f"\n🎉 任務完成！成功切出 {count} 段。")
 
 if __name__ == "__main__":
     TARGET = "/mnt/data/misc/tts/train/input/F001/1/vocal_main_vocal.wav" 
     OUTPUT = "/tmp/slice_audio"
     
-    slice_and_denoise(TARGET, OUTPUT, top_db=30) # 稍微調低 top_db 等佢易啲搵到聲
\ No newline at end of file
+    Slice.slice_and_denoise(TARGET, OUTPUT, top_db=30) # 稍微調低 top_db 等佢易啲搵到聲
@@ -0,0 +1,242 @@
+import argparse
+import contextlib
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import time
+import uuid
+from pathlib import Path
+from typing import Optional
+from config import Config
+
+_GB = 1024**3
+
+# Linux FICLONE ioctl (btrfs / xfs reflink)
+_FICLONE = 0x40049409
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    stage TEXT NOT NULL,
+    model TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    files TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_entries_lru ON entries (last_used);
+CREATE TABLE IF NOT EXISTS file_hashes (
+    path TEXT PRIMARY KEY,
+    sig TEXT NOT NULL,
+    sha256 TEXT NOT NULL
+);
+"""
+
+
+class StageCache:
+    """
+    以內容定址嘅階段產出緩存。
+    key = (輸入音頻 sha256, 階段, 模型名, 參數)，同一段音頻換咗角色 / 被清空重做都會命中。
+    產出檔以 hard link (跨檔案系統就 reflink / 複製) 存入 objects/，
+    命中時再 link 返入任務目錄；總大小超過上限就按最近使用時間 (LRU) 淘汰。
+    """
+
+    def __init__(self, root: Optional[Path] = None, max_bytes: Optional[int] = None):
+        self.root = root or Config.stage_cache_dir
+        self.max_bytes = max_bytes if max_bytes is not None else int(Config.stage_cache_max_gb * _GB)
+        self.objects_dir = self.root / "objects"
+        self.db_path = self.root / "index.db"
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # daemon 多個任務 thread 會同時用，每次操作各自開 connection
+        conn = sqlite3.connect(str(self.db_path), timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    # --- Key ---
+
+    def file_hash(self, path: Path) -> str:
+        """音頻內容 sha256；(size, mtime_ns, inode) 冇變就用返之前計好嘅"""
+        st = path.stat()
+        sig = f"{st.st_size}:{st.st_mtime_ns}:{st.st_ino}"
+        with self._connect() as conn:
+            row = conn.execute("SELECT sig, sha256 FROM file_hashes WHERE path = ?", (str(path),)).fetchone()
+        if row is not None and row[0] == sig:
+            return row[1]
+
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        sha = digest.hexdigest()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO file_hashes (path, sig, sha256) VALUES (?, ?, ?)",
+                (str(path), sig, sha),
+            )
+        return sha
+
+    def make_key(self, input_file: Path, stage: str, model: str = "", params: Optional[dict] = None) -> str:
+        payload = json.dumps(
+            [self.file_hash(input_file), stage, model, params or {}], sort_keys=True, ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _object_dir(self, key: str) -> Path:
+        return self.objects_dir / key[:2] / key
+
+    # --- 存取 ---
+
+    @staticmethod
+    def _link_or_copy(src: Path, dst: Path):
+        """優先 hard link，跨檔案系統就試 reflink，再唔得先複製"""
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        if dst.exists():
+            dst.unlink()
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+        try:
+            with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+                fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+            return
+        except OSError:
+            pass
+        shutil.copy2(src, dst)
+
+    def fetch(self, key: str, dest_dir: Path) -> Optional[list[str]]:
+        """命中就將產出 link 入 dest_dir，回傳相對路徑列表；冇就回傳 None"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT files FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+
+        files = json.loads(row[0])
+        obj_dir = self._object_dir(key)
+        if not all((obj_dir / name).is_file() for name in files):
+            # object 唔齊 (例如被手動刪咗)，當 miss 並清走紀錄
+            self._remove(key)
+            return None
+
+        for name in files:
+            StageCache._link_or_copy(obj_dir / name, dest_dir / name)
+        with self._connect() as conn:
+            conn.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+        return files
+
+    def store(self, key: str, stage: str, model: str, src_dir: Path, files: list[str]) -> bool:
+        """將 src_dir 入面嘅產出 (相對路徑) 存入緩存"""
+        files = [name for name in files if (src_dir / name).is_file()]
+        if not files:
+            return False
+
+        # 先放入暫存目錄再 rename，避免並行任務見到半套 object
+        obj_dir = self._object_dir(key)
+        tmp_dir = obj_dir.with_name(f".{key}.{uuid.uuid4().hex[:8]}")
+        try:
+            for name in files:
+                StageCache._link_or_copy(src_dir / name, tmp_dir / name)
+            if obj_dir.exists():
+                shutil.rmtree(obj_dir)
+            os.replace(tmp_dir, obj_dir)
+        except OSError as e:
+            logging.warning(f"⚠️ 階段緩存寫入失敗: {e}")
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return False
+
+        size = sum((obj_dir / name).stat().st_size for name in files)
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, stage, model, size, files, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, stage, model, size, json.dumps(files, ensure_ascii=False), now, now),
+            )
+        self.gc()
+        return True
+
+    # --- 淘汰 ---
+
+    def _remove(self, key: str):
+        shutil.rmtree(self._object_dir(key), ignore_errors=True)
+        with self._connect() as conn:
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def total_size(self) -> int:
+        with self._connect() as conn:
+            return conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def gc(self, max_bytes: Optional[int] = None, sweep: bool = False) -> tuple[int, int]:
+        """
+        按 LRU 淘汰到總大小唔超過上限，回傳 (淘汰數目, 釋放 bytes)。
+        sweep 就順手清走崩潰留低嘅暫存目錄同冇紀錄嘅 object (要行勻成個 objects/，只喺 CLI 用)。
+        """
+        if sweep:
+            self._sweep_orphans()
+
+        limit = self.max_bytes if max_bytes is None else max_bytes
+        total = self.total_size()
+        if total <= limit:
+            return 0, 0
+
+        with self._connect() as conn:
+            rows = conn.execute("SELECT key, size FROM entries ORDER BY last_used").fetchall()
+        removed, freed = 0, 0
+        for key, size in rows:
+            if total <= limit:
+                break
+            self._remove(key)
+            total -= size
+            freed += size
+            removed += 1
+
+        logging.info(f"🧹 階段緩存淘汰 {removed} 項，釋放 {freed / _GB:.2f} GB")
+        return removed, freed
+
+    def _sweep_orphans(self):
+        # 留一個鐘，避免刪咗並行任務寫緊嘅
+        with self._connect() as conn:
+            known = {row[0] for row in conn.execute("SELECT key FROM entries")}
+        stale_before = time.time() - 3600
+        for prefix_dir in self.objects_dir.iterdir():
+            for obj_dir in prefix_dir.iterdir():
+                if obj_dir.name not in known and obj_dir.stat().st_mtime < stale_before:
+                    shutil.rmtree(obj_dir, ignore_errors=True)
+
+    def stats(self) -> dict[str, tuple[int, int]]:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT stage, COUNT(*), SUM(size) FROM entries GROUP BY stage").fetchall()
+        return {stage: (count, size) for stage, count, size in rows}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    parser = argparse.ArgumentParser(description="內容定址階段緩存")
+    parser.add_argument("command", choices=["gc", "stats"])
+    parser.add_argument("--max_gb", type=float, default=None, help="gc 用嘅上限 (GB)，預設 Config.stage_cache_max_gb")
+    args = parser.parse_args()
+
+    cache = StageCache()
+    if args.command == "gc":
+        max_bytes = int(args.max_gb * _GB) if args.max_gb is not None else None
+        removed, freed = cache.gc(max_bytes, sweep=True)
+        logging.info(f"✅ gc 完成: 淘汰 {removed} 項，釋放 {freed / _GB:.2f} GB，剩餘 {cache.total_size() / _GB:.2f} GB")
+    elif args.command == "stats":
+        for stage, (count, size) in sorted(cache.stats().items()):
+            print(f"{stage:>10}: {count:>6} 項  {size / _GB:8.2f} GB")
+        print(f"{'total':>10}: {cache.total_size() / _GB:.2f} GB / {cache.max_bytes / _GB:.2f} GB")
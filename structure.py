@@ -13,6 +13,10 @@ class Task(BaseModel):
     
     # 這些是計算出來的欄位，設為 Optional
     in_process: bool = False
+    # 任務追蹤檔 (斷點續做用)，預設係 Config.train_task_file；並行模式下每個任務一個
+    task_file: Optional[Path] = None
+    # 第一次被發現嘅時間 (daemon 模式)，用嚟計排隊時間
+    queued_at: Optional[float] = None
     vocal_dir: Optional[Path] = None
     inst_dir: Optional[Path] = None
     train_dir: Optional[Path] = None
@@ -23,10 +27,12 @@ class Task(BaseModel):
     docker_vocal_dir: Optional[Path] = None
     docker_inst_dir: Optional[Path] = None
     docker_train_dir: Optional[Path] = None
-    docker_slice_ir: Optional[Path] = None
+    docker_slice_dir: Optional[Path] = None
 
     # Pydantic 專用：初始化後執行路徑計算
     def model_post_init(self, __context):
+        if self.task_file is None:
+            self.task_file = Config.train_task_file
 
         # --- Host 路徑邏輯 ---
         self.char_dir = Config.dirs["TRAIN_INPUT"] / self.character_name
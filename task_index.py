@@ -0,0 +1,341 @@
+import argparse
+import logging
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+from structure import Task
+from config import Config
+from tools.tools import Tools
+
+# 每個音頻嘅處理階段 (extract → dereverb → deecho → slice → asr → done)
+# stage 代表「下一步要做乜」，asr 即係已切片、等待標註；done 即係已寫出 slice.list
+STAGES = ["extract", "dereverb", "deecho", "slice", "asr", "done"]
+
+# 可排程嘅階段同對應任務，排序即係排程優次 (同 TrainPipeline.TASK_ORDER 一致)
+STAGE_TASKS = {
+    "asr": ("ASR", ""),
+    "slice": ("Slice_Audio", ""),
+    "deecho": ("UVR5", "deecho"),
+    "dereverb": ("UVR5", "dereverb"),
+    "extract": ("UVR5", "extract"),
+}
+STAGE_PRIORITY = {stage: i for i, stage in enumerate(STAGE_TASKS)}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS audios (
+    character_name TEXT NOT NULL,
+    audio_name TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    priority INTEGER,
+    source_path TEXT NOT NULL,
+    source_size INTEGER NOT NULL,
+    source_mtime_ns INTEGER NOT NULL,
+    updated_at REAL NOT NULL,  -- 進入呢個階段嘅時間 (Task.queued_at，排程 aging 用)
+    PRIMARY KEY (character_name, audio_name, stage)
+);
+CREATE INDEX IF NOT EXISTS idx_audios_next ON audios (priority, character_name, audio_name);
+"""
+
+
+class TaskIndex:
+    """
+    TRAIN_INPUT 嘅持久化任務索引 (SQLite)。
+    記錄每個音頻目前嘅階段、來源檔大小同 mtime，
+    目錄 mtime 冇變就唔再重新檢查；檔案驗證經 Tools.probe_audio 嘅 probe cache。
+    """
+
+    def __init__(self, db_path: Optional[Path] = None):
+        self.db_path = db_path or Config.task_index_file
+        self.base_dir: Path = Config.dirs["TRAIN_INPUT"]
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.db_path), timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(_SCHEMA)
+        # 可排程階段有改動 (例如新增咗 asr) 時，舊紀錄嘅優次跟返而家嘅 STAGE_PRIORITY
+        with self.conn:
+            for stage in STAGES:
+                self.conn.execute(
+                    "UPDATE audios SET priority = ? WHERE stage = ? AND priority IS NOT ?",
+                    (STAGE_PRIORITY.get(stage), stage, STAGE_PRIORITY.get(stage)),
+                )
+
+    def close(self):
+        self.conn.close()
+
+    # --- 檔案 / 目錄狀態 ---
+
+    def _valid_audio(self, path: Path):
+        """回傳有效音頻檔嘅 stat，唔存在或者唔係音頻就回傳 None"""
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            return None
+        return st if Tools.is_audio_file(path) else None
+
+    def _dir_changed(self, path: Path, mtime_ns: int) -> bool:
+        row = self.conn.execute("SELECT mtime_ns FROM dirs WHERE path = ?", (str(path),)).fetchone()
+        return row is None or row[0] != mtime_ns
+
+    def _mark_dir(self, path: Path, mtime_ns: int):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO dirs (path, mtime_ns) VALUES (?, ?)", (str(path), mtime_ns)
+        )
+
+    def _forget_char(self, char_name: str, char_dir: Path):
+        prefix = f"{char_dir}/%"
+        self.conn.execute("DELETE FROM audios WHERE character_name = ?", (char_name,))
+        self.conn.execute("DELETE FROM dirs WHERE path = ? OR path LIKE ?", (str(char_dir), prefix))
+
+    def _put(self, char_name: str, audio_name: str, stage: str, source: Path, st, since: Optional[float] = None):
+        """since：重新檢查前已經喺同一階段嘅話沿用原本嘅 updated_at，等待時間唔會因為重掃而歸零"""
+        self.conn.execute(
+            "INSERT OR REPLACE INTO audios "
+            "(character_name, audio_name, stage, priority, source_path, source_size, source_mtime_ns, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                char_name,
+                audio_name,
+                stage,
+                STAGE_PRIORITY.get(stage),
+                str(source),
+                st.st_size,
+                st.st_mtime_ns,
+                since or time.time(),
+            ),
+        )
+
+    # --- 增量更新 ---
+
+    def _audio_dir_stage(self, audio_dir: Path):
+        """按 Slice / UVR5 finder 嘅規則推算音頻目錄嘅階段，回傳 (stage, source, stat)"""
+        final_vocal = audio_dir / "vocal_main_vocal.wav"
+        try:
+            st = final_vocal.stat()
+        except FileNotFoundError:
+            st = None
+        if st is not None:
+            slice_dir = audio_dir / "slice"
+            if slice_dir.is_dir() and any(slice_dir.iterdir()):
+                if (audio_dir / f"{slice_dir.name}.list").exists():
+                    return "done", final_vocal, st
+                return "asr", final_vocal, st
+            return "slice", final_vocal, st
+
+        main_vocal = audio_dir / "main_vocal.wav"
+        st = self._valid_audio(main_vocal)
+        if st is not None:
+            return "deecho", main_vocal, st
+
+        vocal = audio_dir / "vocal.wav"
+        st = self._valid_audio(vocal)
+        if st is not None:
+            return "dereverb", vocal, st
+        return None, None, None
+
+    def _refresh_raw_files(self, char_name: str, raw_files: list[Path]):
+        known = {
+            audio_name: (source_path, size, mtime_ns, updated_at)
+            for audio_name, source_path, size, mtime_ns, updated_at in self.conn.execute(
+                "SELECT audio_name, source_path, source_size, source_mtime_ns, updated_at FROM audios "
+                "WHERE character_name = ? AND stage = 'extract'",
+                (char_name,),
+            )
+        }
+        # 同名 (stem) 嘅多個檔案以排最後嘅有效檔為準 (同以前 INSERT OR REPLACE 一致)
+        chosen: dict[str, tuple[Path, os.stat_result]] = {}
+        for file in raw_files:
+            try:
+                st = file.stat()
+            except FileNotFoundError:
+                continue
+            row = known.get(file.stem)
+            unchanged = row is not None and row[:3] == (str(file), st.st_size, st.st_mtime_ns)
+            if unchanged or Tools.is_audio_file(file):
+                chosen[file.stem] = (file, st)
+
+        for audio_name in known:
+            if audio_name not in chosen:
+                self.conn.execute(
+                    "DELETE FROM audios WHERE character_name = ? AND audio_name = ? AND stage = 'extract'",
+                    (char_name, audio_name),
+                )
+        for audio_name, (file, st) in chosen.items():
+            row = known.get(audio_name)
+            if row is not None and row[:3] == (str(file), st.st_size, st.st_mtime_ns):
+                continue
+            self._put(char_name, audio_name, "extract", file, st)
+
+    def _refresh_char(self, char_dir: Path, force: bool):
+        char_name = char_dir.name
+        try:
+            char_st = char_dir.stat()
+        except FileNotFoundError:
+            self._forget_char(char_name, char_dir)
+            return
+        if not char_dir.is_dir():
+            return
+
+        char_changed = force or self._dir_changed(char_dir, char_st.st_mtime_ns)
+        audio_dirs = []
+        raw_files = []
+        for item in sorted(char_dir.iterdir()):
+            if item.is_dir():
+                audio_dirs.append(item)
+            elif item.is_file() and not item.name.startswith("."):
+                raw_files.append(item)
+
+        # 1. 原始音檔 (extract 任務)：每次都 stat，大小 / mtime 同記錄唔同或者未有記錄先重新驗證。
+        #    複製緊嘅檔案驗證失敗，原地複製完唔會改角色目錄 mtime，所以唔可以只靠目錄 mtime
+        self._refresh_raw_files(char_name, raw_files)
+
+        if char_changed:
+            # 2. 角色目錄有增減：清走已消失嘅音頻目錄
+            names = {d.name for d in audio_dirs}
+            rows = self.conn.execute(
+                "SELECT DISTINCT audio_name FROM audios WHERE character_name = ? AND stage != 'extract'",
+                (char_name,),
+            ).fetchall()
+            for (audio_name,) in rows:
+                if audio_name not in names:
+                    self.conn.execute(
+                        "DELETE FROM audios WHERE character_name = ? AND audio_name = ? AND stage != 'extract'",
+                        (char_name, audio_name),
+                    )
+
+        # 3. 逐個音頻目錄檢查，目錄 (同 slice 子目錄) mtime 冇變就跳過
+        for audio_dir in audio_dirs:
+            slice_dir = audio_dir / "slice"
+            mtime_ns = audio_dir.stat().st_mtime_ns
+            slice_mtime_ns = slice_dir.stat().st_mtime_ns if slice_dir.is_dir() else 0
+            if not force and not self._dir_changed(audio_dir, mtime_ns) and not self._dir_changed(
+                slice_dir, slice_mtime_ns
+            ):
+                continue
+
+            previous = self.conn.execute(
+                "SELECT stage, updated_at FROM audios WHERE character_name = ? AND audio_name = ? AND stage != 'extract'",
+                (char_name, audio_dir.name),
+            ).fetchone()
+            self.conn.execute(
+                "DELETE FROM audios WHERE character_name = ? AND audio_name = ? AND stage != 'extract'",
+                (char_name, audio_dir.name),
+            )
+            stage, source, st = self._audio_dir_stage(audio_dir)
+            if stage is not None:
+                since = previous[1] if previous is not None and previous[0] == stage else None
+                self._put(char_name, audio_dir.name, stage, source, st, since)
+            self._mark_dir(audio_dir, mtime_ns)
+            self._mark_dir(slice_dir, slice_mtime_ns)
+
+        self._mark_dir(char_dir, char_st.st_mtime_ns)
+
+    def refresh(self, char_dirs: Optional[Iterable[Path]] = None, force: bool = False):
+        """增量更新索引；char_dirs 只更新指定角色目錄 (None = 全部)"""
+        if char_dirs is None:
+            if not self.base_dir.exists():
+                logging.warning(f"Input 目錄不存在: {self.base_dir}")
+                return
+            char_dirs = [d for d in self.base_dir.iterdir() if d.is_dir()]
+            # 全樹更新時順手清走已刪除嘅角色
+            names = {d.name for d in char_dirs}
+            for (char_name,) in self.conn.execute("SELECT DISTINCT character_name FROM audios").fetchall():
+                if char_name not in names:
+                    self._forget_char(char_name, self.base_dir / char_name)
+
+        with self.conn:
+            for char_dir in sorted(char_dirs):
+                self._refresh_char(char_dir, force)
+
+    def _candidate_files(self) -> list[Path]:
+        """列出所有可能要 probe 嘅檔案 (原始音檔 / vocal.wav / main_vocal.wav)"""
+        files = []
+        for char_dir in self.base_dir.iterdir():
+            if not char_dir.is_dir():
+                continue
+            for item in char_dir.iterdir():
+                if item.is_file() and not item.name.startswith("."):
+                    files.append(item)
+                elif item.is_dir():
+                    for name in ("vocal.wav", "main_vocal.wav"):
+                        if (item / name).exists():
+                            files.append(item / name)
+        return files
+
+    def rebuild(self):
+        """同檔案系統完全對數：清空階段記錄，並行預熱 probe cache，再重新檢查所有目錄"""
+        with self.conn:
+            self.conn.execute("DELETE FROM audios")
+            self.conn.execute("DELETE FROM dirs")
+        if self.base_dir.exists():
+            Tools.probe_audio_files(self._candidate_files())
+        self.refresh(force=True)
+
+    # --- 查詢 ---
+
+    @staticmethod
+    def _to_task(row) -> Task:
+        char_name, audio_name, stage, source_path, updated_at = row
+        cmd, sub_cmd = STAGE_TASKS[stage]
+        return Task(
+            cmd=cmd,
+            sub_cmd=sub_cmd,
+            file_path=Path(source_path),
+            character_name=char_name,
+            audio_name=audio_name,
+            queued_at=updated_at,
+        )
+
+    def next_task(self) -> Optional[Task]:
+        row = self.conn.execute(
+            "SELECT character_name, audio_name, stage, source_path, updated_at FROM audios "
+            "WHERE priority IS NOT NULL ORDER BY priority, character_name, audio_name LIMIT 1"
+        ).fetchone()
+        return TaskIndex._to_task(row) if row else None
+
+    def iter_pending_tasks(self, char_names: Optional[Iterable[str]] = None) -> Iterator[Task]:
+        sql = (
+            "SELECT character_name, audio_name, stage, source_path, updated_at FROM audios "
+            "WHERE priority IS NOT NULL"
+        )
+        params: list = []
+        if char_names is not None:
+            char_names = list(char_names)
+            sql += f" AND character_name IN ({','.join('?' * len(char_names))})"
+            params.extend(char_names)
+        sql += " ORDER BY priority, character_name, audio_name"
+        for row in self.conn.execute(sql, params).fetchall():
+            yield TaskIndex._to_task(row)
+
+    def stage_counts(self) -> dict[str, int]:
+        rows = self.conn.execute("SELECT stage, COUNT(*) FROM audios GROUP BY stage").fetchall()
+        return {stage: count for stage, count in rows}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    parser = argparse.ArgumentParser(description="TRAIN_INPUT 任務索引")
+    parser.add_argument("command", choices=["rebuild", "refresh", "next", "stats"])
+    args = parser.parse_args()
+
+    index = TaskIndex()
+    if args.command == "rebuild":
+        index.rebuild()
+        logging.info(f"✅ 索引重建完成: {index.stage_counts()}")
+    elif args.command == "refresh":
+        index.refresh()
+        logging.info(f"✅ 索引更新完成: {index.stage_counts()}")
+    elif args.command == "next":
+        task = index.next_task()
+        print(task.to_json() if task else "冇待處理任務")
+    elif args.command == "stats":
+        counts = index.stage_counts()
+        for stage in STAGES:
+            print(f"{stage:>10}: {counts.get(stage, 0)}")
+    index.close()
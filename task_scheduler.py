@@ -0,0 +1,167 @@
+import argparse
+import logging
+import time
+from typing import Iterable, NamedTuple, Optional
+from structure import Task
+from config import Config
+from metrics import Metrics
+from run_asr import ASR
+from run_slice import Slice
+from tools.tools import Tools
+from uvr5 import UVR5
+
+_GB = 1024**3
+_MB = 1024**2
+
+
+class Estimate(NamedTuple):
+    seconds: float
+    vram_bytes: int
+    # 需要 GPU 嘅分離任務 (UVR5)；其餘 (Slice / ASR) 當輕量任務
+    heavy: bool
+
+
+class TaskScheduler:
+    """
+    成本模型調度器。
+    用 probe 到嘅音頻長度 × 歷史每個模型嘅實時倍率 (metrics.py 記錄) 估計每個任務要行幾耐、用幾多 VRAM；
+    夜間時段 (Config.is_night_task_time) 優先做重型分離，日間優先做切片 / ASR，
+    日間只接受估計夠短嘅分離任務，長嘅留返夜晚；同類任務之間最短作業優先 (SJF)，
+    排得耐嘅任務會慢慢升級，唔會被源源不絕嘅短任務餓死。
+    """
+
+    def __init__(self, refresh_sec: float = 600.0):
+        # train_pipeline 會反過嚟用調度器，喺呢度先 import 避免循環
+        from train_pipeline import TrainPipeline
+
+        # 同估計耗時嘅任務用返 TASK_ORDER 排 (下游階段先做，盡快出完整結果)
+        self._task_order = {key: i for i, key in enumerate(TrainPipeline.TASK_ORDER)}
+        # 歷史倍率每隔 refresh_sec 先重新讀一次 metrics 檔
+        self.refresh_sec = refresh_sec
+        self._rtf: dict[str, float] = {}
+        self._vram: dict[str, int] = {}
+        self._loaded_at = 0.0
+
+    # --- 歷史 ---
+
+    def _load_history(self):
+        if time.time() - self._loaded_at < self.refresh_sec:
+            return
+        since = time.time() - Config.sched_history_days * 86400
+        records = list(Metrics.read_records(since))
+        self._rtf = {
+            model: rtf
+            for model, count, _audio, _wall, rtf, _compute in Metrics.rtf_by_model(records)
+            if count >= Config.sched_min_samples and rtf > 0
+        }
+        self._vram = {}
+        for record in records:
+            if record.get("peak_vram_mb") and record.get("model"):
+                peak = int(record["peak_vram_mb"] * _MB)
+                self._vram[record["model"]] = max(self._vram.get(record["model"], 0), peak)
+        self._loaded_at = time.time()
+
+    @staticmethod
+    def model_name(task: Task) -> str:
+        """任務用嘅模型名 (同 metrics 紀錄嘅 model 欄一致)"""
+        if task.cmd == "UVR5":
+            return UVR5.model_name(task)
+        if task.cmd == "Slice_Audio":
+            return Slice.MODEL_NAME
+        if task.cmd == "ASR":
+            return ASR.model_name()
+        return task.cmd
+
+    @staticmethod
+    def _job_key(task: Task) -> tuple[str, str]:
+        return (task.cmd, UVR5.job_type(task) if task.cmd == "UVR5" else task.sub_cmd)
+
+    # --- 估計 ---
+
+    def estimate(self, task: Task) -> Estimate:
+        self._load_history()
+        key = TaskScheduler._job_key(task)
+        model = TaskScheduler.model_name(task)
+
+        probe_info = Tools.probe_audio(task.file_path)
+        duration = (probe_info or {}).get("duration") or Config.sched_default_duration_sec
+        rtf = self._rtf.get(model) or Config.sched_default_rtf.get(key, 10.0)
+
+        # Config 嘅峰值已包 CUDA context；歷史量到嘅 (torch 配置峰值) 超過佢先用歷史值 + 預留
+        configured = int(Config.task_vram_gb.get(key, 0.0) * _GB)
+        observed = self._vram.get(model, 0)
+        vram = max(configured, int(observed + Config.sched_vram_overhead_gb * _GB)) if observed else configured
+        # ASR 雖然都用 GPU，但係輕量任務，日間照做
+        return Estimate(duration / rtf, vram, task.cmd == "UVR5")
+
+    # --- 排序 ---
+
+    def priority(self, task: Task, is_night: bool, now: Optional[float] = None) -> Optional[tuple]:
+        """
+        排序 key (越細越優先)；回傳 None 代表而家唔應該開始 (日間嘅長分離任務)。
+        key = (類別, 有效耗時, TASK_ORDER 次序, 路徑)
+        """
+        est = self.estimate(task)
+        if is_night:
+            klass = 0 if est.heavy else 1
+        elif not est.heavy:
+            klass = 0
+        elif est.seconds <= Config.sched_day_heavy_max_sec:
+            klass = 1
+        else:
+            return None
+
+        # 等得越耐有效耗時越短 (aging)，避免長任務一直被短任務插隊
+        wait = (now or time.time()) - task.queued_at if task.queued_at else 0.0
+        effective = est.seconds - Config.sched_aging * wait
+
+        rank = self._task_order.get((task.cmd, task.sub_cmd), len(self._task_order))
+        return (klass, effective, rank, str(task.file_path))
+
+    def order(self, tasks: Iterable[Task]) -> list[Task]:
+        """按目前時段將任務排序，並剔走而家唔應該開始嘅任務"""
+        is_night = Config.is_night_task_time()
+        now = time.time()
+        keyed = []
+        for task in tasks:
+            key = self.priority(task, is_night, now)
+            if key is not None:
+                keyed.append((key, task))
+        keyed.sort(key=lambda kt: kt[0])
+        return [task for _key, task in keyed]
+
+    def pick(self, tasks: Iterable[Task]) -> Optional[Task]:
+        ordered = self.order(tasks)
+        return ordered[0] if ordered else None
+
+
+if __name__ == "__main__":
+    from task_index import TaskIndex
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    parser = argparse.ArgumentParser(description="顯示待處理任務嘅估計耗時同排程次序")
+    parser.add_argument("--night", action="store_true", help="當夜間時段咁排")
+    args = parser.parse_args()
+
+    scheduler = TaskScheduler()
+    index = TaskIndex()
+    try:
+        index.refresh()
+        tasks = list(index.iter_pending_tasks())
+    finally:
+        index.close()
+
+    is_night = args.night or Config.is_night_task_time()
+    rows = []
+    for task in tasks:
+        est = scheduler.estimate(task)
+        key = scheduler.priority(task, is_night)
+        rows.append((key is None, key or (), task, est))
+    rows.sort(key=lambda r: (r[0], r[1]))
+
+    print(f"{'次序':>4} {'任務':<18} {'音頻':<40} {'估計s':>9} {'VRAM GB':>8}")
+    for i, (deferred, _key, task, est) in enumerate(rows, 1):
+        label = f"{task.cmd}/{task.sub_cmd}" if task.sub_cmd else task.cmd
+        rank = "夜間" if deferred else str(i)
+        print(f"{rank:>4} {label:<18} {task.character_name + '/' + task.audio_name:<40} {est.seconds:>9.1f} {est.vram_bytes / _GB:>8.1f}")
@@ -0,0 +1,68 @@
+"""
+TaskIndex 增量更新：原始音檔喺複製途中被掃描 (驗證失敗)，原地複製完之後 (角色目錄 mtime 冇變) 都要排到 extract 任務。
+ffprobe 用假嘅 probe_audio 代替：內容夠長先當係有效音頻。
+"""
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from config import Config  # noqa: E402
+from task_index import TaskIndex  # noqa: E402
+from tools.tools import Tools  # noqa: E402
+
+FULL = b"RIFF" + b"\0" * 4096
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    monkeypatch.setitem(Config.dirs, "TRAIN_INPUT", tmp_path / "input")
+    monkeypatch.setattr(
+        Tools, "probe_audio", staticmethod(lambda p: {"duration": 1.0} if Path(p).read_bytes() == FULL else None)
+    )
+    (tmp_path / "input" / "A").mkdir(parents=True)
+    idx = TaskIndex(tmp_path / "index.db")
+    yield idx
+    idx.conn.close()
+
+
+def _pending(idx):
+    return [(t.sub_cmd, t.audio_name) for t in idx.iter_pending_tasks()]
+
+
+def test_half_copied_file_is_queued_after_copy_finishes(index):
+    char_dir = index.base_dir / "A"
+    raw = char_dir / "x.wav"
+    raw.write_bytes(FULL[:100])
+    index.refresh()
+    assert _pending(index) == []
+
+    dir_mtime = char_dir.stat().st_mtime_ns
+    with open(raw, "ab") as f:
+        f.write(FULL[100:])
+    os.utime(char_dir, ns=(dir_mtime, dir_mtime))
+    index.refresh()
+    assert _pending(index) == [("extract", "x")]
+
+
+def test_raw_file_replaced_in_place_is_revalidated(index):
+    char_dir = index.base_dir / "A"
+    raw = char_dir / "x.wav"
+    raw.write_bytes(FULL)
+    index.refresh()
+    assert _pending(index) == [("extract", "x")]
+    queued_at = next(index.iter_pending_tasks()).queued_at
+
+    # 冇改動：唔重新驗證，排隊時間照舊
+    index.refresh()
+    assert next(index.iter_pending_tasks()).queued_at == queued_at
+
+    # 原地覆寫成壞檔：任務要消失
+    dir_mtime = char_dir.stat().st_mtime_ns
+    raw.write_bytes(b"broken")
+    os.utime(char_dir, ns=(dir_mtime, dir_mtime))
+    index.refresh()
+    assert _pending(index) == []
@@ -0,0 +1,86 @@
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+
+class ProbeCache:
+    """
+    ffprobe 結果緩存 (LRU + JSON 持久化)。
+    以 path 做 key，記錄 (size, mtime_ns, inode)；檔案有任何改動就當 cache miss。
+    值係第一條音頻 stream 嘅資料 (codec / channels / sample_rate / duration)，
+    唔係音頻檔就儲 None。
+    """
+
+    def __init__(self, cache_file: Path, max_entries: int = 100_000, save_every: int = 200):
+        self.cache_file = cache_file
+        self.max_entries = max_entries
+        self.save_every = save_every
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        # save 由多條 thread 觸發 (probe_audio_files / JobDispatcher)，寫 tmp + rename 要逐個嚟
+        self._save_lock = threading.Lock()
+        self._dirty = 0
+        self._load()
+
+    @staticmethod
+    def _signature(st: os.stat_result) -> list:
+        return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+    def _load(self):
+        if not self.cache_file.exists():
+            return
+        try:
+            data = json.loads(self.cache_file.read_text(encoding="utf-8"))
+            for key, entry in data.items():
+                self._entries[key] = entry
+        except Exception as e:
+            logging.warning(f"⚠️ Probe cache 讀取失敗，重新建立: {e}")
+            self._entries.clear()
+
+    def save(self):
+        """
+        原子寫入 (先寫 tmp 再 rename)，避免中途崩潰留低壞檔。
+        成個 snapshot + 寫入 + rename 都喺 _save_lock 入面：同一個 tmp 檔唔會畀兩條 thread 同時寫，
+        舊 snapshot 亦唔會蓋過新嘅
+        """
+        with self._save_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                data = json.dumps(self._entries, ensure_ascii=False)
+                self._dirty = 0
+            try:
+                self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+                tmp_file = self.cache_file.with_name(f"{self.cache_file.name}.{os.getpid()}.tmp")
+                tmp_file.write_text(data, encoding="utf-8")
+                os.replace(tmp_file, self.cache_file)
+            except Exception as e:
+                logging.warning(f"⚠️ Probe cache 寫入失敗: {e}")
+
+    def get(self, path: Path, st: os.stat_result):
+        """
+        回傳 (hit, info)。hit 為 False 代表要重新 probe。
+        """
+        key = str(path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry["sig"] != self._signature(st):
+                return False, None
+            self._entries.move_to_end(key)
+            return True, entry["info"]
+
+    def put(self, path: Path, st: os.stat_result, info: Optional[dict]):
+        key = str(path)
+        with self._lock:
+            self._entries[key] = {"sig": self._signature(st), "info": info}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._dirty += 1
+            need_save = self._dirty >= self.save_every
+        if need_save:
+            self.save()
@@ -1,33 +1,62 @@
+import atexit
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import logging
 from pathlib import Path
 import shutil
 import subprocess
 import tarfile
+import time
+import threading
+from typing import Optional
 
 import ffmpeg
 from sympy import re
 import torch
 
 from config import Config
+from metrics import Metrics
+from tools.probe_cache import ProbeCache
 
 
 class Tools:
+    # ffprobe 結果緩存 (第一次用先載入)
+    _probe_cache: Optional[ProbeCache] = None
+    # probe_audio_files 嘅 thread pool 同 JobDispatcher 嘅 thread 都會第一次攞 cache，唔好建兩個
+    _probe_cache_lock = threading.Lock()
+
     @staticmethod
-    def run_docker(confs: list[str], image_name: str, args: list[str]) -> bool:
-        # 攞到目前最空閒粒 GPU (例如 "cuda:0")
-        device_str, is_half = Tools.get_best_device()
-        # 轉做 docker 需要嘅 ID (例如 "0")
-        device_id = device_str.split(":")[-1] if "cuda" in device_str else "all"
+    def run_docker(
+        confs: list[str],
+        image_name: str,
+        args: list[str],
+        device_str: Optional[str] = None,
+        container_name: Optional[str] = None,
+    ) -> bool:
+        """
+        :param device_str: 指定設備 (例如 "cuda:1" / "cpu")，None 就自動揀最空閒粒 GPU
+        :param container_name: 指定 container 名，方便調度器追蹤
+        """
+        auto_device = device_str is None
+        if auto_device:
+            # 攞到目前最空閒粒 GPU (例如 "cuda:0")
+            device_str, is_half = Tools.get_best_device()
 
         # 基礎指令
         cmd = [
             "docker",
             "run",
             "--rm",
-            "--gpus",
-            f"device={device_id}"
         ]
+
+        # 轉做 docker 需要嘅 ID (例如 "0")；調度器指明用 CPU 就唔掛 GPU
+        if "cuda" in device_str:
+            cmd.extend(["--gpus", f"device={device_str.split(':')[-1]}"])
+        elif auto_device:
+            cmd.extend(["--gpus", "all"])
+
+        if container_name is not None:
+            cmd.extend(["--name", container_name])
         
         cmd.extend(confs)
         
@@ -41,6 +70,7 @@ class Tools:
 
             # 唔用 capture_output，改用 stdout=subprocess.PIPE
             # 咁樣可以即時將 Docker 嘅 output 導向到你個 log 檔
+            launched_at = time.time()
             with subprocess.Popen(
                 cmd,
                 stdout=subprocess.PIPE,
@@ -48,9 +78,18 @@ class Tools:
                 text=True,
                 bufsize=1,
             ) as p:
+                first_output = True
                 for line in p.stdout:
+                    line = line.strip()
+                    if first_output:
+                        # 第一行輸出之前嘅時間當做 container 啟動 (拉起 container + import)
+                        Metrics.record_stage("container_start", time.time() - launched_at)
+                        first_output = False
+                    # container 嘅量度行 (METRIC {...}) 收入任務量度，唔再寫 log
+                    if Metrics.parse_docker_line(line):
+                        continue
                     # 去除換行符號並寫入 logging
-                    logging.info(f"[{image_name}] [Docker Output] {line.strip()}")
+                    logging.info(f"[{image_name}] [Docker Output] {line}")
 
                 p.wait()
                 if p.returncode == 0:
@@ -67,9 +106,10 @@ class Tools:
             return False
 
     @staticmethod
-    def is_docker_running(image_name: str) -> bool:
+    def is_docker_running(image_name: str, ignore_prefix: Optional[str] = None) -> bool:
         """
         檢查是否有基於該 Image Name 的 Container 正在執行中
+        :param ignore_prefix: 名以呢個前綴開頭嘅 container 唔計 (例如閒置等 job 嘅常駐 worker)
         """
         try:
             # 使用 docker ps 過濾 ancestor (祖先鏡像)
@@ -80,16 +120,33 @@ class Tools:
                 "--filter",
                 f"ancestor={image_name}",
                 "--format",
-                "{{.Image}}",
+                "{{.Names}}",
             ]
             result = subprocess.run(cmd, capture_output=True, text=True, check=True)
 
-            # 如果輸出包含 image_name，代表至少有一個 Container 行緊
-            return image_name in result.stdout
+            # 有任何一個 (唔係被忽略嘅) Container 行緊
+            names = result.stdout.split()
+            if ignore_prefix is not None:
+                names = [name for name in names if not name.startswith(ignore_prefix)]
+            return bool(names)
         except Exception as e:
             logging.error(f"檢查 Image 狀態時出錯: {e}")
             return False
 
+    @staticmethod
+    def get_gpu_mem_info() -> list[tuple[int, int, int]]:
+        """回傳每粒 GPU 嘅 (id, 剩餘顯存, 總顯存)，單位 bytes；冇 CUDA 回傳空 list"""
+        if not torch.cuda.is_available():
+            return []
+        infos = []
+        for i in range(torch.cuda.device_count()):
+            try:
+                free_mem, total_mem = torch.cuda.mem_get_info(i)
+                infos.append((i, free_mem, total_mem))
+            except Exception as e:
+                logging.error(f"查詢 GPU:{i} 資訊失敗: {e}")
+        return infos
+
     @staticmethod
     def get_best_device():
         """
@@ -137,16 +194,72 @@ class Tools:
         return infer_device, is_half
 
     @staticmethod
-    def is_audio_file(file_path: Path) -> bool:
-        """使用 ffprobe 檢查是否為有效的音頻檔案"""
+    def _get_probe_cache() -> ProbeCache:
+        with Tools._probe_cache_lock:
+            if Tools._probe_cache is None:
+                Tools._probe_cache = ProbeCache(Config.probe_cache_file)
+                atexit.register(Tools._probe_cache.save)
+            return Tools._probe_cache
+
+    @staticmethod
+    def _ffprobe_audio(file_path: Path) -> tuple[Optional[dict], bool]:
+        """
+        行 ffprobe，回傳 (第一條音頻 stream 嘅資料, 結果可唔可以 cache)；唔係音頻檔資料係 None。
+        ffprobe 行完話唔係音頻先係確定結果；ffprobe 行唔到 / 出錯 (例如讀檔失敗) 就唔好 cache 住個 None
+        """
         try:
             probe = ffmpeg.probe(str(file_path))
-            for stream in probe.get("streams", []):
-                if stream.get("codec_type") == "audio":
-                    return True
-        except Exception:
-            return False
-        return False
+        except ffmpeg.Error:
+            # ffprobe 正常退出但認唔到呢個檔
+            return None, True
+        except Exception as e:
+            logging.warning(f"⚠️ ffprobe 執行失敗 ({file_path}): {e}")
+            return None, False
+
+        for stream in probe.get("streams", []):
+            if stream.get("codec_type") == "audio":
+                duration = stream.get("duration") or probe.get("format", {}).get("duration")
+                return {
+                    "codec": stream.get("codec_name"),
+                    "channels": stream.get("channels"),
+                    "sample_rate": int(stream.get("sample_rate", 0)),
+                    "duration": float(duration) if duration else None,
+                }, True
+        return None, True
+
+    @staticmethod
+    def probe_audio(file_path: Path) -> Optional[dict]:
+        """
+        攞音頻資料 (codec / channels / sample_rate / duration)，
+        有 cache 就唔再行 ffprobe；唔係音頻檔或者讀唔到回傳 None
+        """
+        try:
+            st = file_path.stat()
+        except OSError:
+            return None
+
+        cache = Tools._get_probe_cache()
+        hit, info = cache.get(file_path, st)
+        if hit:
+            return info
+
+        info, cacheable = Tools._ffprobe_audio(file_path)
+        if cacheable:
+            cache.put(file_path, st, info)
+        return info
+
+    @staticmethod
+    def probe_audio_files(file_paths: list[Path], max_workers: int = 8) -> dict[Path, Optional[dict]]:
+        """並行 probe 一批檔案 (冷啟動掃描大量檔案時用)"""
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = dict(zip(file_paths, executor.map(Tools.probe_audio, file_paths)))
+        Tools._get_probe_cache().save()
+        return results
+
+    @staticmethod
+    def is_audio_file(file_path: Path) -> bool:
+        """使用 ffprobe 檢查是否為有效的音頻檔案 (結果有 cache)"""
+        return Tools.probe_audio(file_path) is not None
 
     @staticmethod
     def clear_folder_contents(folder_path: Path):
@@ -0,0 +1,147 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+from pathlib import Path
+from typing import Optional
+
+# inotify 常數 (見 <sys/inotify.h>)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+_WATCH_MASK = (
+    IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+)
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class InputWatcher:
+    """
+    用 inotify 監察 TRAIN_INPUT 目錄樹 (input / 角色 / 音頻 三層)。
+    wait() 回傳有變動嘅角色目錄；回傳 None 代表要全樹重新掃描
+    (例如 event queue 溢出，或者系統唔支援 inotify 而退返去 polling)。
+    """
+
+    def __init__(self, root: Path, depth: int = 2):
+        self.root = root
+        self.depth = depth
+        self._wd_paths: dict[int, Path] = {}
+        self._fd: Optional[int] = None
+
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            self._inotify_add_watch = libc.inotify_add_watch
+            self._inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_init1 失敗")
+            self._fd = fd
+        except (OSError, AttributeError) as e:
+            logging.warning(f"⚠️ 無法使用 inotify，改用定時掃描: {e}")
+            return
+
+        self._add_tree(self.root, 0)
+
+    @property
+    def is_polling(self) -> bool:
+        return self._fd is None
+
+    def _add_tree(self, path: Path, level: int):
+        if self._fd is None or not path.is_dir():
+            return
+        wd = self._inotify_add_watch(self._fd, os.fsencode(path), _WATCH_MASK)
+        if wd < 0:
+            logging.warning(f"⚠️ 無法監察目錄: {path} (errno={ctypes.get_errno()})")
+            return
+        self._wd_paths[wd] = path
+
+        if level < self.depth:
+            for sub in path.iterdir():
+                if sub.is_dir():
+                    self._add_tree(sub, level + 1)
+
+    def _char_dir_of(self, path: Path) -> Optional[Path]:
+        """將任何監察中嘅路徑對應返去佢所屬嘅角色目錄"""
+        try:
+            rel = path.relative_to(self.root)
+        except ValueError:
+            return None
+        if not rel.parts:
+            return None
+        return self.root / rel.parts[0]
+
+    def wait(self, timeout: float) -> Optional[set[Path]]:
+        """
+        等候目錄變動，最多等 timeout 秒。
+        回傳: 有變動嘅角色目錄 set (可以係空 set)，或者 None 代表需要全樹掃描
+        """
+        if self._fd is None:
+            select.select([], [], [], timeout)
+            return None
+
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+
+        changed: set[Path] = set()
+        full_rescan = False
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, _cookie, name_len = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset : offset + name_len].rstrip(b"\0")
+            offset += name_len
+
+            if mask & IN_Q_OVERFLOW:
+                full_rescan = True
+                continue
+
+            parent = self._wd_paths.get(wd)
+            if parent is None:
+                continue
+
+            if mask & IN_IGNORED:
+                self._wd_paths.pop(wd, None)
+                continue
+
+            # 檔案剛建立時可能仲寫緊，等 IN_CLOSE_WRITE 先當係變動
+            if mask & IN_CREATE and not mask & IN_ISDIR:
+                continue
+
+            path = parent / os.fsdecode(name) if name else parent
+            level = len(path.relative_to(self.root).parts)
+
+            # 新建立 / 搬入嘅目錄，只要未超過監察深度就加 watch
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO) and level <= self.depth:
+                self._add_tree(path, level)
+
+            char_dir = self._char_dir_of(path)
+            if char_dir is not None:
+                changed.add(char_dir)
+
+        return None if full_rescan else changed
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+            self._wd_paths.clear()
@@ -1,15 +1,16 @@
+import argparse
 import logging
 from logging.handlers import TimedRotatingFileHandler
 import sys
-import traceback
 from pathlib import Path
 from structure import Task
 from config import Config
 from tools.tools import Tools
+from train_daemon import TrainDaemon
 from train_pipeline import TrainPipeline
 
 # 設定 Log 檔案路徑
-LOCK_FILE = Path("/tmp/tts_train.lock")
+LOCK_FILE = Config.train_lock_file
 
 LOG_DIR = Config.dirs["TRAIN_ROOT"] / "log"
 LOG_DIR.mkdir(parents=True, exist_ok=True)
@@ -38,7 +39,19 @@ logging.basicConfig(
     ],
 )
 
+def ensure_dirs():
+    # 確保所有 Config 入面定義嘅 path 都存在
+    for name, path in Config.dirs.items():
+        if not path.exists():
+            logging.info(f"正在建立目錄: {path}")
+            path.mkdir(parents=True, exist_ok=True)
+
 def main():
+    # 0. Daemon 行緊就由佢負責，cron 只係後備
+    if TrainDaemon.is_running():
+        logging.debug("Daemon 執行中，跳過巡檢。")
+        return
+
     # 1. 檢查鎖定狀態 (原子操作守門員)
     if LOCK_FILE.exists():
         # 定期巡檢通常用 debug，避免 log 塞滿無謂訊息
@@ -48,11 +61,7 @@ def main():
     if TrainPipeline.hv_docker_running():
         return
 
-    # 確保所有 Config 入面定義嘅 path 都存在
-    for name, path in Config.dirs.items():
-        if not path.exists():
-            logging.info(f"正在建立目錄: {path}")
-            path.mkdir(parents=True, exist_ok=True)
+    ensure_dirs()
 
     task : Task = None
 
@@ -75,35 +84,20 @@ def main():
     if task is None:
         return
 
-    # 5. 正式開始處理流程
-    try:
-        # 獲取鎖定文件
-        LOCK_FILE.touch()
-        
-        logging.info("=" * 60)
-        logging.info(f"🚀 啟動任務: [{task.cmd} - {task.sub_cmd}]")
-        logging.info(f"   角色: {task.character_name}")
-        logging.info(f"   音頻名稱: {task.audio_name}")
-        logging.info(f"   檔案: {task.file_path.name}")
-        logging.info(f"   執行中的任務: {task.in_process}")
-        logging.info("-" * 60)
-
-        # 執行封裝好的流水線邏輯
-        # 內部應包含 UVR5 Task Docker 调用、ASR API 调用等
-        TrainPipeline.process(task)
-
-        logging.info("✅ 該項流水線任務執行成功。")
+    # 5. 正式開始處理流程 (鎖定 / 執行 / 釋放)
+    TrainPipeline.run_locked(task)
 
-    except Exception as e:
-        logging.error(f"❌ 流水線執行失敗: {str(e)}")
-        # 記錄詳細堆疊追蹤，方便 debug
-        logging.error(traceback.format_exc())
-    finally:
-        # 6. 釋放鎖定
-        if LOCK_FILE.exists():
-            LOCK_FILE.unlink()
-        logging.info("🔚 任務序列結束，已釋放 VRAM 鎖定。")
-        logging.info("=" * 60)
+def daemon(poll_interval: float):
+    ensure_dirs()
+    TrainDaemon(poll_interval=poll_interval).run()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="TTS 訓練流水線")
+    parser.add_argument("--daemon", action="store_true", help="常駐模式：監察 input 目錄，有新檔即刻處理")
+    parser.add_argument("--poll_interval", type=float, default=30.0, help="daemon 模式冇 event 時嘅檢查間隔 (秒)")
+    args = parser.parse_args()
+
+    if args.daemon:
+        daemon(args.poll_interval)
+    else:
+        main()
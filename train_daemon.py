@@ -0,0 +1,179 @@
+import logging
+import os
+import signal
+import time
+from pathlib import Path
+from typing import Iterable, Optional
+from structure import Task
+from task_index import TaskIndex
+from config import Config
+from job_dispatcher import JobDispatcher
+from task_scheduler import TaskScheduler
+from tools.watcher import InputWatcher
+from train_pipeline import TrainPipeline
+
+
+class TrainDaemon:
+    """
+    常駐模式：用 inotify 監察 TRAIN_INPUT，喺記憶體入面維持待處理任務 queue。
+    新檔案放入去之後即刻排隊處理，唔使等 cron 下一次巡檢，
+    亦唔使每次重新 import torch / 初始化 CUDA。
+    任務經 JobDispatcher 按 VRAM 同 slot 並行派發去多粒 GPU / CPU，
+    每個任務有自己嘅追蹤檔 (Config.train_task_dir)，重啟後會續做。
+    """
+
+    def __init__(self, poll_interval: float = 30.0):
+        self.base_dir: Path = Config.dirs["TRAIN_INPUT"]
+        # 冇 event 時最長等幾耐再檢查一次 (亦係失敗任務嘅冷卻時間)
+        self.poll_interval = poll_interval
+        self.watcher: Optional[InputWatcher] = None
+        self.index: Optional[TaskIndex] = None
+        self.dispatcher: Optional[JobDispatcher] = None
+        self.scheduler: Optional[TaskScheduler] = None
+        self._ready: dict[tuple[str, str, str], Task] = {}
+        # 處理到一半、等緊重新派發嘅任務 (優先過 ready queue)
+        self._resumed: list[Task] = []
+        # 失敗任務 → 可以再試嘅時間
+        self._cooldown: dict[tuple[str, str, str], float] = {}
+        # 任務第一次被發現嘅時間 (重新掃描都保留)，量度排隊時間用
+        self._first_seen: dict[tuple[str, str, str], float] = {}
+        self._stopping = False
+
+    # --- PID 檔 ---
+
+    @staticmethod
+    def is_running() -> bool:
+        """檢查是否已經有 daemon 行緊 (cron 模式用嚟讓路)"""
+        pid_file = Config.train_daemon_pid_file
+        if not pid_file.exists():
+            return False
+        try:
+            pid = int(pid_file.read_text().strip())
+            os.kill(pid, 0)
+        except (ValueError, ProcessLookupError):
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    def _stop(self, signum, frame):
+        logging.info(f"🛑 收到信號 {signum}，完成目前任務後停止 daemon。")
+        self._stopping = True
+
+    # --- Ready Queue ---
+
+    @staticmethod
+    def _task_key(task: Task) -> tuple[str, str, str]:
+        return (task.cmd, task.sub_cmd, str(task.file_path))
+
+    def _scan(self, char_dirs: Optional[Iterable[Path]] = None):
+        """更新指定角色目錄 (None = 全樹) 嘅任務索引，再同步 ready queue"""
+        names = None
+        if char_dirs is None:
+            self._ready.clear()
+        else:
+            char_dirs = list(char_dirs)
+            names = {d.name for d in char_dirs}
+            for key, task in list(self._ready.items()):
+                if task.character_name in names:
+                    del self._ready[key]
+
+        self.index.refresh(char_dirs)
+        now = time.time()
+        for task in self.index.iter_pending_tasks(names):
+            key = self._task_key(task)
+            task.queued_at = self._first_seen.setdefault(key, task.queued_at or now)
+            self._ready.setdefault(key, task)
+        if char_dirs is None:
+            # 全樹掃描後清走已經唔再待處理嘅紀錄
+            self._first_seen = {key: t for key, t in self._first_seen.items() if key in self._ready}
+
+    def _dispatch(self):
+        """按優次將 ready queue 入面收得落嘅任務派發出去"""
+        now = time.time()
+        busy = self.dispatcher.busy_audios()
+
+        # 1. 優先續做處理到一半嘅任務
+        for task in list(self._resumed):
+            if (task.character_name, task.audio_name) in busy:
+                continue
+            if self.dispatcher.submit(task):
+                self._resumed.remove(task)
+                busy.add((task.character_name, task.audio_name))
+
+        # 2. 再按成本模型 (時段 + 估計耗時，最短優先) 派發 ready queue；
+        #    日間嘅長分離任務唔會出現喺排序結果，留待夜間；某類任務收唔落就唔再試同類
+        rejected: set[tuple[str, str]] = set()
+        for task in self.scheduler.order(self._ready.values()):
+            key = TrainDaemon._task_key(task)
+            if (task.cmd, task.sub_cmd) in rejected:
+                continue
+            if (task.character_name, task.audio_name) in busy:
+                continue
+            if self._cooldown.get(key, 0) > now:
+                continue
+            if self.dispatcher.submit(task):
+                del self._ready[key]
+                self._first_seen.pop(key, None)
+                busy.add((task.character_name, task.audio_name))
+            else:
+                rejected.add((task.cmd, task.sub_cmd))
+
+    def _wait_changes(self, timeout: float):
+        """等候目錄變動並更新 ready queue"""
+        changed = self.watcher.wait(timeout)
+        if changed is None:
+            self._scan()
+        elif changed:
+            self._scan(changed)
+
+    # --- Main Loop ---
+
+    def run(self):
+        if TrainDaemon.is_running():
+            logging.info("已經有 daemon 執行中，唔再重複啟動。")
+            return
+
+        Config.train_daemon_pid_file.write_text(str(os.getpid()))
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        # cron 模式可能有任務行緊，等佢釋放鎖定先接手
+        while Config.train_lock_file.exists() and not self._stopping:
+            logging.info("⏳ cron 任務仍在執行中，等候鎖定釋放...")
+            time.sleep(self.poll_interval)
+
+        self.watcher = InputWatcher(self.base_dir)
+        self.index = TaskIndex()
+        self.scheduler = TaskScheduler()
+        self.dispatcher = JobDispatcher(scheduler=self.scheduler)
+        logging.info(f"👀 Daemon 啟動，監察目錄: {self.base_dir}")
+        try:
+            self._resumed = TrainPipeline.chk_process_tasks()
+            self._scan()
+            while not self._stopping:
+                # 1. 收返已完成嘅任務，佢哋嘅產出會改變該角色目錄嘅狀態
+                finished = self.dispatcher.reap()
+                for job in finished:
+                    if not job.success:
+                        # 避免失敗任務不停重試
+                        self._cooldown[TrainDaemon._task_key(job.task)] = time.time() + self.poll_interval
+                if finished:
+                    self._scan({job.task.char_dir for job in finished})
+
+                # 2. 派發收得落嘅任務
+                self._dispatch()
+
+                # 3. 有任務行緊就短時間 poll 返，等佢哋完成
+                timeout = 1.0 if self.dispatcher.running_count else self.poll_interval
+                self._wait_changes(timeout)
+        finally:
+            if self.dispatcher.running_count:
+                logging.info(f"⏳ 等候 {self.dispatcher.running_count} 個執行中任務完成: {self.dispatcher.running_containers()}")
+                self.dispatcher.wait_all()
+                self.dispatcher.reap()
+            self.watcher.close()
+            self.index.close()
+            if Config.train_daemon_pid_file.exists():
+                Config.train_daemon_pid_file.unlink()
+            logging.info("👋 Daemon 已停止。")
@@ -0,0 +1,4 @@
+#!/bin/bash
+cd /mnt/data/docker/tts || exit
+source .venv/bin/activate
+exec python train.py --daemon
@@ -4,9 +4,13 @@ import shutil
 import traceback
 import subprocess
 from pathlib import Path
+from typing import Optional
 import ffmpeg
+from metrics import Metrics
+from run_asr import ASR
 from run_slice import Slice
 from structure import Task
+from task_index import TaskIndex
 from config import Config
 from pydantic import BaseModel
 from tools.tools import Tools
@@ -14,11 +18,20 @@ from uvr5 import UVR5
 
 
 class TrainPipeline:
+    # 任務優次 (越前越優先)，cron 同 daemon 模式共用
+    TASK_ORDER = [
+        ("ASR", ""),
+        ("Slice_Audio", ""),
+        ("UVR5", "deecho"),
+        ("UVR5", "dereverb"),
+        ("UVR5", "extract"),
+    ]
+
     @staticmethod
     def hv_docker_running() -> bool:
-        """檢查是否有 Docker 任務執行中"""
+        """檢查是否有 Docker 任務執行中 (常駐 UVR5 worker 閒置時都喺度，唔計)"""
         for cmd, image_name in Config.docker_imgs.items():
-            if Tools.is_docker_running(image_name):
+            if Tools.is_docker_running(image_name, ignore_prefix=Config.uvr5_worker_container_prefix):
                 logging.info(f"Docker 任務 [{cmd}] 正在執行中")
                 return True
         return False
@@ -34,16 +47,81 @@ class TrainPipeline:
         return None
 
     @staticmethod
-    def process(task: Task):
+    def chk_process_tasks() -> list[Task]:
+        """列出所有處理到一半嘅任務 (cron 嘅 .task.json 同並行模式嘅 .tasks/*.json)"""
+        tasks = []
+        task = TrainPipeline.chk_process_task()
+        if task is not None:
+            tasks.append(task)
+        if Config.train_task_dir.exists():
+            for file in sorted(Config.train_task_dir.glob("*.json")):
+                task = Task.from_file(file)
+                task.in_process = True
+                tasks.append(task)
+        return tasks
+
+    @staticmethod
+    def run_task(
+        task: Task, device: Optional[str] = None, container_name: Optional[str] = None
+    ) -> bool:
+        """執行單一任務並記錄 log，回傳是否成功"""
+        logging.info("=" * 60)
+        logging.info(f"🚀 啟動任務: [{task.cmd} - {task.sub_cmd}]")
+        logging.info(f"   角色: {task.character_name}")
+        logging.info(f"   音頻名稱: {task.audio_name}")
+        logging.info(f"   檔案: {task.file_path.name}")
+        logging.info(f"   執行中的任務: {task.in_process}")
+        if device is not None:
+            logging.info(f"   設備: {device}")
+        logging.info("-" * 60)
+
+        # 輸入音頻長度 (probe 有 cache)，量度用嚟計實時倍率
+        probe_info = Tools.probe_audio(task.file_path)
+        with Metrics.track(task, device, probe_info.get("duration") if probe_info else None) as metrics:
+            try:
+                # 執行封裝好的流水線邏輯
+                # 內部應包含 UVR5 Task Docker 调用、ASR API 调用等
+                TrainPipeline.process(task, device, container_name)
+
+                metrics["success"] = True
+                logging.info(f"✅ [{task.cmd} - {task.sub_cmd}] {task.audio_name} 流水線任務執行成功。")
+                return True
+
+            except Exception as e:
+                logging.error(f"❌ [{task.cmd} - {task.sub_cmd}] {task.audio_name} 流水線執行失敗: {str(e)}")
+                # 記錄詳細堆疊追蹤，方便 debug
+                logging.error(traceback.format_exc())
+                return False
+
+    @staticmethod
+    def run_locked(task: Task) -> bool:
+        """持有鎖定檔期間執行單一任務 (cron 模式)，回傳是否成功"""
+        try:
+            # 獲取鎖定文件
+            Config.train_lock_file.touch()
+            return TrainPipeline.run_task(task)
+        finally:
+            # 釋放鎖定
+            if Config.train_lock_file.exists():
+                Config.train_lock_file.unlink()
+            logging.info("🔚 任務序列結束，已釋放 VRAM 鎖定。")
+            logging.info("=" * 60)
+
+    @staticmethod
+    def process(
+        task: Task, device: Optional[str] = None, container_name: Optional[str] = None
+    ):
         try:
             if task.cmd == "UVR5":
-                UVR5.process_uvr5_task(task)
+                UVR5.process_uvr5_task(task, device, container_name)
             elif task.cmd == "Slice_Audio":
                 Slice.process_slick_audio_task(task)
+            elif task.cmd == "ASR":
+                ASR.process_asr_task(task, device, container_name)
 
-            if Config.train_task_file.exists():
-                Config.train_task_file.unlink()
-                logging.info(f"🗑️ 已刪除任務追蹤檔: {Config.train_task_file}")
+            if task.task_file.exists():
+                task.task_file.unlink()
+                logging.info(f"🗑️ 已刪除任務追蹤檔: {task.task_file}")
             return
 
         except Exception as e:
@@ -53,28 +131,18 @@ class TrainPipeline:
     @staticmethod
     def chk_standard_task() -> Task:
         """根據時間判斷執行的任務優次"""
-        # 檢查時間狀態 (Config 內定義)
-        is_night_time: bool = Config.is_night_task_time()
-
-        task : Task = None
-        
-        if task is None:
-            task = Slice.get_slick_audio_task()
-        if task is None:
-            task = UVR5.get_uvr5_deecho_vocal_task()
-        if task is None:
-            task = UVR5.get_uvr5_dereverb_vocal_task()
-        if task is None:
-            task = UVR5.get_uvr5_extract_vocal_task()
-    
-        return task
-
-
-
-
-
-
-
-
-
+        # 用任務索引代替逐個目錄 iterdir + ffprobe，只會重新檢查 mtime 有變嘅目錄；
+        # 再由成本模型調度器按時段 (Config.is_night_task_time) 同估計耗時揀下一個
+        from task_scheduler import TaskScheduler
 
+        index = TaskIndex()
+        try:
+            index.refresh()
+            tasks = list(index.iter_pending_tasks())
+        finally:
+            index.close()
+
+        task: Task = TaskScheduler().pick(tasks)
+        if task is None and tasks:
+            logging.debug(f"日間時段，{len(tasks)} 個長分離任務留待夜間處理。")
+        return task
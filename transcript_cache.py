@@ -0,0 +1,114 @@
+import argparse
+import contextlib
+import hashlib
+import logging
+import sqlite3
+import time
+from pathlib import Path
+from typing import Iterable, Optional
+from config import Config
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS transcripts (
+    sha256 TEXT NOT NULL,
+    model TEXT NOT NULL,
+    language TEXT NOT NULL,
+    text TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (sha256, model, language)
+);
+CREATE INDEX IF NOT EXISTS idx_transcripts_lru ON transcripts (last_used);
+"""
+
+
+class TranscriptCache:
+    """
+    逐個切片嘅轉寫緩存。
+    key = (切片內容 sha256, ASR 模型, 語言)；用唔同 top_db 重新切片時，
+    冇變過嘅片段 (同一段 PCM 寫出嚟嘅 wav 一模一樣) 直接用返之前嘅文本，只有新片段先要轉寫。
+    """
+
+    def __init__(self, db_path: Optional[Path] = None):
+        self.db_path = db_path or Config.transcript_cache_file
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # daemon 多個任務 thread 會同時用，每次操作各自開 connection
+        conn = sqlite3.connect(str(self.db_path), timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def file_hash(path: Path) -> str:
+        """切片細，直接成個讀入計 sha256"""
+        return hashlib.sha256(path.read_bytes()).hexdigest()
+
+    def lookup(self, hashes: Iterable[str], model: str, language: str) -> dict[str, str]:
+        """回傳命中嘅 {sha256: text}，順手更新最近使用時間"""
+        hashes = list(set(hashes))
+        found = {}
+        with self._connect() as conn:
+            # SQLite 參數上限，分批查
+            for i in range(0, len(hashes), 500):
+                batch = hashes[i : i + 500]
+                rows = conn.execute(
+                    f"SELECT sha256, text FROM transcripts WHERE model = ? AND language = ? "
+                    f"AND sha256 IN ({','.join('?' * len(batch))})",
+                    [model, language, *batch],
+                ).fetchall()
+                found.update(rows)
+            now = time.time()
+            conn.executemany(
+                "UPDATE transcripts SET last_used = ? WHERE sha256 = ? AND model = ? AND language = ?",
+                [(now, sha, model, language) for sha in found],
+            )
+        return found
+
+    def store(self, transcripts: dict[str, str], model: str, language: str):
+        """存入 {sha256: text}"""
+        if not transcripts:
+            return
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO transcripts (sha256, model, language, text, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(sha, model, language, text, now, now) for sha, text in transcripts.items()],
+            )
+
+    def gc(self, max_age_days: float) -> int:
+        """清走超過 max_age_days 冇用過嘅紀錄，回傳清走數目"""
+        with self._connect() as conn:
+            cur = conn.execute("DELETE FROM transcripts WHERE last_used < ?", (time.time() - max_age_days * 86400,))
+            removed = cur.rowcount
+        logging.info(f"🧹 轉寫緩存清走 {removed} 項")
+        return removed
+
+    def stats(self) -> dict[tuple[str, str], int]:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT model, language, COUNT(*) FROM transcripts GROUP BY model, language").fetchall()
+        return {(model, language): count for model, language, count in rows}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    parser = argparse.ArgumentParser(description="切片轉寫緩存")
+    parser.add_argument("command", choices=["gc", "stats"])
+    parser.add_argument("--days", type=float, default=180, help="gc 清走幾多日冇用過嘅紀錄")
+    args = parser.parse_args()
+
+    cache = TranscriptCache()
+    if args.command == "gc":
+        cache.gc(args.days)
+    elif args.command == "stats":
+        for (model, language), count in sorted(cache.stats().items()):
+            print(f"{model:>20} {language:>4}: {count:>8} 項")
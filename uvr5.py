@@ -1,134 +1,180 @@
+import json
 import logging
 import shutil
 from pathlib import Path
+from typing import Optional
 from structure import Task
 from config import Config
 from pydantic import BaseModel
 
+from metrics import Metrics
+from stage_cache import StageCache
 from tools.tools import Tools
+from uvr5_worker import UVR5WorkerClient
 
 
 class UVR5:
+    # 單獨任務：container 喺 vocal_dir 產出嘅檔名 pattern → 搬去 train_dir 嘅檔名
+    OUTPUT_FILES = {
+        "extract": ("*_vocals.wav", "vocal.wav"),
+        "dereverb": ("*.wav_main_vocal.wav", "main_vocal.wav"),
+        "deecho": ("*.wav_10.wav", "vocal_main_vocal.wav"),
+    }
 
     @staticmethod
-    def _find_task_in_folders(
-        sub_cmd: str, input_filename: str, output_filename: str = None
-    ) -> Task:
-        """
-        通用遍歷邏輯
-        :param sub_cmd: 子命令 (extract/dereverb/deecho)
-        :param input_filename: 來源檔名 (extract 模式下不適用)
-        :param output_filename: 產出檔名 (用嚟 check 係咪處理咗)
-        """
-        base_dir = Config.dirs["TRAIN_INPUT"]
-        if not base_dir.exists():
-            logging.warning(f"Input 目錄不存在: {base_dir}")
-            return None
-
-        for sub_dir in sorted(base_dir.iterdir()):
-            if not sub_dir.is_dir():
-                continue
-
-            char_name = sub_dir.name
-
-            # 處理 extract：直接喺角色目錄搵 file
-            if sub_cmd == "extract":
-                for file in sorted(sub_dir.iterdir()):
-                    if (
-                        file.is_file()
-                        and not file.name.startswith(".")
-                        and Tools.is_audio_file(file)
-                    ):
-                        return Task(
-                            cmd="UVR5",
-                            sub_cmd="extract",
-                            file_path=file,
-                            character_name=char_name,
-                            audio_name=file.stem,
-                        )
-
-            # 處理 deecho / dereverb：喺 audio_dir 入面搵
-            else:
-                for audio_dir in sorted(sub_dir.iterdir()):
-                    if not audio_dir.is_dir():
-                        continue
-
-                    audio_name = audio_dir.name
-                    vocal_path = audio_dir / input_filename
-                    result_path = (
-                        audio_dir / output_filename if output_filename else None
-                    )
-
-                    # Check 來源存在 同埋 結果未存在
-                    if vocal_path.exists() and Tools.is_audio_file(vocal_path):
-                        if (
-                            result_path
-                            and result_path.exists()
-                            and Tools.is_audio_file(result_path)
-                        ):
-                            continue  # 做咗喇，跳過
-
-                        return Task(
-                            cmd="UVR5",
-                            sub_cmd=sub_cmd,
-                            file_path=vocal_path,
-                            character_name=char_name,
-                            audio_name=audio_name,
-                        )
-        return None
+    def job_type(task: Task) -> str:
+        """實際交畀 container 嘅任務類型；chain 模式下 extract 會一次過做埋 dereverb / deecho"""
+        if task.sub_cmd == "extract" and Config.uvr5_chain_mode:
+            return "chain"
+        return task.sub_cmd
 
     @staticmethod
-    def get_uvr5_deecho_vocal_task() -> Task:
-        return UVR5._find_task_in_folders(
-            "deecho", "main_vocal.wav", "vocal_main_vocal.wav"
-        )
+    def model_name(task: Task) -> str:
+        """任務用嘅模型 (chain 係三個模型用 + 連埋)，同階段緩存 / 量度紀錄一致"""
+        job_type = UVR5.job_type(task)
+        keep_intermediates = job_type == "chain" and Config.uvr5_chain_keep_intermediates
+        return UVR5._stage_cache_entry(job_type, keep_intermediates)[1]
 
     @staticmethod
-    def get_uvr5_dereverb_vocal_task() -> Task:
-        return UVR5._find_task_in_folders("dereverb", "vocal.wav", "main_vocal.wav")
+    def _collect_chain_outputs(task: Task) -> bool:
+        """chain 模式：搬 vocal_main_vocal.wav (同保留咗嘅中間檔) 去 train_dir"""
+        timing_file = task.vocal_dir / "chain_timing.json"
+        if timing_file.exists():
+            timings = json.loads(timing_file.read_text(encoding="utf-8"))
+            logging.info(
+                f"⏱️ [UVR5 chain] {task.audio_name}: "
+                + " | ".join(f"{k} {v}s" for k, v in timings.items())
+            )
+            timing_file.unlink()
+
+        final_vocal = task.vocal_dir / "vocal_main_vocal.wav"
+        if not (final_vocal.exists() and Tools.is_audio_file(final_vocal)):
+            return False
+
+        for name in ("vocal.wav", "main_vocal.wav", "vocal_main_vocal.wav"):
+            src = task.vocal_dir / name
+            if src.exists():
+                dest = task.train_dir / name
+                shutil.move(str(src), str(dest))
+                logging.info(f"✅ 已提取人聲: {dest}")
+        return True
 
     @staticmethod
-    def get_uvr5_extract_vocal_task() -> Task:
-        return UVR5._find_task_in_folders("extract", "")
+    def _stage_cache_entry(job_type: str, keep_intermediates: bool):
+        """階段緩存嘅 (stage, model, params, 產出檔)；產出檔係相對 train_dir 嘅路徑"""
+        if job_type == "chain":
+            model = "+".join(Config.uvr5_models[s] for s in ("extract", "dereverb", "deecho"))
+            files = ["vocal_main_vocal.wav"]
+            if keep_intermediates:
+                files = ["vocal.wav", "main_vocal.wav"] + files
+            return "uvr5_chain", model, {"keep_intermediates": keep_intermediates}, files
+
+        store_file_name = {
+            "extract": "vocal.wav",
+            "dereverb": "main_vocal.wav",
+            "deecho": "vocal_main_vocal.wav",
+        }[job_type]
+        return f"uvr5_{job_type}", Config.uvr5_models[job_type], {}, [store_file_name]
 
     @staticmethod
-    def process_uvr5_task(task: Task):
-        if not task.in_process:
-            Tools.clear_folder_contents(task.vocal_dir)
-            Tools.clear_folder_contents(task.inst_dir)
-
-            task.to_file(Config.train_task_file)
-            Tools.run_docker(
-                [
-                    "-e",
-                    "PYTHONPATH=/app:/app/uvr5",
-                    "-v",
-                    f"{Config.dirs['DATA_ROOT']}:{Config.docker_root}",
-                ],
-                Config.docker_imgs[task.cmd],
-                [
-                    "--task_type",
-                    task.sub_cmd,
-                    "--file_path",
-                    str(task.docker_file_path),
-                    "--vocal_dir",
-                    str(task.docker_vocal_dir),
-                    "--inst_dir",
-                    str(task.docker_inst_dir),
-                ],
-            )
+    def process_uvr5_task(
+        task: Task, device: Optional[str] = None, container_name: Optional[str] = None
+    ):
+        job_type = UVR5.job_type(task)
+        keep_intermediates = job_type == "chain" and Config.uvr5_chain_keep_intermediates
+
+        # 0. 同一段音頻 (同模型同參數) 做過就直接由階段緩存 link 返結果
+        cache, cache_key = None, None
+        stage, model, params, cache_files = UVR5._stage_cache_entry(job_type, keep_intermediates)
+        Metrics.annotate(model=model)
+        if Config.stage_cache_enabled and task.file_path.exists():
+            cache = StageCache()
+            cache_key = cache.make_key(task.file_path, stage, model, params)
+            if not task.in_process and cache.fetch(cache_key, task.train_dir):
+                logging.info(f"♻️ 命中階段緩存 [{stage}] {task.character_name}/{task.audio_name}，跳過處理")
+                Metrics.annotate(cache_hit=True)
+                UVR5._backup_original(task)
+                return
+
+        # 續做嘅任務如果 container 未寫出結果 (中途崩潰)，就重新執行；
+        # vocal_dir 入面嘅 .checkpoint 冇清走，Roformer / MDX 會由上次 commit 嘅 chunk 繼續
+        resume = task.in_process and task.file_path.exists() and not UVR5._has_outputs(task, job_type)
+        if resume:
+            logging.info(f"🔁 {task.character_name}/{task.audio_name} 上次中斷時未有產出，由斷點繼續處理...")
+
+        if not task.in_process or resume:
+            if not task.in_process:
+                Tools.clear_folder_contents(task.vocal_dir)
+                Tools.clear_folder_contents(task.inst_dir)
+
+                task.to_file(task.task_file)
+
+            # 將 host 已 cache 嘅 probe 結果傳入 container，慳返一次 ffprobe
+            probe_info = Tools.probe_audio(task.file_path)
+
+            # 1. 優先用常駐 worker (模型已經喺記憶體)
+            result = None
+            if Config.uvr5_worker_enabled:
+                result = UVR5WorkerClient.get(device).run_job(
+                    job_type,
+                    [
+                        {
+                            "file_path": task.file_path,
+                            "vocal_dir": task.vocal_dir,
+                            "inst_dir": task.inst_dir,
+                            "probe_info": probe_info,
+                            "keep_intermediates": keep_intermediates,
+                        }
+                    ],
+                )
+                if result is False:
+                    # job 失敗或者 worker 中途崩潰：報錯等 daemon 冷卻後再重試，唔好當成功
+                    raise RuntimeError(f"UVR5 worker 處理失敗: {task.character_name}/{task.audio_name}")
+
+            # 2. worker 用唔到就退返一次性 docker run
+            if result is None:
+                extra_args = []
+                if probe_info is not None:
+                    extra_args += ["--probe_info", json.dumps(probe_info)]
+                if keep_intermediates:
+                    extra_args.append("--keep_intermediates")
+
+                ok = Tools.run_docker(
+                    [
+                        "-e",
+                        "PYTHONPATH=/app:/app/uvr5",
+                        "-v",
+                        f"{Config.dirs['DATA_ROOT']}:{Config.docker_root}",
+                    ],
+                    Config.docker_imgs[task.cmd],
+                    [
+                        "--task_type",
+                        job_type,
+                        "--file_path",
+                        str(task.docker_file_path),
+                        "--vocal_dir",
+                        str(task.docker_vocal_dir),
+                        "--inst_dir",
+                        str(task.docker_inst_dir),
+                    ]
+                    + extra_args,
+                    device_str=device,
+                    container_name=container_name,
+                )
+                if not ok:
+                    raise RuntimeError(f"UVR5 執行失敗: {task.character_name}/{task.audio_name}")
+
+        if job_type == "chain":
+            logging.info(f"正在整理 {task.character_name} 的串連處理結果...")
+            if UVR5._collect_chain_outputs(task):
+                if cache is not None:
+                    cache.store(cache_key, stage, model, task.train_dir, cache_files)
+                UVR5._backup_original(task)
+            else:
+                raise RuntimeError(f"在 {task.vocal_dir} 找不到 vocal_main_vocal.wav")
+            return
 
-        find_file_name: str = None
-        store_file_name: str = None
-        if task.sub_cmd == "extract":
-            find_file_name = "*_vocals.wav"
-            store_file_name = "vocal.wav"
-        elif task.sub_cmd == "dereverb":
-            find_file_name = "*.wav_main_vocal.wav"
-            store_file_name = "main_vocal.wav"
-        elif task.sub_cmd == "deecho":
-            find_file_name = "*.wav_10.wav"
-            store_file_name = "vocal_main_vocal.wav"
+        find_file_name, store_file_name = UVR5.OUTPUT_FILES.get(task.sub_cmd, (None, None))
 
         if not find_file_name is None:
             logging.info(f"正在整理 {task.character_name} 的提取結果...")
@@ -151,15 +197,28 @@ class UVR5:
                         logging.error(f"❌ 搵到嘅人聲檔損毀或格式不正確: {vocal_file}")
 
             if is_find_file:
-                # 3. Check 吓是否有 Original Audio File, if yes, move to train directory
-                if task.file_path.exists() and task.file_path.parent == task.char_dir:
-                    # 4. 搬 file_path (原始音檔) 到 train_dir 並 rename 做 "original" + ext
-                    original_ext = task.file_path.suffix  # 例如 .ogg, .mp3, .wav
-                    dest_original = task.train_dir / f"original{original_ext}"
-
-                    # 使用 shutil.move 確保跨磁碟搬移都冇問題
-                    shutil.move(str(task.file_path), str(dest_original))
-                    logging.info(f"📦 原始音檔已備份至: {dest_original}")
+                if cache is not None:
+                    cache.store(cache_key, stage, model, task.train_dir, cache_files)
+                UVR5._backup_original(task)
             else:
-                logging.warning(f"⚠️ 在 {task.vocal_dir} 找不到 {find_file_name}")
+                raise RuntimeError(f"在 {task.vocal_dir} 找不到 {find_file_name}")
         return
+
+    @staticmethod
+    def _has_outputs(task: Task, job_type: str) -> bool:
+        """container 係咪已經喺 vocal_dir 寫出結果 (未搬去 train_dir)"""
+        if job_type == "chain":
+            return (task.vocal_dir / "vocal_main_vocal.wav").exists()
+        return any(task.vocal_dir.glob(UVR5.OUTPUT_FILES[job_type][0]))
+
+    @staticmethod
+    def _backup_original(task: Task):
+        # 3. Check 吓是否有 Original Audio File, if yes, move to train directory
+        if task.file_path.exists() and task.file_path.parent == task.char_dir:
+            # 4. 搬 file_path (原始音檔) 到 train_dir 並 rename 做 "original" + ext
+            original_ext = task.file_path.suffix  # 例如 .ogg, .mp3, .wav
+            dest_original = task.train_dir / f"original{original_ext}"
+
+            # 使用 shutil.move 確保跨磁碟搬移都冇問題
+            shutil.move(str(task.file_path), str(dest_original))
+            logging.info(f"📦 原始音檔已備份至: {dest_original}")
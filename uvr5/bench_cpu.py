@@ -0,0 +1,187 @@
+"""
+UVR5 CPU 推理基準測試：同一段合成混音，比較 FP32 基線同各個 CPU 模式 (INT8 / ONNX Runtime，見 uvr5/cpu_infer.py)
+嘅實時倍率 (音頻秒數 / 牆鐘秒數) 同 SDR 偏差 (以 FP32 輸出做參考)。
+
+用法 (PYTHONPATH=/app:/app/uvr5，同 main.py 一樣):
+    python bench_cpu.py --roformer model_bs_roformer_ep_317_sdr_12.9755 --vr VR-DeEchoAggressive --mdx onnx_dereverb
+    python bench_cpu.py --random --seconds 10 --threads 4     # 冇模型檔：用隨機權重 (只睇速度 / 數值偏差)
+"""
+import argparse
+import gc
+import json
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from config import Config
+from uvr5 import cpu_infer
+
+SAMPLE_RATE = 44100
+MODEL_EXT = {"roformer": ".ckpt", "vr": ".pth", "mdx": ".onnx"}
+
+
+def synth_mix(seconds: float, seed: int = 0):
+    """合成混音：有 vibrato 同音節包絡嘅諧波「人聲」+ 低音 / 和弦 / 噪音「伴奏」，回傳 (vocal, mix)，均為 (2, N)"""
+    rng = np.random.default_rng(seed)
+    n = int(seconds * SAMPLE_RATE)
+    t = np.arange(n) / SAMPLE_RATE
+
+    # 每 0.5 秒換一個音，音高喺大調音階入面揀
+    scale = 220 * 2 ** (np.array([0, 2, 4, 5, 7, 9, 11, 12]) / 12)
+    notes = rng.choice(scale, size=int(np.ceil(seconds * 2)) + 1)
+    f0 = notes[(t * 2).astype(int)] * (1 + 0.015 * np.sin(2 * np.pi * 5.5 * t))
+    phase = 2 * np.pi * np.cumsum(f0) / SAMPLE_RATE
+    vocal = sum(np.sin(k * phase) / k for k in range(1, 9))
+    vocal *= 0.5 - 0.5 * np.cos(2 * np.pi * 2 * t)
+
+    bass = np.sin(2 * np.pi * 55 * t) + 0.5 * np.sin(2 * np.pi * 110 * t)
+    chord = sum(np.sin(2 * np.pi * f * t) for f in (261.6, 329.6, 392.0)) / 3
+    noise = np.convolve(rng.standard_normal(n), np.ones(8) / 8, mode="same")
+    inst = 0.4 * bass + 0.3 * chord + 0.1 * noise
+
+    vocal = np.stack([vocal, vocal]) * 0.25
+    inst = np.stack([inst * 0.9, inst * 1.1]) * 0.25
+    return vocal.astype(np.float32), (vocal + inst).astype(np.float32)
+
+
+def sdr(reference: np.ndarray, estimate: np.ndarray) -> float:
+    n = min(reference.shape[-1], estimate.shape[-1])
+    reference, estimate = reference[..., :n].astype(np.float64), estimate[..., :n].astype(np.float64)
+    return float(10 * np.log10(np.sum(reference**2) / max(np.sum((reference - estimate) ** 2), 1e-20)))
+
+
+def random_weights(kind: str, tmp_dir: Path) -> Path:
+    """隨機初始化嘅模型檔 (同真模型一樣嘅結構同大小)"""
+    if kind == "roformer":
+        from uvr5.bsroformer import Roformer_Loader
+
+        loader = object.__new__(Roformer_Loader)
+        loader.model_type = "bs_roformer"
+        loader.config = loader.get_default_config()
+        path = tmp_dir / "bs_roformer_random.ckpt"
+        torch.save(loader.get_model_from_config().state_dict(), path)
+        return path
+    if kind == "vr":
+        from uvr5.vr import CascadedNet, ModelParameters, parent_directory
+
+        mp = ModelParameters("%s/lib/lib_v5/modelparams/4band_v3.json" % parent_directory)
+        path = tmp_dir / "VR-DeEchoAggressive_random.pth"
+        torch.save(CascadedNet(mp.param["bins"] * 2, 48).state_dict(), path)
+        return path
+    raise ValueError(f"{kind} 冇隨機權重模式，請用 --{kind} 指定模型")
+
+
+def build(kind: str, path: Path):
+    """同 UVR5Processor._get_model 一樣咁 load，但固定用 CPU / FP32"""
+    if kind == "roformer":
+        from uvr5.bsroformer import Roformer_Loader
+
+        return Roformer_Loader(str(path), str(path.with_suffix(".yaml")), "cpu", False)
+    if kind == "vr":
+        from uvr5.vr import AudioPre, AudioPreDeEcho
+
+        cls = AudioPreDeEcho if "DeEcho" in path.name else AudioPre
+        return cls(10, path, "cpu", False)
+    from uvr5.mdxnet import MDXNetDereverb
+
+    return MDXNetDereverb(15, str(path))
+
+
+def separate(kind: str, func, mix: np.ndarray) -> np.ndarray:
+    """回傳第一個 stem (Roformer: vocals / VR: y / MDX: main_vocal)"""
+    if kind == "vr":
+        return np.asarray(func.separate(mix, SAMPLE_RATE)[0])
+    return np.asarray(func.separate(mix)[0])
+
+
+def bench(kind: str, path: Path, modes: list, vocal, mix, cache_dir: Path, threads) -> list:
+    seconds = mix.shape[-1] / SAMPLE_RATE
+    results, baseline = [], None
+    for mode in ["fp32"] + [m for m in modes if m != "fp32"]:
+        func = build(kind, path)
+        func = cpu_infer.optimize(func, kind, mode, cache_dir, threads)
+        if mode.startswith("onnx"):
+            separate(kind, func, mix[:, :SAMPLE_RATE])  # warm-up (ORT session 第一次 run 會分配 buffer)
+        start = time.time()
+        out = separate(kind, func, mix)
+        wall = time.time() - start
+        if baseline is None:
+            baseline = out
+        row = {
+            "model": kind,
+            "mode": mode,
+            "seconds": round(wall, 3),
+            "rtf": round(seconds / wall, 3),
+            "speedup": round(results[0]["seconds"] / wall, 3) if results else 1.0,
+            "sdr_vs_fp32": None if mode == "fp32" else round(sdr(baseline, out), 2),
+            "sdr_vs_vocal": round(sdr(vocal, out), 2),
+        }
+        results.append(row)
+        del func, out
+        gc.collect()
+        print(
+            f"[{kind:8s}] {mode:9s} RTF {row['rtf']:6.2f}x ({row['seconds']:.1f}s, x{row['speedup']:.2f})"
+            + (f"  SDR 對 FP32 {row['sdr_vs_fp32']:.1f} dB" if row["sdr_vs_fp32"] is not None else "")
+            + f"  SDR 對人聲 {row['sdr_vs_vocal']:.1f} dB",
+            flush=True,
+        )
+    return results
+
+
+def resolve(kind: str, name: str) -> Path:
+    path = Path(name)
+    if path.exists():
+        return path
+    return Config.dirs["UVR5_MODEL"] / (name + MODEL_EXT[kind])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="UVR5 CPU 推理基準測試 (FP32 vs INT8 / ONNX)")
+    for kind in ("roformer", "vr", "mdx"):
+        parser.add_argument(f"--{kind}", type=str, default=None, help=f"{kind} 模型名 (uvr5_weights 入面) 或路徑")
+    parser.add_argument("--random", action="store_true", help="冇指定模型嘅 roformer / vr 用隨機權重")
+    parser.add_argument(
+        "--modes", nargs="*", default=None, help="要比較嘅模式，例如 roformer=int8 vr=onnx (只測提到嘅類別)；預設每類模型全部模式"
+    )
+    parser.add_argument("--seconds", type=float, default=30.0, help="合成混音長度 (秒)")
+    parser.add_argument("--threads", type=int, default=Config.cpu_threads, help="intra-op thread 數")
+    parser.add_argument("--cache_dir", type=Path, default=None, help="導出 / 量化模型放邊 (預設臨時目錄)")
+    parser.add_argument("--json", type=Path, default=None, help="結果寫入 JSON 檔")
+    args = parser.parse_args()
+
+    wanted = {}
+    for item in args.modes or []:
+        kind, _, mode = item.partition("=")
+        wanted.setdefault(kind, []).append(mode)
+
+    vocal, mix = synth_mix(args.seconds)
+    print(f"合成混音 {args.seconds}s，intra-op threads {cpu_infer.set_threads(args.threads)}")
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp_dir = Path(tmp)
+        cache_dir = args.cache_dir or tmp_dir / "cache"
+        for kind in ("roformer", "vr", "mdx"):
+            # 有 --modes 就只測佢提到嘅模型類別
+            if wanted and kind not in wanted:
+                continue
+            name = getattr(args, kind)
+            if name is not None:
+                path = resolve(kind, name)
+            elif args.random and kind != "mdx":
+                path = random_weights(kind, tmp_dir)
+            else:
+                continue
+            modes = wanted.get(kind, list(cpu_infer.MODES[kind]))
+            results += bench(kind, path, modes, vocal, mix, cache_dir, args.threads)
+
+    if not results:
+        parser.error("冇模型要測：請指定 --roformer / --vr / --mdx 或者加 --random")
+    if args.json is not None:
+        args.json.write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -17,6 +17,16 @@ class Config:
     dirs["TRAIN_INPUT"] = dirs["TRAIN_ROOT"] / "input"
     dirs["TRAIN_OUTPUT"] = dirs["TRAIN_ROOT"] / "output"
     dirs["UVR5_MODEL"] = app_root / "uvr5" / "uvr5_weights"
+    # CPU 模式導出 / 量化後嘅模型 (放喺掛載嘅 data 目錄，一次性 container 都用得返)
+    dirs["UVR5_CPU_CACHE"] = dirs["TRAIN_ROOT"] / ".uvr5_cpu"
+
+    # --- CPU 推理 (冇 CUDA 嘅機，見 uvr5/cpu_infer.py) ---
+    # 各類模型嘅 CPU 模式: "fp32" / "int8" (torch 動態量化) / "onnx" / "onnx_int8" (ONNX Runtime)
+    # VR 同 MDX 以卷積為主，ORT 動態 INT8 (ConvInteger) 喺 CPU 反而慢，預設只用 ONNX FP32；
+    # 用 python bench_cpu.py 喺目標機度量過先好改
+    cpu_modes = {"roformer": "int8", "vr": "onnx", "mdx": "onnx"}
+    # intra-op thread 數 (torch / ONNX Runtime)，None = 用晒全部核心
+    cpu_threads = None
 
     @staticmethod
     def is_night_task_time() -> bool:
@@ -1,22 +1,42 @@
 import argparse
+import json
 import sys
 from pathlib import Path
 
 # 注意：需要確保 UVR5Processor 同 Config 喺 Python Path 入面
 from uvr5_processor import UVR5Processor
 from config import Config
+from worker import serve
 
 def main():
     parser = argparse.ArgumentParser(description="UVR5 Task Runner (Docker Mode)")
     # 將 type 設為 Path，argparse 會自動幫你做轉換
-    parser.add_argument("--file_path", type=Path, required=True, help="輸入音頻檔案的完整路徑")
-    parser.add_argument("--vocal_dir", type=Path, required=True, help="人聲輸出資料夾路徑") 
-    parser.add_argument("--inst_dir", type=Path, required=True, help="伴奏輸出資料夾路徑") 
-    parser.add_argument("--task_type", type=str, choices=["extract", "dereverb", "deecho"], required=True)
+    parser.add_argument("--file_path", type=Path, help="輸入音頻檔案的完整路徑")
+    parser.add_argument("--vocal_dir", type=Path, help="人聲輸出資料夾路徑") 
+    parser.add_argument("--inst_dir", type=Path, help="伴奏輸出資料夾路徑") 
+    parser.add_argument("--task_type", type=str, choices=["extract", "dereverb", "deecho", "chain", "ensemble"])
     parser.add_argument("--model_name", type=str, default=None)
+    parser.add_argument("--model_names", type=str, nargs="+", default=None, help="ensemble 模式用嘅模型 (預設 UVR5Processor.ENSEMBLE_MODELS)")
+    parser.add_argument("--algorithm", type=str, choices=["min_mag", "max_mag", "avg"], default=None, help="ensemble 合併方法")
+    parser.add_argument("--keep_intermediates", action="store_true", help="chain 模式額外保留 vocal.wav / main_vocal.wav")
+    parser.add_argument("--probe_info", type=json.loads, default=None, help="Host 端已有嘅 probe 結果 (JSON)，有就唔再 ffprobe")
+    
+    # 常駐 worker 模式：模型留喺記憶體，經 Unix socket 收 job
+    parser.add_argument("--serve", action="store_true", help="以常駐 worker 模式啟動")
+    parser.add_argument("--socket", type=Path, default=None, help="worker 模式嘅 Unix socket 路徑")
+    parser.add_argument("--idle_timeout", type=float, default=600.0, help="worker 閒置幾多秒後自動結束")
     
     args = parser.parse_args()
 
+    if args.serve:
+        if args.socket is None:
+            parser.error("--serve 需要 --socket")
+        serve(args.socket, args.idle_timeout)
+        sys.exit(0)
+
+    if args.file_path is None or args.vocal_dir is None or args.inst_dir is None or args.task_type is None:
+        parser.error("一次性模式需要 --file_path, --vocal_dir, --inst_dir 同 --task_type")
+
     # 檢查輸入檔案是否存在
     if not args.file_path.exists():
         print(f"Error: 找不到檔案 {args.file_path}")
@@ -37,21 +57,43 @@ def main():
                 args.file_path, 
                 args.vocal_dir, 
                 args.inst_dir, 
-                args.model_name or "model_bs_roformer_ep_317_sdr_12.9755"
+                args.model_name or "model_bs_roformer_ep_317_sdr_12.9755",
+                args.probe_info,
             )
         elif args.task_type == "dereverb":
             success = UVR5Processor.dereverb(
                 args.file_path, 
                 args.vocal_dir, 
                 args.inst_dir, 
-                args.model_name or "onnx_dereverb"
+                args.model_name or "onnx_dereverb",
+                args.probe_info,
             )
         elif args.task_type == "deecho":
             success = UVR5Processor.deecho(
                 args.file_path, 
                 args.vocal_dir, 
                 args.inst_dir, 
-                args.model_name or "VR-DeEchoAggressive"
+                args.model_name or "VR-DeEchoAggressive",
+                args.probe_info,
+            )
+        elif args.task_type == "chain":
+            # extract → dereverb → deecho 一次過做，中間 stem 唔落地
+            success = UVR5Processor.chain(
+                args.file_path,
+                args.vocal_dir,
+                args.inst_dir,
+                probe_info=args.probe_info,
+                keep_intermediates=args.keep_intermediates,
+            )
+        elif args.task_type == "ensemble":
+            # 多個模型共用一次解碼同 STFT，人聲喺頻譜域合併
+            success = UVR5Processor.ensemble(
+                args.file_path,
+                args.vocal_dir,
+                args.inst_dir,
+                model_names=args.model_names,
+                algorithm=args.algorithm,
+                probe_info=args.probe_info,
             )
     except Exception as e:
         print(f"執行期間發生崩潰: {e}")
@@ -0,0 +1,84 @@
+"""
+lib.utils.inference 嘅批次路徑 (窗口疊 batch、TTA 窗口同批) 要同舊版逐個窗口 forward 數值一致。
+用細嘅隨機權重 CascadedNet 同固定 seed 嘅合成頻譜，唔使模型檔。
+"""
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+import torch
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "uvr5"))
+
+from lib.lib_v5.nets_new import CascadedNet  # noqa: E402
+from lib.utils import inference, make_padding  # noqa: E402
+
+N_FFT = 256
+WINDOW_SIZE = 512
+AGGRESSIVENESS = {"value": 0.1, "split_bin": 40}
+
+
+def _reference_inference(X_spec, model, aggressiveness, data):
+    """改動前嘅 inference：每個窗口單獨 forward，TTA 另外再行一次"""
+
+    def _execute(X_mag_pad, roi_size, n_window):
+        preds = []
+        with torch.no_grad():
+            for i in range(n_window):
+                start = i * roi_size
+                X_mag_window = torch.from_numpy(X_mag_pad[None, :, :, start : start + data["window_size"]])
+                preds.append(model.predict(X_mag_window, aggressiveness).numpy()[0])
+        return np.concatenate(preds, axis=2)
+
+    X_mag, X_phase = np.abs(X_spec), np.angle(X_spec)
+    coef = X_mag.max()
+    X_mag_pre = X_mag / coef
+    n_frame = X_mag_pre.shape[2]
+    pad_l, pad_r, roi_size = make_padding(n_frame, data["window_size"], model.offset)
+    n_window = int(np.ceil(n_frame / roi_size))
+
+    X_mag_pad = np.pad(X_mag_pre, ((0, 0), (0, 0), (pad_l, pad_r)), mode="constant")
+    pred = _execute(X_mag_pad, roi_size, n_window)[:, :, :n_frame]
+    if data["tta"]:
+        pad_l += roi_size // 2
+        pad_r += roi_size // 2
+        X_mag_pad = np.pad(X_mag_pre, ((0, 0), (0, 0), (pad_l, pad_r)), mode="constant")
+        pred_tta = _execute(X_mag_pad, roi_size, n_window + 1)[:, :, roi_size // 2 :][:, :, :n_frame]
+        return (pred + pred_tta) * 0.5 * coef, X_mag, np.exp(1.0j * X_phase)
+    return pred * coef, X_mag, np.exp(1.0j * X_phase)
+
+
+@pytest.fixture(scope="module")
+def model():
+    torch.manual_seed(0)
+    net = CascadedNet(N_FFT, nout=8, nout_lstm=16)
+    net.eval()
+    return net
+
+
+@pytest.fixture(scope="module")
+def X_spec():
+    # 合成頻譜：諧波 + 噪音，長度唔係 roi 嘅整數倍 (最後一個窗口要補零)
+    rng = np.random.default_rng(0)
+    bins, frames = N_FFT // 2 + 1, 1000
+    t = np.arange(frames)
+    harmonics = np.zeros((bins, frames))
+    for k in range(1, 8):
+        harmonics[(6 * k) % bins] += np.abs(np.sin(2 * np.pi * t / (50 + 7 * k))) / k
+    mag = harmonics + 0.05 * rng.random((2, bins, frames))
+    phase = rng.uniform(-np.pi, np.pi, (2, bins, frames))
+    return (mag * np.exp(1j * phase)).astype(np.complex64)
+
+
+@pytest.mark.parametrize("tta", [False, True])
+@pytest.mark.parametrize("batch_size", [1, 3, 8])
+def test_batched_matches_per_window(model, X_spec, tta, batch_size):
+    data = {"window_size": WINDOW_SIZE, "tta": tta, "batch_size": batch_size}
+    pred, X_mag, X_phase = inference(X_spec, "cpu", model, AGGRESSIVENESS, data)
+    ref_pred, ref_mag, ref_phase = _reference_inference(X_spec, model, AGGRESSIVENESS, data)
+
+    assert pred.shape == ref_pred.shape == X_spec.shape
+    np.testing.assert_allclose(pred, ref_pred, rtol=1e-5, atol=1e-6)
+    np.testing.assert_array_equal(X_mag, ref_mag)
+    np.testing.assert_array_equal(X_phase, ref_phase)
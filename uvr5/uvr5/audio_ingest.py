@@ -0,0 +1,82 @@
+"""
+UVR5 輸入音頻解碼：經 ffmpeg pipe 直接解碼成 float32 (channels, N) 陣列，
+唔再用 os.system 轉碼一份 .reformatted.wav 去 /tmp 再由各個分離器用 librosa 讀多次。
+好長嘅音頻 (probe 長度超過 MEMMAP_MIN_SECONDS) 會串流寫入 scratch 目錄再 memmap，唔使成條留喺 RAM。
+"""
+import os
+import shutil
+import subprocess
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+SAMPLE_RATE = 44100
+CHANNELS = 2
+# 超過呢個長度 (秒) 就解碼去 memmap (2ch float32 每小時大約 1.3GB)
+MEMMAP_MIN_SECONDS = 30 * 60
+_PIPE_BLOCK = 1 << 22
+
+
+def _ffmpeg_cmd(path, sr: int, channels: int) -> list:
+    # 參數用 list 傳，唔經 shell，檔名有引號 / 空格都冇問題
+    return [
+        "ffmpeg", "-nostdin", "-v", "error",
+        "-i", str(path),
+        "-vn", "-f", "f32le", "-acodec", "pcm_f32le",
+        "-ac", str(channels), "-ar", str(sr),
+        "pipe:1",
+    ]
+
+
+def decode(
+    path,
+    sr: int = SAMPLE_RATE,
+    channels: int = CHANNELS,
+    duration: Optional[float] = None,
+    scratch_dir: Optional[Path] = None,
+) -> np.ndarray:
+    """
+    解碼任何 ffmpeg 讀到嘅格式做 (channels, N) float32 (同 librosa.load(sr=sr, mono=False) 一樣嘅排列)。
+    :param duration: probe 到嘅長度 (秒)，夠長兼有 scratch_dir 就解碼去 memmap
+    """
+    if duration is not None and scratch_dir is not None and duration >= MEMMAP_MIN_SECONDS:
+        return _decode_memmap(path, sr, channels, Path(scratch_dir))
+
+    p = subprocess.run(_ffmpeg_cmd(path, sr, channels), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if p.returncode != 0 or not p.stdout:
+        raise RuntimeError(f"ffmpeg 解碼失敗: {path}: {p.stderr.decode(errors='replace').strip()}")
+    frames = np.frombuffer(p.stdout, dtype=np.float32).reshape(-1, channels)
+    return np.ascontiguousarray(frames.T)
+
+
+def _decode_memmap(path, sr: int, channels: int, scratch_dir: Path) -> np.ndarray:
+    """串流寫入 scratch_dir 再 memmap；map 完即刻 unlink，檔案喺 array 釋放後自動消失"""
+    scratch_dir.mkdir(parents=True, exist_ok=True)
+    raw_path = scratch_dir / "ingest.f32"
+    # stderr 寫去暫存檔：用 pipe 嘅話 ffmpeg 寫滿 stderr 會卡住，同讀 stdout 互相等
+    with open(raw_path, "wb") as f, tempfile.TemporaryFile() as err_f:
+        p = subprocess.Popen(_ffmpeg_cmd(path, sr, channels), stdout=subprocess.PIPE, stderr=err_f)
+        shutil.copyfileobj(p.stdout, f, _PIPE_BLOCK)
+        p.wait()
+        err_f.seek(0)
+        err = err_f.read()
+    size = raw_path.stat().st_size
+    if p.returncode != 0 or size == 0:
+        raw_path.unlink(missing_ok=True)
+        raise RuntimeError(f"ffmpeg 解碼失敗: {path}: {err.decode(errors='replace').strip()}")
+    # copy-on-write：下游原地改都唔會寫返落檔
+    frames = np.memmap(raw_path, dtype=np.float32, mode="c", shape=(size // (4 * channels), channels))
+    os.unlink(raw_path)
+    return frames.T
+
+
+def subtract(mix: np.ndarray, stem: np.ndarray, block: int = SAMPLE_RATE * 60) -> np.ndarray:
+    """
+    mix - stem，分段計 (每次一分鐘)：mix 係 memmap 時唔會一次過成條讀入 RAM 再多開一份臨時陣列
+    """
+    out = np.empty(np.broadcast_shapes(mix.shape, stem.shape), dtype=np.result_type(mix, stem))
+    for start in range(0, out.shape[-1], block):
+        np.subtract(mix[..., start : start + block], stem[..., start : start + block], out=out[..., start : start + block])
+    return out
@@ -1,5 +1,6 @@
 # This code is modified from https://github.com/ZFTurbo/
 import os
+import tempfile
 import warnings
 
 import librosa
@@ -10,6 +11,8 @@ import torch.nn as nn
 import yaml
 from tqdm import tqdm
 
+from uvr5.audio_ingest import subtract
+
 warnings.filterwarnings("ignore")
 
 
@@ -108,7 +111,53 @@ class Roformer_Loader:
             model = None
         return model
 
-    def demix_track(self, model, mix, device):
+    # 累加器 (result + counter) 喺 GPU 上超過呢個大小 (bytes) 就改用滑動窗口，定稿部分分段搬去 host memmap
+    DEVICE_ACCUMULATOR_MAX_BYTES = 1 << 30
+    # 滑動窗口模式每累積幾多 sample 定稿部分先搬一次去 host
+    HOST_FLUSH_SAMPLES = 44100 * 60
+    # (chunk_size, fade_size, device, dtype) → (window_start, window_middle, window_finish)
+    _window_cache = {}
+
+    @staticmethod
+    def _fade_windows(window_size, fade_size, device, dtype=torch.float32):
+        """首 / 中 / 尾 chunk 嘅淡入淡出窗口，每個 device + dtype 只建一次"""
+        key = (window_size, fade_size, str(device), dtype)
+        if key not in Roformer_Loader._window_cache:
+            # Prepare windows arrays (do 1 time for speed up). This trick repairs click problems on the edges of segment
+            fadein = torch.linspace(0, 1, fade_size)
+            fadeout = torch.linspace(1, 0, fade_size)
+            window_start = torch.ones(window_size)
+            window_middle = torch.ones(window_size)
+            window_finish = torch.ones(window_size)
+            window_start[-fade_size:] *= fadeout  # First audio chunk, no fadein
+            window_finish[:fade_size] *= fadein  # Last audio chunk, no fadeout
+            window_middle[-fade_size:] *= fadeout
+            window_middle[:fade_size] *= fadein
+            Roformer_Loader._window_cache[key] = tuple(
+                w.to(device=device, dtype=dtype) for w in (window_start, window_middle, window_finish)
+            )
+        return Roformer_Loader._window_cache[key]
+
+    @staticmethod
+    def _padded_chunk(mix, start, size, pad):
+        """
+        mix 前後各 reflect 補 pad 之後 [start, start + size) 嘅一段 (同 nn.functional.pad(mode="reflect") 一致)；
+        只讀呢一段，唔使成條補完再複製 (mix 可能係 memmap)
+        """
+        length = mix.shape[-1]
+        lo, hi = start - pad, min(start + size, length + 2 * pad) - pad
+        if lo >= 0 and hi <= length:
+            return mix[:, lo:hi]
+        idx = np.abs(np.arange(lo, hi))
+        idx = np.where(idx >= length, 2 * (length - 1) - idx, idx)
+        return mix[:, torch.as_tensor(idx, device=mix.device)]
+
+    def demix_track(self, model, mix, device, checkpoint=None):
+        """
+        overlap-add 累加器留喺 device 上面 (_DeviceAccumulator)，每個 chunk 唔再 .cpu()，最後先搬返分離結果；
+        累加器太大 (長音軌) 就用滑動窗口，定稿部分分段搬去 host memmap。
+        checkpoint (DemixCheckpoint) 唔係 None 就定期將 result / counter 存落 memmap，崩潰後由上次 commit 繼續
+        """
         C = self.config["audio"]["chunk_size"]  # chunk_size
         N = self.config["inference"]["num_overlap"]
         fade_size = C // 10
@@ -120,35 +169,52 @@ class Roformer_Loader:
         progress_bar = tqdm(total=length_init // step + 1, desc="Processing", leave=False)
 
         # Do pad from the beginning and end to account floating window results better
-        if length_init > 2 * border and (border > 0):
-            mix = nn.functional.pad(mix, (border, border), mode="reflect")
-
-        # Prepare windows arrays (do 1 time for speed up). This trick repairs click problems on the edges of segment
-        window_size = C
-        fadein = torch.linspace(0, 1, fade_size)
-        fadeout = torch.linspace(1, 0, fade_size)
-        window_start = torch.ones(window_size)
-        window_middle = torch.ones(window_size)
-        window_finish = torch.ones(window_size)
-        window_start[-fade_size:] *= fadeout  # First audio chunk, no fadein
-        window_finish[:fade_size] *= fadein  # Last audio chunk, no fadeout
-        window_middle[-fade_size:] *= fadeout
-        window_middle[:fade_size] *= fadein
+        # (reflect 補邊喺 _padded_chunk 逐段做，mix 本身唔複製)
+        pad = border if length_init > 2 * border and (border > 0) else 0
+
+        window_start, window_middle, window_finish = Roformer_Loader._fade_windows(C, fade_size, device)
 
         with torch.amp.autocast("cuda"):
             with torch.inference_mode():
                 if self.config["training"]["target_instrument"] is None:
-                    req_shape = (len(self.config["training"]["instruments"]),) + tuple(mix.shape)
+                    req_shape = (len(self.config["training"]["instruments"]), mix.shape[0], length_init + 2 * pad)
                 else:
-                    req_shape = (1,) + tuple(mix.shape)
+                    req_shape = (1, mix.shape[0], length_init + 2 * pad)
+
+                total = req_shape[-1]
+                on_cpu = torch.device(device).type == "cpu"
+                # 一批 chunk 最多掂到嘅範圍；滑動窗口要容得落一批 + 一次 flush 嘅量
+                span = (batch_size - 1) * step + C
+                width = span + self.HOST_FLUSH_SAMPLES
+                sliding = (
+                    not on_cpu
+                    and width < total
+                    and 2 * 4 * int(np.prod(req_shape)) > self.DEVICE_ACCUMULATOR_MAX_BYTES
+                )
+                accumulator = _DeviceAccumulator(
+                    req_shape,
+                    width if sliding else total,
+                    device,
+                    host="memmap" if sliding else ("ram" if checkpoint is not None else None),
+                    scratch_dir=checkpoint.scratch_dir if checkpoint is not None else None,
+                )
+                # CPU 直接用；GPU 冇滑動窗口就成條一次過搬上去，有就逐個 chunk pin 住非同步搬 (唔會成條讀入 RAM)
+                mix_src = mix.to(device) if not on_cpu and not sliding else mix
 
-                result = torch.zeros(req_shape, dtype=torch.float32)
-                counter = torch.zeros(req_shape, dtype=torch.float32)
                 i = 0
+                if checkpoint is not None:
+                    state = checkpoint.open(mix, {k: v.shape for k, v in accumulator.host.items()})
+                    i = checkpoint.restore(accumulator.host, state)
+                    if state is not None:
+                        accumulator.load(state["frontier"])
+                    progress_bar.update(i // step)
                 batch_data = []
                 batch_locations = []
-                while i < mix.shape[1]:
-                    part = mix[:, i : i + C].to(device)
+                while i < total:
+                    part = Roformer_Loader._padded_chunk(mix_src, i, C, pad)
+                    if sliding:
+                        part = part.pin_memory()
+                    part = part.to(device, non_blocking=True)
                     length = part.shape[-1]
                     if length < C:
                         if length > C // 2 + 1:
@@ -162,32 +228,37 @@ class Roformer_Loader:
                     i += step
                     progress_bar.update(1)
 
-                    if len(batch_data) >= batch_size or (i >= mix.shape[1]):
+                    if len(batch_data) >= batch_size or (i >= total):
                         arr = torch.stack(batch_data, dim=0)
-                        # print(23333333,arr.dtype)
                         x = model(arr)
 
                         window = window_middle
                         if i - step == 0:  # First audio chunk, no fadein
                             window = window_start
-                        elif i >= mix.shape[1]:  # Last audio chunk, no fadeout
+                        elif i >= total:  # Last audio chunk, no fadeout
                             window = window_finish
 
                         for j in range(len(batch_locations)):
                             start, l = batch_locations[j]
-                            result[..., start : start + l] += x[j][..., :l].cpu() * window[..., :l]
-                            counter[..., start : start + l] += window[..., :l]
+                            accumulator.add(start, l, x[j], window)
 
                         batch_data = []
                         batch_locations = []
 
-                estimated_sources = result / counter
-                estimated_sources = estimated_sources.cpu().numpy()
-                np.nan_to_num(estimated_sources, copy=False, nan=0.0)
+                        # 之後嘅 chunk 由 i 開始，i 之前嘅位置已經定稿；尾段去到最後一個 chunk 嘅結尾
+                        frontier, tail_end = min(i, total), min(i - step + C, total)
+                        if checkpoint is not None and checkpoint.due(force=i >= total):
+                            accumulator.sync(frontier, tail_end)
+                            checkpoint.commit(i, accumulator.host, frontier, tail_end, force=True)
+                        if sliding and frontier - accumulator.base >= self.HOST_FLUSH_SAMPLES:
+                            accumulator.sync(frontier)
+                            accumulator.slide(frontier)
+
+                estimated_sources = accumulator.finish()
 
-                if length_init > 2 * border and (border > 0):
+                if pad:
                     # Remove pad
-                    estimated_sources = estimated_sources[..., border:-border]
+                    estimated_sources = estimated_sources[..., pad:-pad]
 
         progress_bar.close()
 
@@ -196,7 +267,7 @@ class Roformer_Loader:
         else:
             return {k: v for k, v in zip([self.config["training"]["target_instrument"]], estimated_sources)}
 
-    def run_folder(self, input, vocal_root, others_root, format):
+    def run_folder(self, input, vocal_root, others_root, format, checkpoint=None, mix=None):
         self.model.eval()
         path = input
         os.makedirs(vocal_root, exist_ok=True)
@@ -207,12 +278,19 @@ class Roformer_Loader:
         if "sample_rate" in self.config["audio"]:
             sample_rate = self.config["audio"]["sample_rate"]
 
-        try:
-            mix, sr = librosa.load(path, sr=sample_rate, mono=False)
-        except Exception as e:
-            print("Can read track: {}".format(path))
-            print("Error message: {}".format(str(e)))
-            return
+        if mix is None:
+            try:
+                mix, sr = librosa.load(path, sr=sample_rate, mono=False)
+            except Exception as e:
+                print("Can read track: {}".format(path))
+                print("Error message: {}".format(str(e)))
+                return
+        else:
+            # 已經解碼好嘅 44100Hz (2, N) 波形 (audio_ingest)，唔使再讀檔
+            sr = 44100
+            if sample_rate != sr:
+                mix = librosa.resample(np.asarray(mix), orig_sr=sr, target_sr=sample_rate)
+                sr = sample_rate
 
         # in case if model only supports mono tracks
         isstereo = self.config["model"].get("stereo", True)
@@ -220,17 +298,16 @@ class Roformer_Loader:
             mix = np.mean(mix, axis=0)  # if more than 2 channels, take mean
             print("Warning: Track has more than 1 channels, but model is mono, taking mean of all channels.")
 
-        mix_orig = mix.copy()
-
-        mixture = torch.tensor(mix, dtype=torch.float32)
-        res = self.demix_track(self.model, mixture, self.device)
+        # from_numpy 唔複製：mix 係 memmap 時 demix_track 逐個 chunk 先讀
+        mixture = torch.from_numpy(np.asarray(mix, dtype=np.float32))
+        res = self.demix_track(self.model, mixture, self.device, checkpoint)
 
         if self.config["training"]["target_instrument"] is not None:
             # if target instrument is specified, save target instrument as vocal and other instruments as others
             # other instruments are caculated by subtracting target instrument from mixture
             target_instrument = self.config["training"]["target_instrument"]
             other_instruments = [i for i in self.config["training"]["instruments"] if i != target_instrument]
-            other = mix_orig - res[target_instrument]  # caculate other instruments
+            other = subtract(mix, res[target_instrument])  # caculate other instruments
 
             path_vocal = "{}/{}_{}.wav".format(vocal_root, file_base_name, target_instrument)
             path_other = "{}/{}_{}.wav".format(others_root, file_base_name, other_instruments[0])
@@ -245,6 +322,24 @@ class Roformer_Loader:
                 path_other = "{}/{}_{}.wav".format(others_root, file_base_name, other)
                 self.save_audio(path_other, res[other].T, sr, format)
 
+    def separate(self, mix, checkpoint=None):
+        """
+        記憶體版本 (chain 模式用)：mix 係 config 取樣率嘅 (2, N) 波形，
+        回傳 (target, other)，均為 (2, N)，同 run_folder 寫出嘅兩個檔一致
+        """
+        self.model.eval()
+        isstereo = self.config["model"].get("stereo", True)
+        if not isstereo and len(mix.shape) != 1:
+            mix = np.mean(mix, axis=0)
+
+        res = self.demix_track(self.model, torch.from_numpy(np.asarray(mix, dtype=np.float32)), self.device, checkpoint)
+
+        if self.config["training"]["target_instrument"] is not None:
+            target = res[self.config["training"]["target_instrument"]]
+            return target, subtract(mix, target)
+        instruments = self.config["training"]["instruments"]
+        return res[instruments[0]], res[instruments[1]]
+
     def save_audio(self, path, data, sr, format):
         # input path should be endwith '.wav'
         if format in ["wav", "flac"]:
@@ -300,5 +395,85 @@ class Roformer_Loader:
         else:
             self.model = model.half().to(device)
 
-    def _path_audio_(self, input, others_root, vocal_root, format, is_hp3=False):
-        self.run_folder(input, vocal_root, others_root, format)
+    def _path_audio_(self, input, others_root, vocal_root, format, is_hp3=False, checkpoint=None, mix=None):
+        self.run_folder(input, vocal_root, others_root, format, checkpoint, mix)
+
+
+class _DeviceAccumulator:
+    """
+    demix_track 嘅 overlap-add 累加器 (result / counter)，放喺 device 上面，chunk 唔使逐個搬返 host。
+    width 細過全長就係滑動窗口：device 只保留 [base, base + width)，已定稿部分經 sync 搬去 host。
+    host 鏡像 (斷點用 "ram"，滑動窗口用 "memmap") 只喺 sync 時先同 device 同步。
+    """
+
+    def __init__(self, shape, width, device, host=None, scratch_dir=None):
+        self.total = shape[-1]
+        self.base = 0
+        self.synced = 0
+        self.device = {
+            name: torch.zeros(tuple(shape[:-1]) + (width,), dtype=torch.float32, device=device)
+            for name in ("result", "counter")
+        }
+        self.host = {}
+        if host == "ram":
+            self.host = {name: np.zeros(shape, dtype=np.float32) for name in self.device}
+        elif host == "memmap":
+            if scratch_dir is not None:
+                os.makedirs(scratch_dir, exist_ok=True)
+            self.host = {
+                name: np.memmap(tempfile.TemporaryFile(dir=scratch_dir), dtype=np.float32, mode="w+", shape=shape)
+                for name in self.device
+            }
+
+    def add(self, start, length, x, window):
+        s = start - self.base
+        self.device["result"][..., s : s + length] += x[..., :length] * window[..., :length]
+        self.device["counter"][..., s : s + length] += window[..., :length]
+
+    def load(self, frontier):
+        """斷點 restore 咗 host 之後，將未定稿部分 (滑動窗口就由 frontier 開始) 搬返上 device"""
+        if self.device["result"].shape[-1] < self.total:
+            self.base = frontier
+        for name, buf in self.device.items():
+            end = min(self.base + buf.shape[-1], self.total)
+            buf[..., : end - self.base] = torch.from_numpy(np.ascontiguousarray(self.host[name][..., self.base : end]))
+        self.synced = frontier
+
+    def sync(self, frontier, tail_end=None):
+        """將 [synced, frontier) 搬去 host (之後唔會再變)；有 tail_end 就連埋未定稿尾段一齊抄 (斷點用)"""
+        end = tail_end or frontier
+        if end > self.synced:
+            for name, buf in self.device.items():
+                self.host[name][..., self.synced : end] = (
+                    buf[..., self.synced - self.base : end - self.base].cpu().numpy()
+                )
+        self.synced = frontier
+
+    def slide(self, frontier):
+        """frontier 之前已經 sync 咗，窗口起點移去 frontier"""
+        shift = frontier - self.base
+        if shift <= 0:
+            return
+        for buf in self.device.values():
+            keep = buf.shape[-1] - shift
+            buf[..., :keep] = buf[..., shift:].clone()
+            buf[..., keep:] = 0
+        self.base = frontier
+
+    def finish(self, block=44100 * 60):
+        """回傳 result / counter (numpy)；成條都喺 device 就喺 device 除完先搬，滑動窗口就喺 host 分段除"""
+        if self.device["result"].shape[-1] >= self.total:
+            estimated_sources = self.device["result"] / self.device["counter"]
+            estimated_sources = estimated_sources.cpu().numpy()
+            np.nan_to_num(estimated_sources, copy=False, nan=0.0)
+            return estimated_sources
+
+        self.sync(self.total)
+        result, counter = self.host["result"], self.host["counter"]
+        estimated_sources = np.empty(result.shape, dtype=np.float32)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for start in range(0, self.total, block):
+                np.divide(result[..., start : start + block], counter[..., start : start + block],
+                          out=estimated_sources[..., start : start + block])
+        np.nan_to_num(estimated_sources, copy=False, nan=0.0)
+        return estimated_sources
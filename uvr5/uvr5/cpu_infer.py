@@ -0,0 +1,183 @@
+"""
+冇 CUDA 嘅機用嘅 CPU 推理模式 (UVR5Processor 見到 device 係 cpu 先會用)：
+  - BS-Roformer ("int8"): torch 動態 INT8 量化 nn.Linear，Transformer 為主，CPU 上快大約 1.4 倍
+  - VR ("onnx" / "onnx_int8" / "int8"): 導出靜態 shape 嘅 ONNX 交畀 ONNX Runtime 行；
+    VR 係卷積為主 (ASPP 嘅 adaptive pooling 唔支援動態 shape，所以 batch (1) / 窗口闊度固定)
+  - MDX ("onnx" / "onnx_int8"): 本身已經係 ONNX，重新開 CPU session 限 thread，可選 ORT 動態 INT8
+導出 / 量化後嘅模型存喺 cache_dir，原模型檔冇改過就直接重用。
+"""
+import logging
+import os
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import torch
+
+logger = logging.getLogger(__name__)
+
+# 每類模型支援嘅模式 ("fp32" = 唔改)
+MODES = {
+    "roformer": ("fp32", "int8"),
+    "vr": ("fp32", "int8", "onnx", "onnx_int8"),
+    "mdx": ("fp32", "onnx", "onnx_int8"),
+}
+# torch 動態量化嘅模塊 (卷積唔支援動態量化)
+QUANTIZE_MODULES = {torch.nn.Linear, torch.nn.LSTM, torch.nn.GRU}
+
+
+def set_threads(threads: Optional[int] = None) -> int:
+    """設定 torch intra-op thread 數，回傳實際用緊幾多條"""
+    if threads:
+        torch.set_num_threads(threads)
+    return torch.get_num_threads()
+
+
+def session_options(threads: Optional[int] = None):
+    import onnxruntime as ort
+
+    so = ort.SessionOptions()
+    so.intra_op_num_threads = threads or 0
+    so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    # 唔留 arena：VR 單次推理嘅中間 tensor 好大，留住會食晒細機嘅 RAM
+    so.enable_cpu_mem_arena = False
+    return so
+
+
+def cpu_session(model_path, threads: Optional[int] = None):
+    import onnxruntime as ort
+
+    return ort.InferenceSession(str(model_path), sess_options=session_options(threads), providers=["CPUExecutionProvider"])
+
+
+def quantize_torch(model: torch.nn.Module) -> torch.nn.Module:
+    """動態 INT8 量化 Linear / LSTM / GRU (weight 預先量化，activation 逐次量化)"""
+    return torch.ao.quantization.quantize_dynamic(model.float().eval(), QUANTIZE_MODULES, dtype=torch.qint8)
+
+
+def _fresh(dst: Path, src: Path) -> bool:
+    return dst.exists() and dst.stat().st_mtime >= Path(src).stat().st_mtime
+
+
+def quantize_onnx(src, dst: Path) -> Path:
+    """ORT 動態 INT8 量化；dst 比 src 新就直接用"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    dst = Path(dst)
+    if not _fresh(dst, src):
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        tmp = dst.with_name(f"{dst.stem}.tmp.onnx")
+        quantize_dynamic(str(src), str(tmp), weight_type=QuantType.QInt8)
+        os.replace(tmp, dst)
+        logger.info(f"ONNX INT8 量化完成: {dst}")
+    return dst
+
+
+class _PredictWrapper(torch.nn.Module):
+    """將 aggressiveness 固定落 graph，導出 model.predict"""
+
+    def __init__(self, model, aggressiveness):
+        super().__init__()
+        self.model = model
+        self.aggressiveness = aggressiveness
+
+    def forward(self, x):
+        return self.model.predict(x, self.aggressiveness)
+
+
+def export_vr(model, dst: Path, src, aggressiveness: dict, bins: int, window_size: int) -> Path:
+    """導出 VR 模型嘅 predict (input: (1, 2, bins, window_size))；dst 比 src 新就直接用"""
+    dst = Path(dst)
+    if not _fresh(dst, src):
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        tmp = dst.with_name(f"{dst.stem}.tmp.onnx")
+        example = torch.zeros(1, 2, bins, window_size)
+        with torch.no_grad():
+            torch.onnx.export(
+                _PredictWrapper(model.float().eval(), aggressiveness),
+                (example,),
+                str(tmp),
+                dynamo=False,
+                input_names=["x_mag"],
+                output_names=["pred_mag"],
+                opset_version=17,
+            )
+        os.replace(tmp, dst)
+        logger.info(f"VR ONNX 導出完成: {dst}")
+    return dst
+
+
+class OnnxVRNet:
+    """
+    ONNX Runtime 版本嘅 VR 模型，介面同 CascadedNet 一樣 (eval / state_dict / predict / offset)，
+    直接交畀 lib.utils.inference 用。graph 係 batch 1，一批窗口逐個行
+    (CPU 上 batch 冇乜好處，大 batch 嘅中間 tensor 仲會爆 RAM)。
+    """
+
+    def __init__(self, model_path, offset: int, aggressiveness: dict, threads: Optional[int] = None):
+        self.session = cpu_session(model_path, threads)
+        self.offset = offset
+        self.aggressiveness = aggressiveness
+        self.input_name = self.session.get_inputs()[0].name
+
+    def eval(self):
+        return self
+
+    def state_dict(self):
+        return {}
+
+    def predict(self, x_mag, aggressiveness=None):
+        if aggressiveness is not None and aggressiveness != self.aggressiveness:
+            raise ValueError(f"aggressiveness {aggressiveness} 同導出時 {self.aggressiveness} 唔一致")
+        x = x_mag.detach().float().cpu().numpy()
+        out = [self.session.run(None, {self.input_name: x[i : i + 1]})[0] for i in range(x.shape[0])]
+        return torch.from_numpy(np.concatenate(out))
+
+
+def optimize(func, kind: str, mode: str, cache_dir: Path, threads: Optional[int] = None):
+    """
+    將已 load 好嘅分離器 (Roformer_Loader / AudioPre / AudioPreDeEcho / MDXNetDereverb) 轉做 CPU 模式。
+    :param kind: "roformer" / "vr" / "mdx"
+    :param mode: 見 MODES
+    """
+    if mode not in MODES[kind]:
+        raise ValueError(f"{kind} 唔支援 CPU 模式 {mode}，可用: {MODES[kind]}")
+    set_threads(threads)
+    cache_dir = Path(cache_dir)
+
+    if kind == "roformer":
+        if mode == "int8":
+            func.model = quantize_torch(func.model)
+    elif kind == "vr":
+        if mode == "int8":
+            func.model = quantize_torch(func.model)
+        elif mode.startswith("onnx"):
+            src = Path(func.model_path)
+            # 同 vr._predict 一樣計法
+            aggressiveness = {
+                "value": float(func.data["agg"] / 100),
+                "split_bin": func.mp.param["band"][1]["crop_stop"],
+            }
+            window_size = func.data["window_size"]
+            onnx_path = export_vr(
+                func.model,
+                cache_dir / f"{src.stem}.agg{func.data['agg']}.w{window_size}.onnx",
+                src,
+                aggressiveness,
+                func.mp.param["bins"] + 1,
+                window_size,
+            )
+            if mode == "onnx_int8":
+                onnx_path = quantize_onnx(onnx_path, onnx_path.with_name(f"{onnx_path.stem}.int8.onnx"))
+            func.model = OnnxVRNet(onnx_path, func.model.offset, aggressiveness, threads)
+    elif kind == "mdx":
+        pred = func.pred
+        onnx_path = Path(pred.model_path)
+        if mode == "onnx_int8":
+            onnx_path = quantize_onnx(onnx_path, cache_dir / f"{onnx_path.stem}.int8.onnx")
+        if mode != "fp32":
+            pred.model = cpu_session(onnx_path, threads)
+            pred._io_device = "cpu"
+            pred._output_name = pred.model.get_outputs()[0].name
+    logger.info(f"CPU 模式 [{kind}] {mode}，intra-op threads {torch.get_num_threads()}")
+    return func
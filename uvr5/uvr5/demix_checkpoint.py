@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+
+class DemixCheckpoint:
+    """
+    分離途中嘅斷點 (Roformer demix_track / MDX demix 用)。
+    已經定稿 (之後嘅 chunk 唔會再掂到) 嘅累加器區段寫入 memory-mapped 暫存檔 (.npy)，
+    仲會被重疊 chunk 加嘅尾段同進度一齊原子寫入 state.npz；
+    container 崩潰後重新執行，就由最後一次 commit 嘅 chunk 繼續，唔使由頭再做。
+
+    commit 先 flush memmap 再 rename state，所以 state 講嘅定稿長度一定已經喺 memmap；
+    memmap 入面超出定稿長度嘅內容 (崩潰前寫咗一半) 續做時會被重新計算覆蓋。
+    """
+
+    def __init__(self, scratch_dir: Path, tag: str, interval: float = 30.0):
+        """
+        :param scratch_dir: 暫存目錄 (要喺 host 掛載嘅 volume 入面，container 重開先搵得返)
+        :param tag: 區分同一目錄入面唔同階段 / 模型嘅斷點
+        :param interval: 最少隔幾多秒先 commit 一次
+        """
+        self.scratch_dir = Path(scratch_dir)
+        self.tag = tag
+        self.interval = interval
+        self._arrays: dict[str, np.memmap] = {}
+        self._input_sig: Optional[str] = None
+        self._frontier = 0
+        self._last_commit = 0.0
+
+    @staticmethod
+    def _signature(mix) -> str:
+        """輸入波形嘅指紋 (shape + 抽樣)，唔同輸入唔會誤用舊斷點"""
+        mix = np.asarray(mix)
+        digest = hashlib.sha1(str(mix.shape).encode())
+        digest.update(np.ascontiguousarray(mix[..., ::4099], dtype=np.float32).tobytes())
+        return digest.hexdigest()
+
+    def _path(self, suffix: str) -> Path:
+        return self.scratch_dir / f"{self.tag}.{suffix}"
+
+    def open(self, mix, shapes: dict[str, tuple]) -> Optional[dict]:
+        """
+        按輸入波形 mix 開 (或者接返) 各累加器嘅 memmap，回傳上次 commit 嘅狀態
+        {"pos": 下一個未做嘅位置, "frontier": 已定稿長度, "tails": {名: 尾段}}；冇可用斷點就回傳 None
+        """
+        self.scratch_dir.mkdir(parents=True, exist_ok=True)
+        signature = DemixCheckpoint._signature(mix)
+        self._input_sig = signature
+        state = self._load_state(signature, shapes)
+
+        mode = "r+" if state is not None else "w+"
+        for name, shape in shapes.items():
+            self._arrays[name] = np.lib.format.open_memmap(
+                self._path(f"{name}.npy"), mode=mode, dtype=np.float32, shape=tuple(shape) if mode == "w+" else None
+            )
+        self._frontier = state["frontier"] if state is not None else 0
+        self._last_commit = time.time()
+        return state
+
+    def _load_state(self, signature: str, shapes: dict[str, tuple]) -> Optional[dict]:
+        state_file = self._path("state.npz")
+        if not state_file.exists():
+            return None
+        try:
+            with np.load(state_file) as data:
+                meta = json.loads(str(data["meta"]))
+                tails = {name: data[f"tail_{name}"] for name in shapes}
+        except (OSError, ValueError, KeyError):
+            return None
+        if meta["signature"] != signature or meta["shapes"] != {k: list(v) for k, v in shapes.items()}:
+            return None
+        if not all(self._path(f"{name}.npy").exists() for name in shapes):
+            return None
+        return {"pos": meta["pos"], "frontier": meta["frontier"], "tails": tails}
+
+    def restore(self, accumulators: dict[str, np.ndarray], state: Optional[dict]) -> int:
+        """將斷點抄返入記憶體累加器 (最後一軸係時間)，回傳要由邊個位置繼續"""
+        if state is None:
+            return 0
+        frontier = state["frontier"]
+        for name, acc in accumulators.items():
+            acc[..., :frontier] = self._arrays[name][..., :frontier]
+            tail = state["tails"][name]
+            acc[..., frontier : frontier + tail.shape[-1]] = tail
+        print(f"[斷點] {self.tag}: 由 {state['pos']} / {acc.shape[-1]} 繼續")
+        return state["pos"]
+
+    def due(self, force: bool = False) -> bool:
+        """夠鐘 commit 未 (demix 可以先睇呢個，唔夠鐘就唔使準備累加器)"""
+        return force or time.time() - self._last_commit >= self.interval
+
+    def commit(
+        self, pos: int, accumulators: dict[str, np.ndarray], frontier: int, tail_end: int, force: bool = False
+    ) -> bool:
+        """
+        記低進度：[0, frontier) 已定稿 (寫入 memmap)，[frontier, tail_end) 係未定稿尾段，
+        下次由 pos 繼續。未夠 interval 而又唔係 force 就唔做。
+        """
+        now = time.time()
+        if not self.due(force):
+            return False
+
+        for name, acc in accumulators.items():
+            mm = self._arrays[name]
+            mm[..., self._frontier : frontier] = acc[..., self._frontier : frontier]
+            mm.flush()
+        self._frontier = frontier
+
+        meta = {
+            "signature": self._input_sig,
+            "shapes": {name: list(mm.shape) for name, mm in self._arrays.items()},
+            "pos": int(pos),
+            "frontier": int(frontier),
+        }
+        tails = {f"tail_{name}": np.array(acc[..., frontier:tail_end]) for name, acc in accumulators.items()}
+        tmp = self._path("state.npz.tmp")
+        with open(tmp, "wb") as f:
+            np.savez(f, meta=json.dumps(meta), **tails)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._path("state.npz"))
+        self._last_commit = now
+        return True
+
+    @staticmethod
+    def discard(scratch_dir: Path):
+        """成個檔案處理完先清走斷點 (chain 模式要等三級都完成)"""
+        shutil.rmtree(scratch_dir, ignore_errors=True)
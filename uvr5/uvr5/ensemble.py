@@ -0,0 +1,101 @@
+"""
+多模型 ensemble：同一段已解碼嘅混音，多頻帶 STFT 只做一次 (同 mp 嘅 VR 模型共用)，
+VR 模型直接喺共用頻譜上推理，其他模型 (Roformer / MDX) 嘅波形輸出轉入同一個頻譜域，
+最後用 spec_utils.ensembling (min_mag / max_mag / avg) 合併，只做一次 ISTFT。
+"""
+import json
+import os
+from types import SimpleNamespace
+
+import numpy as np
+from lib.lib_v5 import spec_utils
+from lib.lib_v5.model_param_init import ModelParameters
+from uvr5.vr import AudioPre, AudioPreDeEcho, _analyse, _mix_high_band, _predict, _synthesise, parent_directory
+
+ALGORITHMS = ("min_mag", "max_mag", "avg")
+
+
+def is_vr(func) -> bool:
+    return isinstance(func, (AudioPre, AudioPreDeEcho))
+
+
+def _domain_key(vr) -> tuple:
+    """頻譜域一樣 (mp / front-end / device / 高頻處理) 嘅模型可以共用分析結果"""
+    return (
+        json.dumps(vr.mp.param, sort_keys=True, default=str),
+        vr.data.get("torch_frontend", False),
+        str(vr.device),
+        vr.data["high_end_process"],
+    )
+
+
+def _default_domain(device):
+    """冇 VR 模型時用單頻帶 44100Hz 嘅頻譜域 (唔使重採樣；多頻帶嘅 ensemble.json 合成要 libsamplerate)"""
+    return SimpleNamespace(
+        mp=ModelParameters(os.path.join(parent_directory, "lib", "lib_v5", "modelparams", "1band_sr44100_hl512.json")),
+        device=device,
+        data={"torch_frontend": True, "high_end_process": "mirroring"},
+    )
+
+
+def _fit(spec: np.ndarray, frames: int) -> np.ndarray:
+    """時間軸補零 / 切到同混音一樣長 (各模型輸出長度可能差幾個 frame)"""
+    if spec.shape[2] >= frames:
+        return spec[:, :, :frames]
+    return np.pad(spec, ((0, 0), (0, 0), (0, frames - spec.shape[2])))
+
+
+class SpectralEnsemble:
+    """
+    用法：
+        ens = SpectralEnsemble(mix, models, device)
+        for func in models: ens.add_vr(func, is_hp3) 或 ens.add_wave(func.separate(mix)[0])
+        vocal, inst = ens.combine("avg")
+    每個模型貢獻「人聲嗰邊」嘅 stem (HP2/HP5: vocal；HP3: 反轉；DeEcho: 去延遲後人聲；Roformer / MDX: separate()[0])，
+    伴奏 = 混音頻譜 - 合併後人聲頻譜。
+    """
+
+    def __init__(self, mix: np.ndarray, models: list, device, sr: int = 44100):
+        self.mix = mix
+        self.sr = sr
+        vr_models = [func for func in models if is_vr(func)]
+        # 第一個 VR 模型嘅頻譜域做共用域，佢同同 mp 嘅模型唔使再轉換
+        self.ref = vr_models[0] if vr_models else _default_domain(device)
+        self._analyses = {}
+        self.X_spec_m, self.input_high_end_h, self.input_high_end = self._analysis(self.ref)
+        self.specs = []
+
+    def _analysis(self, vr):
+        """混音喺 vr 嘅頻譜域嘅分析結果，每個域只做一次"""
+        key = _domain_key(vr)
+        if key not in self._analyses:
+            self._analyses[key] = _analyse(vr, _mix_high_band(vr, self.mix, self.sr))
+        return self._analyses[key]
+
+    def add_vr(self, vr, is_hp3: bool = False):
+        X_spec_m, input_high_end_h, input_high_end = self._analysis(vr)
+        y_spec_m, v_spec_m = _predict(vr, X_spec_m)
+        # AudioPre 嘅 y 係伴奏 (HP3 反轉)；AudioPreDeEcho 嘅 y 係去延遲後人聲
+        stem = v_spec_m if isinstance(vr, AudioPre) and not is_hp3 else y_spec_m
+        if _domain_key(vr) == _domain_key(self.ref):
+            self.specs.append(_fit(stem, self.X_spec_m.shape[2]))
+        else:
+            wave = _synthesise(vr, stem, input_high_end_h, input_high_end)
+            self.add_wave(wave.T, vr.mp.param["sr"])
+
+    def add_wave(self, wave: np.ndarray, sr: int = 44100):
+        """波形輸出 (2, N) 轉入共用頻譜域"""
+        spec = _analyse(self.ref, _mix_high_band(self.ref, np.asarray(wave), sr))[0]
+        self.specs.append(_fit(spec, self.X_spec_m.shape[2]))
+
+    def combine(self, algorithm: str = "avg"):
+        """回傳 (人聲, 伴奏) 波形，均為 (2, N)，取樣率 self.ref.mp.param["sr"]"""
+        if algorithm not in ALGORITHMS:
+            raise ValueError(f"未知 ensemble 方法 {algorithm}，可用: {ALGORITHMS}")
+        if not self.specs:
+            raise ValueError("冇模型輸出可以合併")
+        v_spec_m = spec_utils.ensembling(algorithm, list(self.specs))
+        y_spec_m = self.X_spec_m - v_spec_m
+        wav_v = _synthesise(self.ref, v_spec_m, self.input_high_end_h, self.input_high_end)
+        wav_y = _synthesise(self.ref, y_spec_m, self.input_high_end_h, self.input_high_end)
+        return wav_v.T, wav_y.T
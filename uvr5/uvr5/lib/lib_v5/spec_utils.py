@@ -331,7 +331,7 @@ def cmb_spectrogram_to_wave(spec_m, mp, extra_bins_h=None, extra_bins=None):
 
     for d in range(1, bands_n + 1):
         bp = mp.param["band"][d]
-        spec_s = np.ndarray(shape=(2, bp["n_fft"] // 2 + 1, spec_m.shape[2]), dtype=complex)
+        spec_s = np.zeros(shape=(2, bp["n_fft"] // 2 + 1, spec_m.shape[2]), dtype=complex)
         h = bp["crop_stop"] - bp["crop_start"]
         spec_s[:, bp["crop_start"] : bp["crop_stop"], :] = spec_m[:, offset : offset + h, :]
 
@@ -451,10 +451,13 @@ def mirroring(a, spec_m, input_high_end, mp):
 
 
 def ensembling(a, specs):
-    for i in range(1, len(specs)):
-        if i == 1:
-            spec = specs[0]
+    spec = specs[0]
+    if "avg" == a:
+        # 複數頻譜直接平均 (同 UVR 嘅 Average 一樣)
+        ln = min([specs[i].shape[2] for i in range(len(specs))])
+        return sum(specs[i][:, :, :ln] for i in range(len(specs))) / len(specs)
 
+    for i in range(1, len(specs)):
         ln = min([spec.shape[2], specs[i].shape[2]])
         spec = spec[:, :, :ln]
         specs[i] = specs[i][:, :, :ln]
@@ -498,7 +501,7 @@ if __name__ == "__main__":
         "--algorithm",
         "-a",
         type=str,
-        choices=["invert", "invert_p", "min_mag", "max_mag", "deep", "align"],
+        choices=["invert", "invert_p", "min_mag", "max_mag", "avg", "deep", "align"],
         default="min_mag",
     )
     p.add_argument(
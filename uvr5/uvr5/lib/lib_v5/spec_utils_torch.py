@@ -0,0 +1,297 @@
+"""
+spec_utils 多頻帶分析 / 合成嘅 torch 版本 (同模型用同一個 device)。
+逐個函數對應 spec_utils 入面同名嘅 librosa / numpy 實現，數值喺浮點誤差範圍內一致：
+  - STFT / ISTFT: hann 窗，center=True，constant padding (同 librosa.stft / istft 預設一樣)
+  - polyphase 重採樣: 同 scipy.signal.resample_poly 一樣嘅 kaiser(5.0) FIR + upfirdn
+  - scipy 重採樣: 同 scipy.signal.resample 一樣嘅 FFT 截斷 / 補零
+其他 res_type (kaiser_fast / sinc_* 等) 冇對應實現，supported() 會回傳 False，由呼叫方退返 librosa 路徑。
+"""
+import math
+
+import numpy as np
+import torch
+from scipy.signal import firwin
+
+# 有 torch 實現嘅 res_type (librosa.resample 嘅名)
+_RES_TYPES = {
+    "polyphase": "poly",
+    "scipy": "fft",
+    "fft": "fft",
+}
+
+_windows = {}
+_poly_filters = {}
+
+
+def _hann(n_fft, device, dtype):
+    key = (n_fft, str(device), dtype)
+    if key not in _windows:
+        _windows[key] = torch.hann_window(n_fft, periodic=True, dtype=dtype, device=device)
+    return _windows[key]
+
+
+def _resample_kind(orig_sr, target_sr, res_type):
+    if orig_sr == target_sr:
+        return "none"
+    return _RES_TYPES.get(res_type)
+
+
+def supported(mp):
+    """mp 嘅分析 / 合成用到嘅重採樣係咪全部有 torch 實現"""
+    bands_n = len(mp.param["band"])
+    for d in range(1, bands_n):
+        bp, bp_next = mp.param["band"][d], mp.param["band"][d + 1]
+        # 分析: 由上一級頻帶降採樣
+        if _resample_kind(bp_next["sr"], bp["sr"], bp["res_type"]) is None:
+            return False
+        # 合成: 最低頻帶用 sinc_fastest，其餘用 scipy
+        if _resample_kind(bp["sr"], bp_next["sr"], "sinc_fastest" if d == 1 else "scipy") is None:
+            return False
+    return True
+
+
+def _n_samples(n_in, orig_sr, target_sr):
+    # 同 librosa.resample 一樣計輸出長度
+    return int(np.ceil(n_in * (float(target_sr) / orig_sr)))
+
+
+def _fix_length(wave, size):
+    n = wave.shape[-1]
+    if n > size:
+        return wave[..., :size]
+    if n < size:
+        return torch.nn.functional.pad(wave, (0, size - n))
+    return wave
+
+
+def resample_poly(wave, orig_sr, target_sr):
+    """等同 librosa.resample(res_type="polyphase")，wave: (..., N)"""
+    g = math.gcd(int(orig_sr), int(target_sr))
+    up, down = int(target_sr) // g, int(orig_sr) // g
+    if up == down == 1:
+        return wave
+    key = (up, down, str(wave.device), wave.dtype)
+    if key not in _poly_filters:
+        max_rate = max(up, down)
+        half_len = 10 * max_rate
+        h = firwin(2 * half_len + 1, 1.0 / max_rate, window=("kaiser", 5.0)) * up
+        # conv1d 係 cross-correlation，要反轉濾波器
+        _poly_filters[key] = (torch.as_tensor(h[::-1].copy(), dtype=wave.dtype, device=wave.device), half_len)
+    h, half_len = _poly_filters[key]
+
+    shape = wave.shape
+    x = wave.reshape(-1, 1, shape[-1])
+    n_in = shape[-1]
+    if up > 1:
+        # upfirdn 嘅插零
+        x_up = x.new_zeros(x.shape[0], 1, n_in * up)
+        x_up[..., ::up] = x
+        x = x_up
+    n_out = -(-n_in * up // down)
+    # 輸出第 k 點 = 濾波結果第 half_len + k * down 點 (scipy 會將濾波器前面補零令輸出對齊中心)
+    need = (n_out - 1) * down + h.shape[0]
+    x = torch.nn.functional.pad(x, (half_len, max(0, need - half_len - x.shape[-1])))
+    y = torch.nn.functional.conv1d(x, h.view(1, 1, -1), stride=down)[..., :n_out]
+    y = y.reshape(*shape[:-1], n_out)
+    return _fix_length(y, _n_samples(n_in, orig_sr, target_sr))
+
+
+def resample_fft(wave, orig_sr, target_sr):
+    """等同 librosa.resample(res_type="scipy")，wave: (..., N)"""
+    if orig_sr == target_sr:
+        return wave
+    n_x = wave.shape[-1]
+    num = _n_samples(n_x, orig_sr, target_sr)
+    m = min(num, n_x)
+    X = torch.fft.rfft(wave)[..., : m // 2 + 1]
+    if m % 2 == 0 and num != n_x:
+        # 拆開 / 合併 Nyquist bin (同 scipy.signal.resample 一樣)
+        X = X.clone()
+        X[..., m // 2] *= 2 if num < n_x else 0.5
+    return torch.fft.irfft(X * (num / n_x), n=num)
+
+
+def resample(wave, orig_sr, target_sr, res_type):
+    kind = _resample_kind(orig_sr, target_sr, res_type)
+    if kind == "none":
+        return wave
+    if kind == "poly":
+        return resample_poly(wave, orig_sr, target_sr)
+    if kind == "fft":
+        return resample_fft(wave, orig_sr, target_sr)
+    raise NotImplementedError(f"res_type {res_type} 冇 torch 實現")
+
+
+def wave_to_spectrogram(wave, hop_length, n_fft, mid_side=False, mid_side_b2=False, reverse=False):
+    """wave: (2, N) 實數 tensor，回傳 (2, n_fft // 2 + 1, T) complex tensor；兩聲道一次過 STFT"""
+    if reverse:
+        wave = torch.flip(wave, dims=[1])
+    elif mid_side:
+        wave = torch.stack([(wave[0] + wave[1]) / 2, wave[0] - wave[1]])
+    elif mid_side_b2:
+        wave = torch.stack([wave[1] + wave[0] * 0.5, wave[0] - wave[1] * 0.5])
+
+    return torch.stft(
+        wave,
+        n_fft=n_fft,
+        hop_length=hop_length,
+        window=_hann(n_fft, wave.device, wave.dtype),
+        center=True,
+        pad_mode="constant",
+        return_complex=True,
+    )
+
+
+def spectrogram_to_wave(spec, hop_length, mid_side, mid_side_b2, reverse):
+    """spec: (2, F, T) complex tensor，回傳 (2, N)"""
+    n_fft = 2 * (spec.shape[1] - 1)
+    wave = torch.istft(
+        spec,
+        n_fft=n_fft,
+        hop_length=hop_length,
+        window=_hann(n_fft, spec.device, spec.real.dtype),
+        center=True,
+    )
+    wave_left, wave_right = wave[0], wave[1]
+
+    if reverse:
+        return torch.flip(wave, dims=[1])
+    elif mid_side:
+        return torch.stack([wave_left + wave_right / 2, wave_left - wave_right / 2])
+    elif mid_side_b2:
+        return torch.stack([wave_right / 1.25 + 0.4 * wave_left, wave_left / 1.25 - 0.4 * wave_right])
+    else:
+        return wave
+
+
+def _lp_gains(bin_start, bin_stop):
+    g, gains = 1.0, []
+    for _ in range(bin_start, bin_stop):
+        g -= 1 / (bin_stop - bin_start)
+        gains.append(g)
+    return gains
+
+
+def fft_lp_filter(spec, bin_start, bin_stop):
+    if bin_stop > bin_start:
+        gains = torch.tensor(_lp_gains(bin_start, bin_stop), dtype=spec.real.dtype, device=spec.device)
+        spec[:, bin_start:bin_stop, :] *= gains[:, None]
+    spec[:, bin_stop:, :] = 0
+
+    return spec
+
+
+def fft_hp_filter(spec, bin_start, bin_stop):
+    g, gains = 1.0, []
+    for _ in range(bin_start, bin_stop, -1):
+        g -= 1 / (bin_start - bin_stop)
+        gains.append(g)
+    if gains:
+        # bin 由 bin_start 向下行到 bin_stop + 1
+        gains = torch.tensor(gains[::-1], dtype=spec.real.dtype, device=spec.device)
+        spec[:, bin_stop + 1 : bin_start + 1, :] *= gains[:, None]
+    spec[:, 0 : bin_stop + 1, :] = 0
+
+    return spec
+
+
+def combine_spectrograms(specs, mp):
+    l = min([specs[i].shape[2] for i in specs])
+    ref = specs[len(mp.param["band"])]
+    spec_c = torch.zeros((2, mp.param["bins"] + 1, l), dtype=ref.dtype, device=ref.device)
+    offset = 0
+    bands_n = len(mp.param["band"])
+
+    for d in range(1, bands_n + 1):
+        h = mp.param["band"][d]["crop_stop"] - mp.param["band"][d]["crop_start"]
+        spec_c[:, offset : offset + h, :l] = specs[d][
+            :, mp.param["band"][d]["crop_start"] : mp.param["band"][d]["crop_stop"], :l
+        ]
+        offset += h
+
+    if offset > mp.param["bins"]:
+        raise ValueError("Too much bins")
+
+    # lowpass fiter
+    if mp.param["pre_filter_start"] > 0:
+        if bands_n == 1:
+            spec_c = fft_lp_filter(spec_c, mp.param["pre_filter_start"], mp.param["pre_filter_stop"])
+        else:
+            gp, gains = 1, []
+            for b in range(mp.param["pre_filter_start"] + 1, mp.param["pre_filter_stop"]):
+                g = math.pow(10, -(b - mp.param["pre_filter_start"]) * (3.5 - gp) / 20.0)
+                gp = g
+                gains.append(g)
+            if gains:
+                start = mp.param["pre_filter_start"] + 1
+                gains = torch.tensor(gains, dtype=spec_c.real.dtype, device=spec_c.device)
+                spec_c[:, start : start + len(gains), :] *= gains[:, None]
+
+    return spec_c
+
+
+def mirroring(a, spec_m, input_high_end, mp):
+    mirror = torch.flip(
+        torch.abs(
+            spec_m[
+                :,
+                mp.param["pre_filter_start"] - 10 - input_high_end.shape[1] : mp.param["pre_filter_start"] - 10,
+                :,
+            ]
+        ),
+        dims=[1],
+    )
+    if "mirroring" == a:
+        mirror = torch.polar(mirror, torch.angle(input_high_end))
+
+        return torch.where(torch.abs(input_high_end) <= torch.abs(mirror), input_high_end, mirror)
+
+    if "mirroring2" == a:
+        mi = mirror * (input_high_end * 1.7)
+
+        return torch.where(torch.abs(input_high_end) <= torch.abs(mi), input_high_end, mi)
+
+
+def cmb_spectrogram_to_wave(spec_m, mp, extra_bins_h=None, extra_bins=None):
+    """spec_m: (2, bins + 1, T) complex tensor，回傳 (N, 2) tensor"""
+    bands_n = len(mp.param["band"])
+    offset = 0
+
+    for d in range(1, bands_n + 1):
+        bp = mp.param["band"][d]
+        spec_s = torch.zeros((2, bp["n_fft"] // 2 + 1, spec_m.shape[2]), dtype=spec_m.dtype, device=spec_m.device)
+        h = bp["crop_stop"] - bp["crop_start"]
+        spec_s[:, bp["crop_start"] : bp["crop_stop"], :] = spec_m[:, offset : offset + h, :]
+
+        offset += h
+        if d == bands_n:  # higher
+            if extra_bins_h:  # if --high_end_process bypass
+                max_bin = bp["n_fft"] // 2
+                spec_s[:, max_bin - extra_bins_h : max_bin, :] = extra_bins[:, :extra_bins_h, :]
+            if bp["hpf_start"] > 0:
+                spec_s = fft_hp_filter(spec_s, bp["hpf_start"], bp["hpf_stop"] - 1)
+            band_wave = spectrogram_to_wave(
+                spec_s, bp["hl"], mp.param["mid_side"], mp.param["mid_side_b2"], mp.param["reverse"]
+            )
+            wave = band_wave if bands_n == 1 else wave + band_wave
+        else:
+            sr = mp.param["band"][d + 1]["sr"]
+            if d == 1:  # lower
+                spec_s = fft_lp_filter(spec_s, bp["lpf_start"], bp["lpf_stop"])
+                wave = resample(
+                    spectrogram_to_wave(
+                        spec_s, bp["hl"], mp.param["mid_side"], mp.param["mid_side_b2"], mp.param["reverse"]
+                    ),
+                    bp["sr"],
+                    sr,
+                    "sinc_fastest",
+                )
+            else:  # mid
+                spec_s = fft_hp_filter(spec_s, bp["hpf_start"], bp["hpf_stop"] - 1)
+                spec_s = fft_lp_filter(spec_s, bp["lpf_start"], bp["lpf_stop"])
+                wave2 = wave + spectrogram_to_wave(
+                    spec_s, bp["hl"], mp.param["mid_side"], mp.param["mid_side_b2"], mp.param["reverse"]
+                )
+                wave = resample(wave2, bp["sr"], sr, "scipy")
+
+    return wave.T
@@ -25,31 +25,35 @@ def make_padding(width, cropsize, offset):
 def inference(X_spec, device, model, aggressiveness, data):
     """
     data : dic configs
+    data["batch_size"] : 每次 forward 疊幾多個窗口 (預設 4)；TTA 嘅錯位窗口同正常窗口混埋一齊入批
     """
 
-    def _execute(X_mag_pad, roi_size, n_window, device, model, aggressiveness, is_half=True):
+    def _execute(passes, roi_size, device, model, aggressiveness, is_half=True, batch_size=4):
+        """
+        passes: [(X_mag_pad, n_window), ...]，每個 pass 嘅窗口一齊排隊，逐批 forward。
+        X_mag_pad 一次過搬上 device，窗口喺 device 上切，結果留喺 device 直到最後 concat 先搬返 CPU。
+        """
         model.eval()
         with torch.no_grad():
-            preds = []
-
-            iterations = [n_window]
-
-            total_iterations = sum(iterations)
-            for i in tqdm(range(n_window)):
-                start = i * roi_size
-                X_mag_window = X_mag_pad[None, :, :, start : start + data["window_size"]]
-                X_mag_window = torch.from_numpy(X_mag_window)
+            pads = []
+            for X_mag_pad, _ in passes:
+                X_mag_pad = torch.from_numpy(X_mag_pad)
                 if is_half:
-                    X_mag_window = X_mag_window.half()
-                X_mag_window = X_mag_window.to(device)
-
+                    X_mag_pad = X_mag_pad.half()
+                pads.append(X_mag_pad.to(device))
+
+            windows = [(p, i * roi_size) for p, (_, n_window) in enumerate(passes) for i in range(n_window)]
+            preds = [[] for _ in passes]
+            for b in tqdm(range(0, len(windows), batch_size)):
+                batch = windows[b : b + batch_size]
+                X_mag_window = torch.stack(
+                    [pads[p][:, :, start : start + data["window_size"]] for p, start in batch]
+                )
                 pred = model.predict(X_mag_window, aggressiveness)
+                for (p, _), h in zip(batch, pred):
+                    preds[p].append(h)
 
-                pred = pred.detach().cpu().numpy()
-                preds.append(pred[0])
-
-            pred = np.concatenate(preds, axis=2)
-        return pred
+        return [torch.cat(pred, dim=2).detach().cpu().numpy() for pred in preds]
 
     def preprocess(X_spec):
         X_mag = np.abs(X_spec)
@@ -66,24 +70,26 @@ def inference(X_spec, device, model, aggressiveness, data):
     pad_l, pad_r, roi_size = make_padding(n_frame, data["window_size"], model.offset)
     n_window = int(np.ceil(n_frame / roi_size))
 
-    X_mag_pad = np.pad(X_mag_pre, ((0, 0), (0, 0), (pad_l, pad_r)), mode="constant")
+    passes = [(np.pad(X_mag_pre, ((0, 0), (0, 0), (pad_l, pad_r)), mode="constant"), n_window)]
+    if data["tta"]:
+        # 錯開半個 roi 再推一次，同正常 pass 共用批次
+        pad_l += roi_size // 2
+        pad_r += roi_size // 2
+        passes.append((np.pad(X_mag_pre, ((0, 0), (0, 0), (pad_l, pad_r)), mode="constant"), n_window + 1))
 
-    if list(model.state_dict().values())[0].dtype == torch.float16:
+    # ONNX Runtime 版本 (cpu_infer.OnnxVRNet) 冇 torch 參數，當 FP32
+    params = list(model.state_dict().values())
+    if params and params[0].dtype == torch.float16:
         is_half = True
     else:
         is_half = False
-    pred = _execute(X_mag_pad, roi_size, n_window, device, model, aggressiveness, is_half)
-    pred = pred[:, :, :n_frame]
+    preds = _execute(
+        passes, roi_size, device, model, aggressiveness, is_half, max(1, int(data.get("batch_size", 4)))
+    )
+    pred = preds[0][:, :, :n_frame]
 
     if data["tta"]:
-        pad_l += roi_size // 2
-        pad_r += roi_size // 2
-        n_window += 1
-
-        X_mag_pad = np.pad(X_mag_pre, ((0, 0), (0, 0), (pad_l, pad_r)), mode="constant")
-
-        pred_tta = _execute(X_mag_pad, roi_size, n_window, device, model, aggressiveness, is_half)
-        pred_tta = pred_tta[:, :, roi_size // 2 :]
+        pred_tta = preds[1][:, :, roi_size // 2 :]
         pred_tta = pred_tta[:, :, :n_frame]
 
         return (pred + pred_tta) * 0.5 * coef, X_mag, np.exp(1.0j * X_phase)
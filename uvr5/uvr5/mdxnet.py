@@ -1,5 +1,6 @@
 import os
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 logger = logging.getLogger(__name__)
@@ -10,6 +11,8 @@ import soundfile as sf
 import torch
 from tqdm import tqdm
 
+from uvr5.audio_ingest import subtract
+
 cpu = torch.device("cpu")
 
 
@@ -73,6 +76,8 @@ def get_models(device, dim_f, dim_t, n_fft):
 
 
 class Predictor:
+    batched = False
+
     def __init__(self, args):
         import onnxruntime as ort
 
@@ -84,6 +89,8 @@ class Predictor:
         path : Path = Path(args.onnx)
         if path.is_file():
             model_path = path
+        # cpu_infer 換 session (量化 / 限 thread) 時要用返原本嘅模型檔
+        self.model_path = model_path
         self.model = ort.InferenceSession(
             model_path,
             providers=[
@@ -94,7 +101,22 @@ class Predictor:
         )
         logger.info("ONNX load done")
 
-    def demix(self, mix):
+        # 批量模式：denoise 嘅 -spek / spek 拼成一批，經 IOBinding 行，下一段 STFT 同目前段推理並行
+        self.batched = getattr(args, "batched", False)
+        self._io_device = "cuda" if self.model.get_providers()[0] == "CUDAExecutionProvider" else "cpu"
+        input_meta, output_meta = self.model.get_inputs()[0], self.model.get_outputs()[0]
+        self._output_name = output_meta.name
+        # batch 維度固定嘅模型拼唔到批，退返逐次 run
+        if isinstance(input_meta.shape[0], int):
+            self.batched = False
+        # 輸出同輸入一樣 shape 就預先開好 numpy buffer 俾 ORT 直接寫入 (CPU)
+        self._output_like_input = len(input_meta.shape) == len(output_meta.shape) and all(
+            o == i or not isinstance(o, int) or not isinstance(i, int)
+            for o, i in zip(output_meta.shape, input_meta.shape)
+        )
+
+    def demix(self, mix, checkpoint=None):
+        """checkpoint (DemixCheckpoint) 唔係 None 就逐段將輸出存落 memmap，崩潰後由上次 commit 嘅段繼續"""
         samples = mix.shape[-1]
         margin = self.args.margin
         chunk_size = self.args.chunks * 44100
@@ -116,10 +138,14 @@ class Predictor:
 
             start = skip - s_margin
 
-            segmented_mix[skip] = mix[:, start:end].copy()
+            # 只存 view，用到先由 mix (可能係 memmap) 讀嗰段
+            segmented_mix[skip] = mix[:, start:end]
             if end == samples:
                 break
 
+        if checkpoint is not None:
+            return self._demix_checkpointed(mix, segmented_mix, margin, checkpoint)
+
         sources = self.demix_base(segmented_mix, margin_size=margin)
         """
         mix:(2,big_sample)
@@ -128,44 +154,52 @@ class Predictor:
         """
         return sources
 
-    def demix_base(self, mixes, margin_size):
+    def _demix_checkpointed(self, mix, segmented_mix, margin, checkpoint):
+        """
+        同 demix_base 一樣逐段做，但每段輸出即刻放入 (1, 2, N) 嘅累加器並 commit；
+        段與段之間冇重疊 (margin 已經裁走)，所以做完嘅段就係定稿，冇尾段
+        """
+        samples = mix.shape[-1]
+        sources = np.zeros((1, 2, samples), dtype=np.float32)
+        accumulators = {"sources": sources}
+        pos = checkpoint.restore(accumulators, checkpoint.open(mix, {"sources": sources.shape}))
+
+        skips = list(segmented_mix)
+        keys = [skip for skip in skips if skip >= pos]
+        if self.batched:
+            # 批量模式照樣預取下一段 STFT，每段做完即刻 commit
+            outputs = self._iter_batched(segmented_mix, margin, keys)
+        else:
+            outputs = ((skip, self.demix_base(segmented_mix, margin_size=margin, keys=[skip])) for skip in keys)
+        for skip, out in outputs:
+            end = skip + out.shape[-1]
+            sources[..., skip:end] = out
+            checkpoint.commit(end, accumulators, end, end, force=skip == skips[-1])
+        return sources
+
+    def demix_base(self, mixes, margin_size, keys=None):
+        """keys 指定只做邊幾段 (斷點續做用)；頭尾段嘅 margin 裁剪照樣按成個 mixes 判斷"""
+        keys = list(mixes) if keys is None else keys
+        if self.batched:
+            return self._demix_base_batched(mixes, margin_size, keys)
+
         chunked_sources = []
-        progress_bar = tqdm(total=len(mixes))
+        progress_bar = tqdm(total=len(keys))
         progress_bar.set_description("Processing")
-        for mix in mixes:
-            cmix = mixes[mix]
+        for mix in keys:
             sources = []
-            n_sample = cmix.shape[1]
-            model = self.model_
-            trim = model.n_fft // 2
-            gen_size = model.chunk_size - 2 * trim
-            pad = gen_size - n_sample % gen_size
-            mix_p = np.concatenate((np.zeros((2, trim)), cmix, np.zeros((2, pad)), np.zeros((2, trim))), 1)
-            mix_waves = []
-            i = 0
-            while i < n_sample + pad:
-                waves = np.array(mix_p[:, i : i + model.chunk_size])
-                mix_waves.append(waves)
-                i += gen_size
-            mix_waves = torch.tensor(mix_waves, dtype=torch.float32).to(cpu)
             with torch.no_grad():
                 _ort = self.model
-                spek = model.stft(mix_waves)
+                spek, pad = self._stft_segment(mixes[mix])
                 if self.args.denoise:
                     spec_pred = (
                         -_ort.run(None, {"input": -spek.cpu().numpy()})[0] * 0.5
                         + _ort.run(None, {"input": spek.cpu().numpy()})[0] * 0.5
                     )
-                    tar_waves = model.istft(torch.tensor(spec_pred))
                 else:
-                    tar_waves = model.istft(torch.tensor(_ort.run(None, {"input": spek.cpu().numpy()})[0]))
-                tar_signal = tar_waves[:, :, trim:-trim].transpose(0, 1).reshape(2, -1).numpy()[:, :-pad]
-
-                start = 0 if mix == 0 else margin_size
-                end = None if mix == list(mixes.keys())[::-1][0] else -margin_size
-                if margin_size == 0:
-                    end = None
-                sources.append(tar_signal[:, start:end])
+                    spec_pred = _ort.run(None, {"input": spek.cpu().numpy()})[0]
+                tar_signal = self._istft_segment(spec_pred, pad)
+                sources.append(Predictor._trim_margin(tar_signal, mix, mixes, margin_size))
 
                 progress_bar.update(1)
 
@@ -175,23 +209,117 @@ class Predictor:
         progress_bar.close()
         return _sources
 
-    def prediction(self, m, vocal_root, others_root, format):
+    def _stft_segment(self, cmix):
+        """一段 mix 補零切成 chunk_size 嘅窗口做 STFT，回傳 (spek, pad)"""
+        model = self.model_
+        n_sample = cmix.shape[1]
+        trim = model.n_fft // 2
+        gen_size = model.chunk_size - 2 * trim
+        pad = gen_size - n_sample % gen_size
+        mix_p = np.concatenate((np.zeros((2, trim)), cmix, np.zeros((2, pad)), np.zeros((2, trim))), 1)
+        mix_waves = []
+        i = 0
+        while i < n_sample + pad:
+            waves = np.array(mix_p[:, i : i + model.chunk_size])
+            mix_waves.append(waves)
+            i += gen_size
+        mix_waves = torch.tensor(np.array(mix_waves), dtype=torch.float32).to(cpu)
+        with torch.no_grad():
+            return model.stft(mix_waves), pad
+
+    def _istft_segment(self, spec_pred, pad):
+        model = self.model_
+        trim = model.n_fft // 2
+        with torch.no_grad():
+            tar_waves = model.istft(torch.tensor(spec_pred))
+        return tar_waves[:, :, trim:-trim].transpose(0, 1).reshape(2, -1).numpy()[:, :-pad]
+
+    @staticmethod
+    def _trim_margin(tar_signal, key, mixes, margin_size):
+        start = 0 if key == 0 else margin_size
+        end = None if key == list(mixes.keys())[::-1][0] else -margin_size
+        if margin_size == 0:
+            end = None
+        return tar_signal[:, start:end]
+
+    def _run_batched(self, spek):
+        """denoise 時 -spek 同 spek 拼成一批，經 IOBinding 一次過行 session，回傳 spec_pred"""
+        import onnxruntime as ort
+
+        spek = spek.numpy()
+        n = spek.shape[0]
+        # 直接寫入一個連續 buffer (spek 係裁過頻率軸嘅 view，本身唔連續)
+        x = np.empty((2 * n if self.args.denoise else n,) + spek.shape[1:], dtype=np.float32)
+        if self.args.denoise:
+            np.negative(spek, out=x[:n])
+        x[-n:] = spek
+
+        binding = self.model.io_binding()
+        binding.bind_ortvalue_input("input", ort.OrtValue.ortvalue_from_numpy(x, self._io_device, 0))
+        if self._io_device == "cpu" and self._output_like_input:
+            # ORT 直接寫入呢個 buffer，唔使再抄一次輸出
+            out = np.empty_like(x)
+            binding.bind_ortvalue_output(self._output_name, ort.OrtValue.ortvalue_from_numpy(out))
+            self.model.run_with_iobinding(binding)
+        else:
+            binding.bind_output(self._output_name, self._io_device)
+            self.model.run_with_iobinding(binding)
+            out = binding.copy_outputs_to_cpu()[0]
+
+        if self.args.denoise:
+            return -out[:n] * 0.5 + out[n:] * 0.5
+        return out
+
+    def _iter_batched(self, mixes, margin_size, keys):
+        """
+        逐段 yield (key, (1, 2, n) 輸出)，用 _run_batched，並喺 session 行緊第 N 段時由另一條 thread 做第 N+1 段嘅 STFT；
+        調用方處理第 N 段 (例如 checkpoint commit) 時第 N+1 段嘅 STFT 亦已經喺度做
+        """
+        progress_bar = tqdm(total=len(keys))
+        progress_bar.set_description("Processing")
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            future = pool.submit(self._stft_segment, mixes[keys[0]]) if keys else None
+            for n, key in enumerate(keys):
+                spek, pad = future.result()
+                if n + 1 < len(keys):
+                    future = pool.submit(self._stft_segment, mixes[keys[n + 1]])
+                tar_signal = self._istft_segment(self._run_batched(spek), pad)
+                progress_bar.update(1)
+                yield key, Predictor._trim_margin(tar_signal, key, mixes, margin_size)[None]
+        progress_bar.close()
+
+    def _demix_base_batched(self, mixes, margin_size, keys):
+        """同 demix_base 一樣，但用 _iter_batched (預取下一段 STFT)"""
+        return np.concatenate([out for _, out in self._iter_batched(mixes, margin_size, keys)], axis=-1)
+
+    def separate(self, mix, checkpoint=None):
+        """記憶體版本：mix 係 44100Hz 嘅 (2, N) 波形，回傳 (main_vocal, others)，均為 (2, N)"""
+        if mix.ndim == 1:
+            mix = np.asfortranarray([mix, mix])
+        opt = self.demix(mix, checkpoint)[0]
+        return subtract(mix, opt), opt
+
+    def prediction(self, m, vocal_root, others_root, format, checkpoint=None, mix=None):
+        """mix: 已經解碼好嘅 44100Hz (2, N) 波形 (audio_ingest)，None 就由 m 讀"""
         os.makedirs(vocal_root, exist_ok=True)
         os.makedirs(others_root, exist_ok=True)
         basename = os.path.basename(m)
-        mix, rate = librosa.load(m, mono=False, sr=44100)
+        if mix is None:
+            mix, rate = librosa.load(m, mono=False, sr=44100)
+        else:
+            rate = 44100
         if mix.ndim == 1:
             mix = np.asfortranarray([mix, mix])
-        mix = mix.T
-        sources = self.demix(mix.T)
+        sources = self.demix(mix, checkpoint)
         opt = sources[0].T
+        main_vocal = subtract(mix, sources[0]).T
         if format in ["wav", "flac"]:
-            sf.write("%s/%s_main_vocal.%s" % (vocal_root, basename, format), mix - opt, rate)
+            sf.write("%s/%s_main_vocal.%s" % (vocal_root, basename, format), main_vocal, rate)
             sf.write("%s/%s_others.%s" % (others_root, basename, format), opt, rate)
         else:
             path_vocal = "%s/%s_main_vocal.wav" % (vocal_root, basename)
             path_other = "%s/%s_others.wav" % (others_root, basename)
-            sf.write(path_vocal, mix - opt, rate)
+            sf.write(path_vocal, main_vocal, rate)
             sf.write(path_other, opt, rate)
             opt_path_vocal = path_vocal[:-4] + ".%s" % format
             opt_path_other = path_other[:-4] + ".%s" % format
@@ -225,8 +353,13 @@ class MDXNetDereverb:
         self.dim_f = 3072
         self.n_fft = 6144
         self.denoise = True
+        # -spek / spek 一批過 + IOBinding + STFT 流水線 (Predictor 見到模型 batch 維度固定會自動關閉)
+        self.batched = True
         self.pred = Predictor(self)
         self.device = cpu
 
-    def _path_audio_(self, input, others_root, vocal_root, format, is_hp3=False):
-        self.pred.prediction(input, vocal_root, others_root, format)
+    def separate(self, mix, checkpoint=None):
+        return self.pred.separate(mix, checkpoint)
+
+    def _path_audio_(self, input, others_root, vocal_root, format, is_hp3=False, checkpoint=None, mix=None):
+        self.pred.prediction(input, vocal_root, others_root, format, checkpoint, mix)
@@ -10,14 +10,160 @@ import numpy as np
 import soundfile as sf
 import torch
 from lib.lib_v5 import nets_61968KB as Nets
-from lib.lib_v5 import spec_utils
+from lib.lib_v5 import spec_utils, spec_utils_torch
 from lib.lib_v5.model_param_init import ModelParameters
 from lib.lib_v5.nets_new import CascadedNet
 from lib.utils import inference
 
 
+def _load_high_band(vr, music_file):
+    """用最高頻帶嘅取樣率讀入音頻，回傳 (2, N) float32"""
+    bp = vr.mp.param["band"][len(vr.mp.param["band"])]
+    X_wave, _ = librosa.core.load(  # 理论上librosa读取可能对某些音频有bug，应该上ffmpeg读取，但是太麻烦了弃坑
+        music_file,
+        sr=bp["sr"],
+        mono=False,
+        dtype=np.float32,
+        res_type=bp["res_type"],
+    )
+    if X_wave.ndim == 1:
+        X_wave = np.asfortranarray([X_wave, X_wave])
+    return X_wave
+
+
+def _mix_high_band(vr, mix, sr):
+    """已解碼嘅波形 (2, N) 或 (N,) 轉做最高頻帶取樣率嘅 (2, N) float32"""
+    if mix.ndim == 1:
+        mix = np.asfortranarray([mix, mix])
+    bp = vr.mp.param["band"][len(vr.mp.param["band"])]
+    if sr != bp["sr"]:
+        mix = librosa.core.resample(mix, orig_sr=sr, target_sr=bp["sr"], res_type=bp["res_type"])
+    return np.asarray(mix, dtype=np.float32)
+
+
+def _torch_frontend(vr):
+    """多頻帶分析 / 合成用唔用 torch (同模型同一個 device)；mp 有冇 torch 實現嘅重採樣就退返 librosa"""
+    return vr.data.get("torch_frontend", False) and spec_utils_torch.supported(vr.mp)
+
+
+def _analyse(vr, X_wave_high):
+    """多頻帶 STFT：由最高頻帶波形逐級降採樣，回傳 (X_spec_m, input_high_end_h, input_high_end)"""
+    if _torch_frontend(vr):
+        return _analyse_torch(vr, X_wave_high)
+    X_wave, X_spec_s = {}, {}
+    input_high_end_h, input_high_end = None, None
+    bands_n = len(vr.mp.param["band"])
+    for d in range(bands_n, 0, -1):
+        bp = vr.mp.param["band"][d]
+        if d == bands_n:  # high-end band
+            X_wave[d] = X_wave_high
+        else:  # lower bands
+            X_wave[d] = librosa.core.resample(
+                X_wave[d + 1],
+                orig_sr=vr.mp.param["band"][d + 1]["sr"],
+                target_sr=bp["sr"],
+                res_type=bp["res_type"],
+            )
+        # Stft of wave source
+        X_spec_s[d] = spec_utils.wave_to_spectrogram_mt(
+            X_wave[d],
+            bp["hl"],
+            bp["n_fft"],
+            vr.mp.param["mid_side"],
+            vr.mp.param["mid_side_b2"],
+            vr.mp.param["reverse"],
+        )
+        if d == bands_n and vr.data["high_end_process"] != "none":
+            input_high_end_h = (bp["n_fft"] // 2 - bp["crop_stop"]) + (
+                vr.mp.param["pre_filter_stop"] - vr.mp.param["pre_filter_start"]
+            )
+            input_high_end = X_spec_s[d][:, bp["n_fft"] // 2 - input_high_end_h : bp["n_fft"] // 2, :]
+
+    return spec_utils.combine_spectrograms(X_spec_s, vr.mp), input_high_end_h, input_high_end
+
+
+def _analyse_torch(vr, X_wave_high):
+    """_analyse 嘅 torch 版本：回傳嘅 X_spec_m 係 numpy (畀 inference 用)，input_high_end 留喺 device 畀 _synthesise"""
+    X_wave, X_spec_s = {}, {}
+    input_high_end_h, input_high_end = None, None
+    bands_n = len(vr.mp.param["band"])
+    with torch.no_grad():
+        for d in range(bands_n, 0, -1):
+            bp = vr.mp.param["band"][d]
+            if d == bands_n:  # high-end band
+                X_wave[d] = torch.from_numpy(np.ascontiguousarray(X_wave_high)).to(vr.device)
+            else:  # lower bands
+                X_wave[d] = spec_utils_torch.resample(
+                    X_wave[d + 1], vr.mp.param["band"][d + 1]["sr"], bp["sr"], bp["res_type"]
+                )
+            X_spec_s[d] = spec_utils_torch.wave_to_spectrogram(
+                X_wave[d],
+                bp["hl"],
+                bp["n_fft"],
+                vr.mp.param["mid_side"],
+                vr.mp.param["mid_side_b2"],
+                vr.mp.param["reverse"],
+            )
+            if d == bands_n and vr.data["high_end_process"] != "none":
+                input_high_end_h = (bp["n_fft"] // 2 - bp["crop_stop"]) + (
+                    vr.mp.param["pre_filter_stop"] - vr.mp.param["pre_filter_start"]
+                )
+                input_high_end = X_spec_s[d][:, bp["n_fft"] // 2 - input_high_end_h : bp["n_fft"] // 2, :]
+        X_spec_m = spec_utils_torch.combine_spectrograms(X_spec_s, vr.mp)
+
+    return X_spec_m.cpu().numpy(), input_high_end_h, input_high_end
+
+
+def _predict(vr, X_spec_m):
+    """模型推理，回傳 (y_spec_m, v_spec_m)"""
+    aggresive_set = float(vr.data["agg"] / 100)
+    aggressiveness = {
+        "value": aggresive_set,
+        "split_bin": vr.mp.param["band"][1]["crop_stop"],
+    }
+    with torch.no_grad():
+        pred, X_mag, X_phase = inference(X_spec_m, vr.device, vr.model, aggressiveness, vr.data)
+    # Postprocess
+    if vr.data["postprocess"]:
+        pred_inv = np.clip(X_mag - pred, 0, np.inf)
+        pred = spec_utils.mask_silence(pred, pred_inv)
+    y_spec_m = pred * X_phase
+    return y_spec_m, X_spec_m - y_spec_m
+
+
+def _synthesise(vr, spec_m, input_high_end_h, input_high_end):
+    """頻譜還原做波形，回傳 (N, 2)"""
+    if _torch_frontend(vr):
+        with torch.no_grad():
+            spec_m = torch.from_numpy(np.ascontiguousarray(spec_m)).to(vr.device)
+            if vr.data["high_end_process"].startswith("mirroring"):
+                input_high_end_ = spec_utils_torch.mirroring(vr.data["high_end_process"], spec_m, input_high_end, vr.mp)
+                wave = spec_utils_torch.cmb_spectrogram_to_wave(spec_m, vr.mp, input_high_end_h, input_high_end_)
+            else:
+                wave = spec_utils_torch.cmb_spectrogram_to_wave(spec_m, vr.mp)
+        return wave.cpu().numpy()
+    if vr.data["high_end_process"].startswith("mirroring"):
+        input_high_end_ = spec_utils.mirroring(vr.data["high_end_process"], spec_m, input_high_end, vr.mp)
+        return spec_utils.cmb_spectrogram_to_wave(spec_m, vr.mp, input_high_end_h, input_high_end_)
+    return spec_utils.cmb_spectrogram_to_wave(spec_m, vr.mp)
+
+
+def _separate(vr, mix, sr):
+    """
+    記憶體版本嘅分離 (chain 模式用)，唔經檔案。
+    :param mix: (2, N) 或 (N,) 波形
+    回傳 (y 波形, v 波形)，均為 (2, N)，取樣率 vr.mp.param["sr"]
+    """
+    X_spec_m, input_high_end_h, input_high_end = _analyse(vr, _mix_high_band(vr, mix, sr))
+    y_spec_m, v_spec_m = _predict(vr, X_spec_m)
+    wav_y = _synthesise(vr, y_spec_m, input_high_end_h, input_high_end)
+    wav_v = _synthesise(vr, v_spec_m, input_high_end_h, input_high_end)
+    return wav_y.T, wav_v.T
+
+
+
 class AudioPre:
-    def __init__(self, agg, model_path, device, is_half, tta=False):
+    def __init__(self, agg, model_path, device, is_half, tta=False, batch_size=4):
         self.model_path = model_path
         self.device = device
         self.data = {
@@ -26,6 +172,10 @@ class AudioPre:
             "tta": tta,
             # Constants
             "window_size": 512,
+            # 每次 forward 疊幾多個窗口 (TTA 窗口同批)
+            "batch_size": batch_size,
+            # 多頻帶 STFT / 重採樣 / ISTFT 喺模型個 device 上做 (spec_utils_torch)
+            "torch_frontend": True,
             "agg": agg,
             "high_end_process": "mirroring",
         }
@@ -42,7 +192,11 @@ class AudioPre:
         self.mp = mp
         self.model = model
 
-    def _path_audio_(self, music_file, ins_root=None, vocal_root=None, format="flac", is_hp3=False):
+    def separate(self, mix, sr=44100):
+        """記憶體版本：回傳 (instrument, vocal) 波形，均為 (2, N)"""
+        return _separate(self, mix, sr)
+
+    def _path_audio_(self, music_file, ins_root=None, vocal_root=None, format="flac", is_hp3=False, mix=None):
         if ins_root is None and vocal_root is None:
             return "No save root."
         name = os.path.basename(music_file)
@@ -50,73 +204,16 @@ class AudioPre:
             os.makedirs(ins_root, exist_ok=True)
         if vocal_root is not None:
             os.makedirs(vocal_root, exist_ok=True)
-        X_wave, y_wave, X_spec_s, y_spec_s = {}, {}, {}, {}
-        bands_n = len(self.mp.param["band"])
-        # print(bands_n)
-        for d in range(bands_n, 0, -1):
-            bp = self.mp.param["band"][d]
-            if d == bands_n:  # high-end band
-                (
-                    X_wave[d],
-                    _,
-                ) = librosa.core.load(  # 理论上librosa读取可能对某些音频有bug，应该上ffmpeg读取，但是太麻烦了弃坑
-                    music_file,
-                    sr=bp["sr"],
-                    mono=False,
-                    dtype=np.float32,
-                    res_type=bp["res_type"],
-                )
-                if X_wave[d].ndim == 1:
-                    X_wave[d] = np.asfortranarray([X_wave[d], X_wave[d]])
-            else:  # lower bands
-                X_wave[d] = librosa.core.resample(
-                    X_wave[d + 1],
-                    orig_sr=self.mp.param["band"][d + 1]["sr"],
-                    target_sr=bp["sr"],
-                    res_type=bp["res_type"],
-                )
-            # Stft of wave source
-            X_spec_s[d] = spec_utils.wave_to_spectrogram_mt(
-                X_wave[d],
-                bp["hl"],
-                bp["n_fft"],
-                self.mp.param["mid_side"],
-                self.mp.param["mid_side_b2"],
-                self.mp.param["reverse"],
-            )
-            # pdb.set_trace()
-            if d == bands_n and self.data["high_end_process"] != "none":
-                input_high_end_h = (bp["n_fft"] // 2 - bp["crop_stop"]) + (
-                    self.mp.param["pre_filter_stop"] - self.mp.param["pre_filter_start"]
-                )
-                input_high_end = X_spec_s[d][:, bp["n_fft"] // 2 - input_high_end_h : bp["n_fft"] // 2, :]
-
-        X_spec_m = spec_utils.combine_spectrograms(X_spec_s, self.mp)
-        aggresive_set = float(self.data["agg"] / 100)
-        aggressiveness = {
-            "value": aggresive_set,
-            "split_bin": self.mp.param["band"][1]["crop_stop"],
-        }
-        with torch.no_grad():
-            pred, X_mag, X_phase = inference(X_spec_m, self.device, self.model, aggressiveness, self.data)
-        # Postprocess
-        if self.data["postprocess"]:
-            pred_inv = np.clip(X_mag - pred, 0, np.inf)
-            pred = spec_utils.mask_silence(pred, pred_inv)
-        y_spec_m = pred * X_phase
-        v_spec_m = X_spec_m - y_spec_m
+        # mix: 已經解碼好嘅 44100Hz 波形 (audio_ingest)，None 就由 music_file 讀
+        X_wave_high = _load_high_band(self, music_file) if mix is None else _mix_high_band(self, mix, 44100)
+        X_spec_m, input_high_end_h, input_high_end = _analyse(self, X_wave_high)
+        y_spec_m, v_spec_m = _predict(self, X_spec_m)
 
         if is_hp3 == True:
             ins_root, vocal_root = vocal_root, ins_root
 
         if ins_root is not None:
-            if self.data["high_end_process"].startswith("mirroring"):
-                input_high_end_ = spec_utils.mirroring(self.data["high_end_process"], y_spec_m, input_high_end, self.mp)
-                wav_instrument = spec_utils.cmb_spectrogram_to_wave(
-                    y_spec_m, self.mp, input_high_end_h, input_high_end_
-                )
-            else:
-                wav_instrument = spec_utils.cmb_spectrogram_to_wave(y_spec_m, self.mp)
+            wav_instrument = _synthesise(self, y_spec_m, input_high_end_h, input_high_end)
             logger.info("%s instruments done" % name)
             if is_hp3 == True:
                 head = "vocal_"
@@ -153,11 +250,7 @@ class AudioPre:
                 head = "instrument_"
             else:
                 head = "vocal_"
-            if self.data["high_end_process"].startswith("mirroring"):
-                input_high_end_ = spec_utils.mirroring(self.data["high_end_process"], v_spec_m, input_high_end, self.mp)
-                wav_vocals = spec_utils.cmb_spectrogram_to_wave(v_spec_m, self.mp, input_high_end_h, input_high_end_)
-            else:
-                wav_vocals = spec_utils.cmb_spectrogram_to_wave(v_spec_m, self.mp)
+            wav_vocals = _synthesise(self, v_spec_m, input_high_end_h, input_high_end)
             logger.info("%s vocals done" % name)
             if format in ["wav", "flac"]:
                 sf.write(
@@ -188,7 +281,7 @@ class AudioPre:
 
 
 class AudioPreDeEcho:
-    def __init__(self, agg, model_path, device, is_half, tta=False):
+    def __init__(self, agg, model_path, device, is_half, tta=False, batch_size=4):
         self.model_path = str(model_path)
         self.device = device
         self.data = {
@@ -197,6 +290,10 @@ class AudioPreDeEcho:
             "tta": tta,
             # Constants
             "window_size": 512,
+            # 每次 forward 疊幾多個窗口 (TTA 窗口同批)
+            "batch_size": batch_size,
+            # 多頻帶 STFT / 重採樣 / ISTFT 喺模型個 device 上做 (spec_utils_torch)
+            "torch_frontend": True,
             "agg": agg,
             "high_end_process": "mirroring",
         }
@@ -214,8 +311,15 @@ class AudioPreDeEcho:
         self.mp = mp
         self.model = model
 
+    def separate(self, mix, sr=44100):
+        """
+        記憶體版本：回傳 (y, v) 波形，均為 (2, N)。
+        注意同 _path_audio_ 一樣 vocal / ins 係反嘅：y 即係寫入 ins_root 嘅 "vocal_*" 檔 (去延遲後人聲)
+        """
+        return _separate(self, mix, sr)
+
     def _path_audio_(
-        self, music_file, vocal_root=None, ins_root=None, format="flac", is_hp3=False
+        self, music_file, vocal_root=None, ins_root=None, format="flac", is_hp3=False, mix=None
     ):  # 3个VR模型vocal和ins是反的
         if ins_root is None and vocal_root is None:
             return "No save root."
@@ -224,70 +328,13 @@ class AudioPreDeEcho:
             os.makedirs(ins_root, exist_ok=True)
         if vocal_root is not None:
             os.makedirs(vocal_root, exist_ok=True)
-        X_wave, y_wave, X_spec_s, y_spec_s = {}, {}, {}, {}
-        bands_n = len(self.mp.param["band"])
-        # print(bands_n)
-        for d in range(bands_n, 0, -1):
-            bp = self.mp.param["band"][d]
-            if d == bands_n:  # high-end band
-                (
-                    X_wave[d],
-                    _,
-                ) = librosa.core.load(  # 理论上librosa读取可能对某些音频有bug，应该上ffmpeg读取，但是太麻烦了弃坑
-                    music_file,
-                    sr=bp["sr"],
-                    mono=False,
-                    dtype=np.float32,
-                    res_type=bp["res_type"],
-                )
-                if X_wave[d].ndim == 1:
-                    X_wave[d] = np.asfortranarray([X_wave[d], X_wave[d]])
-            else:  # lower bands
-                X_wave[d] = librosa.core.resample(
-                    X_wave[d + 1],
-                    orig_sr=self.mp.param["band"][d + 1]["sr"],
-                    target_sr=bp["sr"],
-                    res_type=bp["res_type"],
-                )
-            # Stft of wave source
-            X_spec_s[d] = spec_utils.wave_to_spectrogram_mt(
-                X_wave[d],
-                bp["hl"],
-                bp["n_fft"],
-                self.mp.param["mid_side"],
-                self.mp.param["mid_side_b2"],
-                self.mp.param["reverse"],
-            )
-            # pdb.set_trace()
-            if d == bands_n and self.data["high_end_process"] != "none":
-                input_high_end_h = (bp["n_fft"] // 2 - bp["crop_stop"]) + (
-                    self.mp.param["pre_filter_stop"] - self.mp.param["pre_filter_start"]
-                )
-                input_high_end = X_spec_s[d][:, bp["n_fft"] // 2 - input_high_end_h : bp["n_fft"] // 2, :]
-
-        X_spec_m = spec_utils.combine_spectrograms(X_spec_s, self.mp)
-        aggresive_set = float(self.data["agg"] / 100)
-        aggressiveness = {
-            "value": aggresive_set,
-            "split_bin": self.mp.param["band"][1]["crop_stop"],
-        }
-        with torch.no_grad():
-            pred, X_mag, X_phase = inference(X_spec_m, self.device, self.model, aggressiveness, self.data)
-        # Postprocess
-        if self.data["postprocess"]:
-            pred_inv = np.clip(X_mag - pred, 0, np.inf)
-            pred = spec_utils.mask_silence(pred, pred_inv)
-        y_spec_m = pred * X_phase
-        v_spec_m = X_spec_m - y_spec_m
+        # mix: 已經解碼好嘅 44100Hz 波形 (audio_ingest)，None 就由 music_file 讀
+        X_wave_high = _load_high_band(self, music_file) if mix is None else _mix_high_band(self, mix, 44100)
+        X_spec_m, input_high_end_h, input_high_end = _analyse(self, X_wave_high)
+        y_spec_m, v_spec_m = _predict(self, X_spec_m)
 
         if ins_root is not None:
-            if self.data["high_end_process"].startswith("mirroring"):
-                input_high_end_ = spec_utils.mirroring(self.data["high_end_process"], y_spec_m, input_high_end, self.mp)
-                wav_instrument = spec_utils.cmb_spectrogram_to_wave(
-                    y_spec_m, self.mp, input_high_end_h, input_high_end_
-                )
-            else:
-                wav_instrument = spec_utils.cmb_spectrogram_to_wave(y_spec_m, self.mp)
+            wav_instrument = _synthesise(self, y_spec_m, input_high_end_h, input_high_end)
             logger.info("%s instruments done" % name)
             if format in ["wav", "flac"]:
                 sf.write(
@@ -316,11 +363,7 @@ class AudioPreDeEcho:
                         except:
                             pass
         if vocal_root is not None:
-            if self.data["high_end_process"].startswith("mirroring"):
-                input_high_end_ = spec_utils.mirroring(self.data["high_end_process"], v_spec_m, input_high_end, self.mp)
-                wav_vocals = spec_utils.cmb_spectrogram_to_wave(v_spec_m, self.mp, input_high_end_h, input_high_end_)
-            else:
-                wav_vocals = spec_utils.cmb_spectrogram_to_wave(v_spec_m, self.mp)
+            wav_vocals = _synthesise(self, v_spec_m, input_high_end_h, input_high_end)
             logger.info("%s vocals done" % name)
             if format in ["wav", "flac"]:
                 sf.write(
@@ -1,13 +1,17 @@
-import os
+import json
+import time
 import torch
-import librosa
-import ffmpeg
 import numpy as np
 import soundfile as sf
+import resource
 import traceback
 from pathlib import Path
+from typing import Callable, Optional
 from config import Config
+from uvr5 import audio_ingest, cpu_infer
+from uvr5.ensemble import SpectralEnsemble, is_vr
 from uvr5.bsroformer import Roformer_Loader
+from uvr5.demix_checkpoint import DemixCheckpoint
 from uvr5.mdxnet import MDXNetDereverb
 from uvr5.vr import AudioPre, AudioPreDeEcho
 
@@ -20,17 +24,38 @@ class UVR5Processor:
     # 用嚟儲存 Loader 實例，避免批次處理時重複 Load 模型到 GPU
     _model_cache = {}
 
+    # 量度輸出：None 就印 "METRIC {json}" 行畀 host (Tools.run_docker) 解析；常駐 worker 會換成 socket event
+    metric_sink: Optional[Callable[[dict], None]] = None
+
+    # 分離途中斷點嘅 commit 間隔 (秒)；斷點放喺 vocal_output_dir/.checkpoint，處理完先刪
+    CHECKPOINT_INTERVAL = 30.0
+
+    # VR 模型 (DeEcho 等) 每次 forward 疊幾多個窗口
+    VR_BATCH_SIZE = 4
+
+    # chain 模式各階段預設模型 (同單獨任務一致)
+    CHAIN_MODELS = {
+        "extract": "model_bs_roformer_ep_317_sdr_12.9755",
+        "dereverb": "onnx_dereverb",
+        "deecho": "VR-DeEchoAggressive",
+    }
+
+    # ensemble 模式預設模型同合併方法 (min_mag / max_mag / avg，見 uvr5/ensemble.py)
+    ENSEMBLE_MODELS = ["HP2_all_vocals", "HP3_all_vocals", "model_bs_roformer_ep_317_sdr_12.9755"]
+    ENSEMBLE_ALGORITHM = "avg"
+
     @staticmethod
     def extract_vocal(
         file_path: Path,
         vocal_output_dir: Path,
         inst_output_dir: Path,
         model_name="model_bs_roformer_ep_317_sdr_12.9755",
+        probe_info: Optional[dict] = None,
     ) -> bool:
         """使用 BS-Roformer 提取人聲"""
         print(f"[提取人聲] 處理中: {file_path.name}")
         rslt = UVR5Processor._process(
-            model_name, file_path, vocal_output_dir, inst_output_dir
+            model_name, file_path, vocal_output_dir, inst_output_dir, probe_info
         )
         return rslt
 
@@ -40,11 +65,12 @@ class UVR5Processor:
         vocal_output_dir: Path,
         inst_output_dir: Path,
         model_name="onnx_dereverb",
+        probe_info: Optional[dict] = None,
     ) -> bool:
         """使用 ONNX 模型去混響"""
         print(f"[去混響] 處理中: {file_path.name}")
         return UVR5Processor._process(
-            model_name, file_path, vocal_output_dir, inst_output_dir
+            model_name, file_path, vocal_output_dir, inst_output_dir, probe_info
         )
 
     @staticmethod
@@ -53,83 +79,321 @@ class UVR5Processor:
         vocal_output_dir: Path,
         inst_output_dir: Path,
         model_name="VR-DeEchoAggressive",
+        probe_info: Optional[dict] = None,
     ) -> bool:
         """使用 PTH 模型去延遲"""
         print(f"[去延遲] 處理中: {file_path.name}")
         return UVR5Processor._process(
-            model_name, file_path, vocal_output_dir, inst_output_dir
+            model_name, file_path, vocal_output_dir, inst_output_dir, probe_info
         )
 
-    # --- Private Methods ---
+    @staticmethod
+    def chain(
+        file_path: Path,
+        vocal_output_dir: Path,
+        inst_output_dir: Path,
+        model_names: Optional[dict] = None,
+        probe_info: Optional[dict] = None,
+        keep_intermediates: bool = False,
+    ) -> bool:
+        """
+        一次過做 提取人聲 → 去混響 → 去延遲，中間結果只喺記憶體傳遞。
+        最後只寫 vocal_output_dir/vocal_main_vocal.wav (keep_intermediates 先會另外寫 vocal.wav / main_vocal.wav)，
+        各階段耗時寫入 vocal_output_dir/chain_timing.json。
+        """
+        print(f"[串連處理] 處理中: {file_path.name}")
+        if not file_path.exists():
+            return False
+        UVR5Processor._ensure_dir(vocal_output_dir)
+        UVR5Processor._ensure_dir(inst_output_dir)
+        models = {**UVR5Processor.CHAIN_MODELS, **(model_names or {})}
+        timings = {}
+        UVR5Processor._reset_peaks()
+
+        def timed(stage, func, *args):
+            start = time.time()
+            result = func(*args)
+            timings[stage] = round(time.time() - start, 3)
+            print(f"[串連處理] {stage} 完成 ({timings[stage]}s)")
+            # load 階段由 _get_model 逐個模型報 model_load，呢度唔重複
+            if stage != "load":
+                UVR5Processor._report(stage, timings[stage], model=models.get(stage, ""))
+            return result
+
+        try:
+            # 1. 經 ffmpeg pipe 解碼一次做 2ch/44100，之後唔再讀寫中間檔
+            duration = probe_info.get("duration") if probe_info else None
+            mix = timed(
+                "decode",
+                lambda: audio_ingest.decode(file_path, duration=duration, scratch_dir=vocal_output_dir / ".checkpoint"),
+            )
+
+            # 2. 三個模型一齊 load (常駐 worker 第二次之後就係緩存命中)
+            extractor, dereverber, deechoer = timed(
+                "load", lambda: [UVR5Processor._get_model(models[s]) for s in ("extract", "dereverb", "deecho")]
+            )
+
+            # 3. 逐級分離，stem 以 (2, N) 陣列傳落下一級
+            #    (支援斷點嘅模型做完嗰級嘅斷點會保留到成條鏈完成，崩潰後重做會直接由斷點攞返)
+            scratch_dir = vocal_output_dir / ".checkpoint"
+            vocal, _ = timed(
+                "extract", UVR5Processor._separate, extractor, mix, scratch_dir, f"extract.{models['extract']}"
+            )
+            main_vocal, _ = timed(
+                "dereverb", UVR5Processor._separate, dereverber, vocal, scratch_dir, f"dereverb.{models['dereverb']}"
+            )
+            final_vocal, _ = timed(
+                "deecho", UVR5Processor._separate, deechoer, main_vocal, scratch_dir, f"deecho.{models['deecho']}"
+            )
+
+            # 4. 只寫最終結果
+            def write_outputs():
+                if keep_intermediates:
+                    sf.write(vocal_output_dir / "vocal.wav", vocal.T, 44100)
+                    sf.write(vocal_output_dir / "main_vocal.wav", main_vocal.T, 44100)
+                sf.write(
+                    vocal_output_dir / "vocal_main_vocal.wav",
+                    (np.array(final_vocal.T) * 32768).astype("int16"),
+                    44100,
+                )
+
+            timed("write", write_outputs)
+            DemixCheckpoint.discard(scratch_dir)
+        except:
+            traceback.print_exc()
+            print(f"處理失敗: {file_path.name}")
+            return False
+
+        UVR5Processor._report_resources()
+        timings["total"] = round(sum(timings.values()), 3)
+        (vocal_output_dir / "chain_timing.json").write_text(json.dumps(timings), encoding="utf-8")
+        print("[串連處理] 各階段耗時: " + " | ".join(f"{k} {v}s" for k, v in timings.items()))
+        return True
 
     @staticmethod
-    def _process(
-        model_name: str,
+    def ensemble(
         file_path: Path,
         vocal_output_dir: Path,
         inst_output_dir: Path,
+        model_names: Optional[list] = None,
+        algorithm: Optional[str] = None,
+        probe_info: Optional[dict] = None,
     ) -> bool:
-        # 既然傳入嚟係 Folder，直接 ensure 呢個 Path 就得
+        """
+        多模型 ensemble：解碼一次、混音嘅多頻帶 STFT 做一次，所有模型同時 load 住逐個推理，
+        人聲 stem 喺頻譜域合併 (min_mag / max_mag / avg) 再 ISTFT 一次。
+        寫 vocal_output_dir/vocal_{檔名}_ensemble.wav 同 inst_output_dir/instrument_{檔名}_ensemble.wav，
+        各階段耗時寫入 vocal_output_dir/ensemble_timing.json。
+        """
+        print(f"[Ensemble] 處理中: {file_path.name}")
+        if not file_path.exists():
+            return False
         UVR5Processor._ensure_dir(vocal_output_dir)
         UVR5Processor._ensure_dir(inst_output_dir)
+        model_names = list(model_names or UVR5Processor.ENSEMBLE_MODELS)
+        algorithm = algorithm or UVR5Processor.ENSEMBLE_ALGORITHM
+        scratch_dir = vocal_output_dir / ".checkpoint"
+        timings = {}
+        UVR5Processor._reset_peaks()
+
+        def timed(stage, func, *args, **report):
+            start = time.time()
+            result = func(*args)
+            timings[stage] = round(time.time() - start, 3)
+            print(f"[Ensemble] {stage} 完成 ({timings[stage]}s)")
+            if stage != "load":
+                UVR5Processor._report(report.pop("as_stage", stage), timings[stage], **report)
+            return result
+
+        try:
+            duration = probe_info.get("duration") if probe_info else None
+            mix = timed(
+                "decode", lambda: audio_ingest.decode(file_path, duration=duration, scratch_dir=scratch_dir)
+            )
+            models = timed("load", lambda: [UVR5Processor._get_model(name) for name in model_names])
+
+            # 混音嘅頻譜分析喺度做一次，同 mp 嘅 VR 模型共用
+            device, _ = Config.get_best_device()
+            ens = timed("analyse", SpectralEnsemble, mix, models, device)
+            for name, func in zip(model_names, models):
+                if is_vr(func):
+                    timed(name, ens.add_vr, func, "HP3" in name, as_stage="compute", model=name)
+                else:
+                    timed(
+                        name,
+                        lambda: ens.add_wave(UVR5Processor._separate(func, mix, scratch_dir, f"ensemble.{name}")[0]),
+                        as_stage="compute",
+                        model=name,
+                    )
+            vocal, inst = timed("ensemble", ens.combine, algorithm, algorithm=algorithm)
 
+            def write_outputs():
+                sr = ens.ref.mp.param["sr"]
+                sf.write(
+                    vocal_output_dir / f"vocal_{file_path.name}_ensemble.wav",
+                    (np.array(vocal.T) * 32768).astype("int16"),
+                    sr,
+                )
+                sf.write(
+                    inst_output_dir / f"instrument_{file_path.name}_ensemble.wav",
+                    (np.array(inst.T) * 32768).astype("int16"),
+                    sr,
+                )
+
+            timed("write", write_outputs)
+            DemixCheckpoint.discard(scratch_dir)
+        except:
+            traceback.print_exc()
+            print(f"處理失敗: {file_path.name}")
+            return False
+
+        UVR5Processor._report_resources()
+        timings["total"] = round(sum(timings.values()), 3)
+        (vocal_output_dir / "ensemble_timing.json").write_text(json.dumps(timings), encoding="utf-8")
+        print("[Ensemble] 各階段耗時: " + " | ".join(f"{k} {v}s" for k, v in timings.items()))
+        return True
+
+    # --- Private Methods ---
+
+    @staticmethod
+    def _get_model(model_name: str):
+        """按模型名建立 (或者由緩存攞) 對應嘅 Loader"""
         device, is_half = Config.get_best_device()
-        is_hp3 = "HP3" in model_name
-        
+
         # 模型緩存邏輯
         cache_key = f"{model_name}_{device}_{is_half}"
         if cache_key in UVR5Processor._model_cache:
-            func = UVR5Processor._model_cache[cache_key]
+            return UVR5Processor._model_cache[cache_key]
+
+        start = time.time()
+        if "onnx_dereverb" in model_name.lower():
+            kind = "mdx"
+            func = MDXNetDereverb(15, str(Config.dirs["UVR5_MODEL"] / (model_name + ".onnx")))
+        elif "roformer" in model_name.lower():
+            kind = "roformer"
+            func = Roformer_Loader(
+                str(Config.dirs["UVR5_MODEL"] / (model_name + ".ckpt")),
+                str(Config.dirs["UVR5_MODEL"] / (model_name + ".yaml")),
+                device,
+                is_half,
+            )
+        elif "DeEcho" not in model_name:
+            kind = "vr"
+            func = AudioPre(
+                10,
+                Config.dirs["UVR5_MODEL"] / (model_name + ".pth"),
+                device,
+                is_half,
+                batch_size=UVR5Processor.VR_BATCH_SIZE,
+            )
         else:
-            if "onnx_dereverb" in model_name.lower():
-                func = MDXNetDereverb(15, str(Config.dirs["UVR5_MODEL"] / (model_name + ".onnx")))
-            elif "roformer" in model_name.lower():
-                func = Roformer_Loader(
-                    str(Config.dirs["UVR5_MODEL"] / (model_name + ".ckpt")),
-                    str(Config.dirs["UVR5_MODEL"] / (model_name + ".yaml")),
-                    device,
-                    is_half,
-                )
-            elif "DeEcho" not in model_name:
-                func = AudioPre(
-                    10, Config.dirs["UVR5_MODEL"] / (model_name + ".pth"), device, is_half
-                )
-            else:
-                func = AudioPreDeEcho(
-                    10, Config.dirs["UVR5_MODEL"] / (model_name + ".pth"), device, is_half
-                )
-            UVR5Processor._model_cache[cache_key] = func
-        
+            kind = "vr"
+            func = AudioPreDeEcho(
+                10,
+                Config.dirs["UVR5_MODEL"] / (model_name + ".pth"),
+                device,
+                is_half,
+                batch_size=UVR5Processor.VR_BATCH_SIZE,
+            )
+        extra = {}
+        if device == "cpu":
+            # 冇 CUDA：按 Config.cpu_modes 轉做 INT8 / ONNX Runtime 版本 (導出結果有 cache)
+            extra["cpu_mode"] = Config.cpu_modes.get(kind, "fp32")
+            func = cpu_infer.optimize(
+                func, kind, extra["cpu_mode"], Config.dirs["UVR5_CPU_CACHE"], Config.cpu_threads
+            )
+        UVR5Processor._model_cache[cache_key] = func
+        UVR5Processor._report("model_load", time.time() - start, model=model_name, **extra)
+        return func
+
+    @staticmethod
+    def _process(
+        model_name: str,
+        file_path: Path,
+        vocal_output_dir: Path,
+        inst_output_dir: Path,
+        probe_info: Optional[dict] = None,
+    ) -> bool:
+        # 既然傳入嚟係 Folder，直接 ensure 呢個 Path 就得
+        UVR5Processor._ensure_dir(vocal_output_dir)
+        UVR5Processor._ensure_dir(inst_output_dir)
+
+        is_hp3 = "HP3" in model_name
+        UVR5Processor._reset_peaks()
+        func = UVR5Processor._get_model(model_name)
+        # 支援斷點嘅模型崩潰後重新執行會由上次 commit 繼續
+        scratch_dir = vocal_output_dir / ".checkpoint"
+        checkpoint = UVR5Processor._make_checkpoint(func, scratch_dir, model_name)
+        extra = {"checkpoint": checkpoint} if checkpoint is not None else {}
+
         if func is not None and file_path.exists():
-            done = 0
             try:
-                # 預檢音頻格式
-                info = ffmpeg.probe(str(file_path), cmd="ffprobe")
-                if info["streams"][0]["channels"] == 2 and info["streams"][0].get("sample_rate") == "44100":
-                    # 傳入 str 格式嘅 Folder Path
-                    func._path_audio_(str(file_path), str(inst_output_dir), str(vocal_output_dir), "wav", is_hp3)
-                    done = 1
+                # 經 ffmpeg pipe 一次過解碼做 2ch/44100 float32 再直接交畀分離器 (任何格式都唔使轉碼寫 /tmp)；
+                # 好長嘅音頻會解碼去 scratch_dir 嘅 memmap
+                duration = probe_info.get("duration") if probe_info else None
+                start = time.time()
+                mix = audio_ingest.decode(file_path, duration=duration, scratch_dir=scratch_dir)
+                UVR5Processor._report("decode", time.time() - start)
+
+                # 傳入 str 格式嘅 Folder Path (輸出檔名仍然跟 file_path)
+                start = time.time()
+                func._path_audio_(
+                    str(file_path), str(inst_output_dir), str(vocal_output_dir), "wav", is_hp3, mix=mix, **extra
+                )
+                UVR5Processor._report("compute", time.time() - start, model=model_name)
             except:
-                pass
-                
-            if done == 0:
-                # 轉碼處理，確保臨時文件夾存在
-                tmp_dir = Path(os.environ.get("TEMP", "/tmp"))
-                tmp_path = tmp_dir / f"{file_path.stem}.reformatted.wav"
-                
-                print(f"轉碼處理中: {file_path.name}")
-                os.system(f'ffmpeg -i "{file_path}" -vn -acodec pcm_s16le -ac 2 -ar 44100 "{tmp_path}" -y -loglevel quiet')
-                
-                try:
-                    func._path_audio_(str(tmp_path), str(inst_output_dir), str(vocal_output_dir), "wav", is_hp3)
-                    if tmp_path.exists(): tmp_path.unlink()
-                except:
-                    traceback.print_exc()
-                    print(f"處理失敗: {file_path.name}")
-                    return False
+                traceback.print_exc()
+                print(f"處理失敗: {file_path.name}")
+                return False
+            DemixCheckpoint.discard(scratch_dir)
+            UVR5Processor._report_resources()
             return True
         return False
 
+    @staticmethod
+    def _make_checkpoint(func, scratch_dir: Path, tag: str) -> Optional[DemixCheckpoint]:
+        """Roformer / MDX 嘅 demix 係逐 chunk 累加，先支援斷點；VR 模型回傳 None"""
+        if isinstance(func, (Roformer_Loader, MDXNetDereverb)):
+            return DemixCheckpoint(scratch_dir, tag, UVR5Processor.CHECKPOINT_INTERVAL)
+        return None
+
+    @staticmethod
+    def _separate(func, mix, scratch_dir: Path, tag: str):
+        """chain 用：有斷點支援就帶住斷點做 separate"""
+        checkpoint = UVR5Processor._make_checkpoint(func, scratch_dir, tag)
+        if checkpoint is None:
+            return func.separate(mix)
+        return func.separate(mix, checkpoint)
+
+    @staticmethod
+    def _report(stage: str, seconds: Optional[float] = None, **extra):
+        """報一個階段嘅量度畀 host"""
+        metric = {"stage": stage, **extra}
+        if seconds is not None:
+            metric["seconds"] = round(seconds, 3)
+        if UVR5Processor.metric_sink is not None:
+            UVR5Processor.metric_sink(metric)
+        else:
+            print(f"METRIC {json.dumps(metric, ensure_ascii=False)}", flush=True)
+
+    @staticmethod
+    def _reset_peaks():
+        # 常駐 worker 會連續處理好多個 job，VRAM 峰值要逐個 job 重新計
+        if torch.cuda.is_available():
+            torch.cuda.reset_peak_memory_stats()
+
+    @staticmethod
+    def _report_resources():
+        """報 RSS / VRAM 峰值 (RSS 係程序開始以嚟嘅峰值，Linux 下 ru_maxrss 單位係 KB)"""
+        peak_vram_mb = None
+        if torch.cuda.is_available():
+            peak_vram_mb = round(torch.cuda.max_memory_allocated() / 1024**2, 1)
+        UVR5Processor._report(
+            "resources",
+            peak_rss_mb=round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            peak_vram_mb=peak_vram_mb,
+        )
+
     @staticmethod
     def _ensure_dir(dir_path: Path):
         """確保目錄存在"""
@@ -0,0 +1,198 @@
+import json
+import os
+import shutil
+import socket
+import time
+import traceback
+from pathlib import Path
+from typing import Callable
+
+# 每種任務嘅預設模型 (同 main.py 一次性模式一致)
+DEFAULT_MODELS = {
+    "extract": "model_bs_roformer_ep_317_sdr_12.9755",
+    "dereverb": "onnx_dereverb",
+    "deecho": "VR-DeEchoAggressive",
+    # chain = extract → dereverb → deecho，用 UVR5Processor.CHAIN_MODELS
+    # ensemble = 多模型合併，用 UVR5Processor.ENSEMBLE_MODELS
+}
+
+
+def _process_file(task_type: str, model_name: str, item: dict, on_metric: Callable[[dict], None]) -> bool:
+    """用 UVR5Processor 處理單一檔案 (模型留喺 _model_cache，下個 job 直接重用)"""
+    from uvr5_processor import UVR5Processor
+
+    # 量度唔印落 stdout，改為經 socket 以 "metric" event 送返 host
+    UVR5Processor.metric_sink = on_metric
+
+    if task_type == "chain":
+        # 串連模式三個模型都用預設 (CHAIN_MODELS)，model_name 唔適用
+        return UVR5Processor.chain(
+            Path(item["file_path"]),
+            Path(item["vocal_dir"]),
+            Path(item["inst_dir"]),
+            probe_info=item.get("probe_info"),
+            keep_intermediates=item.get("keep_intermediates", False),
+        )
+
+    if task_type == "ensemble":
+        # 模型列表 / 合併方法由 file 指定，冇就用 ENSEMBLE_MODELS / ENSEMBLE_ALGORITHM
+        return UVR5Processor.ensemble(
+            Path(item["file_path"]),
+            Path(item["vocal_dir"]),
+            Path(item["inst_dir"]),
+            model_names=item.get("model_names"),
+            algorithm=item.get("algorithm"),
+            probe_info=item.get("probe_info"),
+        )
+
+    func = {
+        "extract": UVR5Processor.extract_vocal,
+        "dereverb": UVR5Processor.dereverb,
+        "deecho": UVR5Processor.deecho,
+    }[task_type]
+    return func(
+        Path(item["file_path"]),
+        Path(item["vocal_dir"]),
+        Path(item["inst_dir"]),
+        model_name,
+        item.get("probe_info"),
+    )
+
+
+def _stub_file(task_type: str, model_name: str, item: dict, on_metric: Callable[[dict], None]) -> bool:
+    """
+    替身處理器：唔 load 模型，直接複製輸入做輸出 (檔名同真模型一樣)，
+    畀 host 端喺冇 Docker / GPU 嘅環境測試 worker 協定用
+    """
+    start = time.time()
+    file_path = Path(item["file_path"])
+    vocal_dir = Path(item["vocal_dir"])
+    vocal_dir.mkdir(parents=True, exist_ok=True)
+    Path(item["inst_dir"]).mkdir(parents=True, exist_ok=True)
+    if task_type == "chain":
+        shutil.copyfile(file_path, vocal_dir / "vocal_main_vocal.wav")
+        if item.get("keep_intermediates"):
+            shutil.copyfile(file_path, vocal_dir / "vocal.wav")
+            shutil.copyfile(file_path, vocal_dir / "main_vocal.wav")
+        (vocal_dir / "chain_timing.json").write_text(json.dumps({"total": 0.0}), encoding="utf-8")
+    elif task_type == "ensemble":
+        shutil.copyfile(file_path, vocal_dir / f"vocal_{file_path.name}_ensemble.wav")
+        shutil.copyfile(file_path, Path(item["inst_dir"]) / f"instrument_{file_path.name}_ensemble.wav")
+        (vocal_dir / "ensemble_timing.json").write_text(json.dumps({"total": 0.0}), encoding="utf-8")
+    else:
+        out_name = {
+            "extract": f"{file_path.stem}_vocals.wav",
+            "dereverb": f"{file_path.name}_main_vocal.wav",
+            "deecho": f"instrument_{file_path.name}_10.wav",
+        }[task_type]
+        shutil.copyfile(file_path, vocal_dir / out_name)
+    on_metric({"stage": "compute", "seconds": round(time.time() - start, 3), "model": "stub"})
+    return True
+
+
+class UVR5Worker:
+    """
+    常駐 UVR5 worker：喺 Unix socket 度收 job，模型留喺記憶體。
+    協定 (JSON lines)：
+      請求: {"task_type": "extract", "model_name": null, "files": [{"file_path", "vocal_dir", "inst_dir", "probe_info"}]}
+            (task_type 亦可以係 "chain"，file 可加 "keep_intermediates"；
+             或者 "ensemble"，file 可加 "model_names" / "algorithm")
+      回應: 逐行 event，{"event": "start" | "progress" | "file_done" | "finished", ...}
+    job 逐個順序處理 (同一時間只有一個 job 用 GPU)。
+    """
+
+    def __init__(self, socket_path: Path, idle_timeout: float = 600.0, stub: bool = False):
+        self.socket_path = socket_path
+        self.idle_timeout = idle_timeout
+        self.handler: Callable[[str, str, dict, Callable[[dict], None]], bool] = (
+            _stub_file if stub else _process_file
+        )
+
+    def _handle(self, conn: socket.socket):
+        reader = conn.makefile("r", encoding="utf-8")
+        writer = conn.makefile("w", encoding="utf-8")
+
+        def emit(event: str, **data):
+            writer.write(json.dumps({"event": event, **data}, ensure_ascii=False) + "\n")
+            writer.flush()
+
+        try:
+            line = reader.readline()
+            if not line:
+                return
+            job = json.loads(line)
+            task_type = job["task_type"]
+            model_name = job.get("model_name") or DEFAULT_MODELS.get(task_type)
+            files = job["files"]
+
+            emit("start", task_type=task_type, model_name=model_name, total=len(files))
+            all_ok = True
+            for i, item in enumerate(files):
+                emit("progress", index=i, total=len(files), file_path=item["file_path"])
+                start = time.time()
+                try:
+                    ok = self.handler(task_type, model_name, item, lambda metric: emit("metric", **metric))
+                    error = None
+                except Exception as e:
+                    traceback.print_exc()
+                    ok, error = False, str(e)
+                all_ok = all_ok and ok
+                emit(
+                    "file_done",
+                    index=i,
+                    file_path=item["file_path"],
+                    success=ok,
+                    elapsed=round(time.time() - start, 3),
+                    error=error,
+                )
+            emit("finished", success=all_ok)
+        except Exception as e:
+            traceback.print_exc()
+            try:
+                emit("finished", success=False, error=str(e))
+            except OSError:
+                pass
+        finally:
+            reader.close()
+            writer.close()
+
+    def serve_forever(self):
+        self.socket_path.parent.mkdir(parents=True, exist_ok=True)
+        if self.socket_path.exists():
+            self.socket_path.unlink()
+
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(str(self.socket_path))
+        os.chmod(self.socket_path, 0o666)
+        server.listen(16)
+        server.settimeout(self.idle_timeout if self.idle_timeout > 0 else None)
+        print(f"UVR5 worker 就緒: {self.socket_path}", flush=True)
+
+        try:
+            while True:
+                try:
+                    conn, _ = server.accept()
+                except socket.timeout:
+                    print(f"閒置超過 {self.idle_timeout}s，worker 結束並釋放 VRAM。", flush=True)
+                    break
+                with conn:
+                    self._handle(conn)
+        finally:
+            server.close()
+            if self.socket_path.exists():
+                self.socket_path.unlink()
+
+
+def serve(socket_path: Path, idle_timeout: float, stub: bool = False):
+    UVR5Worker(socket_path, idle_timeout, stub).serve_forever()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="UVR5 常駐 worker")
+    parser.add_argument("--socket", type=Path, required=True)
+    parser.add_argument("--idle_timeout", type=float, default=600.0)
+    parser.add_argument("--stub", action="store_true", help="替身模式：唔 load 模型，只複製檔案 (測試用)")
+    args = parser.parse_args()
+    serve(args.socket, args.idle_timeout, args.stub)
@@ -0,0 +1,180 @@
+import json
+import logging
+import socket
+import subprocess
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+from config import Config
+from metrics import Metrics
+from tools.tools import Tools
+
+
+class UVR5WorkerClient:
+    """
+    Host 端嘅 UVR5 常駐 worker 客戶端。
+    每個設備一個 worker (Docker container 或者本地替身程序)，模型留喺 worker 記憶體；
+    worker 唔喺度就自動啟動，啟動唔到就由 caller 退返去一次性 docker run。
+    """
+
+    _clients: dict[str, "UVR5WorkerClient"] = {}
+    _clients_lock = threading.Lock()
+
+    def __init__(self, device: str):
+        self.device = device
+        tag = device.replace(":", "")
+        self.container_name = f"{Config.uvr5_worker_container_prefix}{tag}"
+        self.socket_path: Path = Config.dirs["TRAIN_ROOT"] / ".uvr5" / f"{tag}.sock"
+        # 有設定本地替身指令就唔經 Docker (測試 / 冇 Docker 嘅環境)
+        self.local = Config.uvr5_worker_cmd is not None
+        self.process: Optional[subprocess.Popen] = None
+        # 一個 worker 同一時間只處理一個 job
+        self._job_lock = threading.Lock()
+
+    @staticmethod
+    def get(device: Optional[str] = None) -> "UVR5WorkerClient":
+        if device is None:
+            device, _ = Tools.get_best_device()
+        with UVR5WorkerClient._clients_lock:
+            client = UVR5WorkerClient._clients.get(device)
+            if client is None:
+                client = UVR5WorkerClient(device)
+                UVR5WorkerClient._clients[device] = client
+            return client
+
+    def map_path(self, path: Path) -> str:
+        """將 host 路徑轉做 worker 睇到嘅路徑"""
+        if self.local:
+            return str(path)
+        return str(path).replace(str(Config.dirs["DATA_ROOT"]), str(Config.docker_root))
+
+    # --- Worker 生命週期 ---
+
+    def _connect(self) -> Optional[socket.socket]:
+        if not self.socket_path.exists():
+            return None
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(str(self.socket_path))
+            return sock
+        except OSError:
+            sock.close()
+            return None
+
+    def _launch(self) -> bool:
+        self.socket_path.parent.mkdir(parents=True, exist_ok=True)
+        serve_args = [
+            "--socket",
+            self.map_path(self.socket_path),
+            "--idle_timeout",
+            str(Config.uvr5_worker_idle_timeout),
+        ]
+
+        if self.local:
+            cmd = list(Config.uvr5_worker_cmd) + serve_args
+        else:
+            cmd = ["docker", "run", "-d", "--rm", "--name", self.container_name]
+            if "cuda" in self.device:
+                cmd.extend(["--gpus", f"device={self.device.split(':')[-1]}"])
+            cmd.extend(
+                [
+                    "-e",
+                    "PYTHONPATH=/app:/app/uvr5",
+                    "-v",
+                    f"{Config.dirs['DATA_ROOT']}:{Config.docker_root}",
+                    Config.docker_imgs["UVR5"],
+                    "--serve",
+                ]
+                + serve_args
+            )
+
+        logging.info(f"[uvr5-worker] 🚀 啟動常駐 worker ({self.device})...")
+        try:
+            if self.local:
+                self.process = subprocess.Popen(cmd)
+            else:
+                # container 名撞咗代表已經有 worker 啟動緊，照等 socket 就得
+                subprocess.run(cmd, capture_output=True, text=True)
+        except Exception as e:
+            logging.error(f"[uvr5-worker] 💥 啟動 worker 失敗: {e}")
+            return False
+
+        deadline = time.time() + Config.uvr5_worker_start_timeout
+        while time.time() < deadline:
+            sock = self._connect()
+            if sock is not None:
+                sock.close()
+                logging.info(f"[uvr5-worker] ✅ worker 就緒: {self.socket_path}")
+                return True
+            if self.process is not None and self.process.poll() is not None:
+                break
+            time.sleep(0.5)
+
+        logging.error(f"[uvr5-worker] ❌ worker 喺 {Config.uvr5_worker_start_timeout}s 內未就緒")
+        return False
+
+    # --- Job ---
+
+    def run_job(self, task_type: str, files: list[dict], model_name: Optional[str] = None) -> Optional[bool]:
+        """
+        將一批檔案交畀 worker 處理。
+        :param files: [{"file_path", "vocal_dir", "inst_dir", "probe_info"}]，路徑用 host 路徑
+        回傳: True/False = job 成功/失敗；None = worker 用唔到 (caller 應退返一次性模式)
+        """
+        with self._job_lock:
+            sock = self._connect()
+            if sock is None:
+                launched_at = time.time()
+                if not self._launch():
+                    return None
+                Metrics.record_stage("container_start", time.time() - launched_at)
+                sock = self._connect()
+                if sock is None:
+                    return None
+
+            request = {
+                "task_type": task_type,
+                "model_name": model_name,
+                "files": [
+                    {
+                        **item,
+                        "file_path": self.map_path(item["file_path"]),
+                        "vocal_dir": self.map_path(item["vocal_dir"]),
+                        "inst_dir": self.map_path(item["inst_dir"]),
+                    }
+                    for item in files
+                ],
+            }
+
+            with sock:
+                reader = sock.makefile("r", encoding="utf-8")
+                sock.sendall((json.dumps(request, ensure_ascii=False) + "\n").encode("utf-8"))
+
+                success = None
+                for line in reader:
+                    event = json.loads(line)
+                    name = event.get("event")
+                    if name == "progress":
+                        logging.info(
+                            f"[uvr5-worker] ⏳ ({event['index'] + 1}/{event['total']}) {Path(event['file_path']).name}"
+                        )
+                    elif name == "file_done":
+                        status = "✅" if event["success"] else f"❌ {event.get('error') or ''}"
+                        logging.info(
+                            f"[uvr5-worker] {status} {Path(event['file_path']).name} ({event['elapsed']}s)"
+                        )
+                    elif name == "metric":
+                        # worker 報上嚟嘅模型載入 / 運算耗時同資源峰值
+                        event.pop("event")
+                        Metrics.ingest(event)
+                    elif name == "finished":
+                        success = bool(event["success"])
+                        break
+                reader.close()
+
+            if success is None:
+                # 連線中途斷咗 (worker 崩潰)，由 caller 決定點處理
+                logging.error("[uvr5-worker] 💥 worker 連線中斷，job 未完成")
+                return False
+            return success